@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""
+TITLE:  benchmark
+AUTHOR: Ranomier (ranomier@fragomat.net), F4EXB (f4exb06@gmail.com)
+DESC:   Measure the CPU cost of pipeline stages on synthetic audio.
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import numpy as np
+
+# fmt: off
+from mumblebridge import (Pipeline, VoxGate, Volume, LevelMeter, ToneDecoder, AudioFile, VadGate, StatsMeter, Scheduler, Hang,
+                          QueueSource, DriftEstimator, DriftCompensator)
+# fmt: on
+
+SAMPLERATE = 48000
+
+# fmt: off
+STAGES = {
+    "meter": lambda: LevelMeter(),
+    "volume": lambda: Volume(0.8),
+    "vox": lambda: VoxGate(1000, 1),
+    "vad": lambda: VadGate(1000, 1),
+    "tones": lambda: ToneDecoder(100.0, {"*12#": {"command": "status"}}),
+    "stats": lambda: StatsMeter(),
+}
+# fmt: on
+
+
+def synthetic_audio(seconds, seed=0):
+    """Test signal over a 100 Hz CTCSS tone and background noise: a DTMF sequence, then 2 seconds of voice like
+    harmonic sound every 4 seconds with static crashes in between"""
+    rng = np.random.default_rng(seed)
+    length = int(seconds * SAMPLERATE)
+    t = np.arange(length) / SAMPLERATE
+    audio = 300 * np.sin(2 * np.pi * 100 * t) + 30 * rng.standard_normal(length)
+    talking = np.floor(t / 2) % 2 == 1
+    audio += talking * speech(seconds)[:length]
+    for crash in np.flatnonzero(~talking[:: SAMPLERATE * 7 // 10]) * (SAMPLERATE * 7 // 10):
+        audio[crash : crash + SAMPLERATE // 200] += 10000 * rng.standard_normal(len(audio[crash : crash + SAMPLERATE // 200]))
+    for index, (low, high) in enumerate(((941, 1209), (697, 1209), (697, 1336), (941, 1477))):  # *12#
+        start, stop = int((0.1 + 0.2 * index) * SAMPLERATE), int((0.2 + 0.2 * index) * SAMPLERATE)
+        audio[start:stop] = 4000 * (np.sin(2 * np.pi * low * t[start:stop]) + np.sin(2 * np.pi * high * t[start:stop]))
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+
+def speech(seconds, amplitude=3000):
+    """Voice like harmonic sound with a pitch moving between 100 and 140 Hz, 6 syllables per second"""
+    t = np.arange(int(seconds * SAMPLERATE)) / SAMPLERATE
+    pitch = 2 * np.pi * np.cumsum(120 + 20 * np.sin(2 * np.pi * 0.5 * t)) / SAMPLERATE
+    voice = sum(np.sin(harmonic * pitch) / harmonic for harmonic in range(1, 20))
+    return amplitude * np.abs(np.sin(2 * np.pi * 3 * t)) * voice
+
+
+def tone(seconds, frequency, amplitude=300):
+    """Sine wave"""
+    return amplitude * np.sin(2 * np.pi * frequency * np.arange(int(seconds * SAMPLERATE)) / SAMPLERATE)
+
+
+def voiced(seconds, amplitude=3000, pitch=120):
+    """Steady voice like harmonic sound"""
+    t = np.arange(int(seconds * SAMPLERATE)) / SAMPLERATE
+    return amplitude * sum(np.sin(2 * np.pi * harmonic * pitch * t) / harmonic for harmonic in range(1, 20)) / 2
+
+
+def noise(seconds, amplitude=30, seed=0):
+    """Background noise"""
+    return amplitude * np.random.default_rng(seed).standard_normal(int(seconds * SAMPLERATE))
+
+
+def pushed_frames(stage, audio, packet_length=0.02):
+    """Push the audio through a pipeline made of the stage, yielding each processed frame"""
+    pipeline = Pipeline(stage.name, None, [stage])
+    chunk = int(packet_length * SAMPLERATE)
+    audio = np.clip(audio, -32768, 32767).astype(np.int16)
+    for index, offset in enumerate(range(0, len(audio) - chunk + 1, chunk)):
+        frame = pipeline.frame.load(audio[offset : offset + chunk].tobytes())
+        frame.timestamp = index * packet_length
+        yield pipeline.process(frame)
+
+
+def active_frames(stage, audio, packet_length=0.02):
+    """Active flag of each frame of the audio pushed through a pipeline made of the stage"""
+    return np.array([frame.active for frame in pushed_frames(stage, audio, packet_length)])
+
+
+def tone_frames(ctcss_tone, audio):
+    """CTCSS tone_present of each 20 ms frame of the audio after the first second"""
+    decoder = ToneDecoder(ctcss_tone)
+    return np.array([decoder.tone_present for _ in pushed_frames(decoder, audio)])[50:]
+
+
+def check_vad_floor():
+    """The VAD noise floor follows the background noise heard before the voice"""
+    flags = active_frames(VadGate(1000, 0), np.concatenate((noise(2), voiced(8) + noise(8))))
+    sent = flags[100:].mean()
+    return sent > 0.9, f"{100 * sent:.0f}% of steady voice frames sent after 2 s of noise"
+
+
+def check_ctcss_voice():
+    """Voice pitch without a tone does not open the CTCSS squelch"""
+    seen = max(tone_frames(ctcss_tone, speech(20) + noise(20)).mean() for ctcss_tone in (100.0, 136.5))
+    return seen < 0.01, f"tone seen in {100 * seen:.1f}% of voice frames without tone"
+
+
+def check_ctcss_tone():
+    """The CTCSS tone is seen alone and under voice 20 dB louder"""
+    alone = tone_frames(100.0, tone(5, 100.0) + noise(5)).mean()
+    under = tone_frames(100.0, tone(20, 100.0) + speech(20) + noise(20)).mean()
+    return alone == 1 and under > 0.5, f"tone seen in {100 * alone:.0f}% of frames alone, {100 * under:.0f}% under voice"
+
+
+def check_dtmf_packet_lengths():
+    """The 100 ms digits of the test signal are decoded whatever the packet length"""
+    missed = []
+    for packet_length in (0.01, 0.02, 0.04, 0.06):
+        commands = []
+        decoder = ToneDecoder(commands={"*12#": "status"}, on_command=commands.append)
+        for _ in pushed_frames(decoder, synthetic_audio(2), packet_length):
+            pass
+        if commands != ["status"]:
+            missed.append(f"{packet_length * 1000:.0f} ms")
+    return not missed, f"*12# missed with {', '.join(missed)} packets" if missed else "*12# decoded with 10 to 60 ms packets"
+
+
+def simulate_drift(ppm, seconds, prebuffer_packets=2, packet_length=0.02):
+    """Simulated time of a sender ppm faster than the sound card feeding the receive jitter buffer with drift
+    compensation. The card plays from a two packet buffer. Returns the drift estimate and the number of times
+    the card ran dry in the second half of the run"""
+    clock = [0.0]
+    estimator = DriftEstimator()
+    source = QueueSource(prebuffer_packets * packet_length, drift=estimator, clock=lambda: clock[0])
+    pipeline = Pipeline("output", source, [DriftCompensator(estimator)])
+    chunk = int(packet_length * SAMPLERATE)
+    pcm = np.zeros(chunk, dtype=np.int16).tobytes()
+    interval = packet_length / (1 + ppm * 1e-6)
+    arrival, now, card, underruns, waiting = 0.0, 0.0, 0.0, 0, True
+    while now < seconds:
+        write_ts = np.inf if waiting else now + max(0.0, (card - chunk) / SAMPLERATE)  # a packet fits in the card buffer
+        if arrival <= write_ts:
+            card -= (arrival - now) * SAMPLERATE
+            if card < 0:
+                underruns += now > seconds / 2
+                card = 0.0
+            now, arrival = arrival, arrival + interval
+            source.put(pcm)
+            waiting = waiting and source.depth() < source.prebuffer - 1e-9
+            continue
+        card -= (write_ts - now) * SAMPLERATE
+        now = clock[0] = write_ts
+        frame = pipeline.run_once()
+        if frame is None:
+            waiting = True
+        else:
+            card += frame.length
+    return estimator.ppm, underruns
+
+
+def check_drift():
+    """Half an hour of received sound with the sender faster or slower than the sound card"""
+    results = [(ppm, *simulate_drift(ppm, 1800)) for ppm in (50, 200, -300)]
+    passed = all(abs(estimate - ppm) < 5 and underruns == 0 for ppm, estimate, underruns in results)
+    return passed, ", ".join(f"{ppm:+d} ppm estimated {estimate:+.1f} with {underruns} underruns" for ppm, estimate, underruns in results)
+
+
+CHECKS = [check_vad_floor, check_ctcss_voice, check_ctcss_tone, check_dtmf_packet_lengths, check_drift]
+
+
+def run_checks():
+    """Run the detection checks. Returns the number of failures"""
+    failures = 0
+    for check in CHECKS:
+        passed, detail = check()
+        failures += not passed
+        print(f"{'ok  ' if passed else 'FAIL'} {check.__name__}: {detail}")
+    return failures
+
+
+def polling_timers(hang, late):
+    """Idle loops of the bots before the scheduler: audio polled every 5 ms and the PTT hang checked every 100 ms.
+    Returns the function called on sound and the function stopping the loops"""
+    running = [True]
+    receive_ts = [None]
+
+    def audio_loop():
+        while running[0]:
+            time.sleep(0.005)
+
+    def ptt_loop():
+        while running[0]:
+            if receive_ts[0] is not None and time.monotonic() > receive_ts[0] + hang:
+                late.append(time.monotonic() - receive_ts[0] - hang)
+                receive_ts[0] = None
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=audio_loop, daemon=True), threading.Thread(target=ptt_loop, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    def touch():
+        receive_ts[0] = time.monotonic()
+
+    def stop():
+        running[0] = False
+        for thread in threads:
+            thread.join()
+
+    return touch, stop
+
+
+def scheduler_timers(hang, late):
+    """Idle loops of the bots with the scheduler: a PTT Hang and the 60 s status timer.
+    Returns the function called on sound and the function stopping the loops"""
+    scheduler = Scheduler()
+    ptt_hang = Hang(scheduler, hang, lambda: late.append(time.monotonic() - ptt_hang.last - hang))
+    scheduler.every(60, lambda: None)
+    scheduler.start()
+    return ptt_hang.touch, scheduler.stop
+
+
+def run_timers(start_timers, seconds, hang=0.2):
+    """Run idle timer loops with a talker keying PTT at random times about every second. Returns the CPU time
+    per second of run and the PTT off lateness after the hang deadline"""
+    rng = np.random.default_rng(0)
+    late = []
+    touch, stop = start_timers(hang, late)
+    start, cpu = time.monotonic(), time.process_time()
+    while time.monotonic() < start + seconds:
+        touch()
+        time.sleep(rng.uniform(0.5, 1.5))
+    cpu = (time.process_time() - cpu) / (time.monotonic() - start)
+    stop()
+    return cpu, np.array(late or [0.0])
+
+
+def run_stage(name, audio, packet_length):
+    """Push the audio through a pipeline made of the stage. Returns the timing and the number of active frames"""
+    pipeline = Pipeline(name, None, [STAGES[name]()])
+    chunk = int(packet_length * SAMPLERATE)
+    active = 0
+    for index, offset in enumerate(range(0, len(audio) - chunk + 1, chunk)):
+        frame = pipeline.frame.load(audio[offset : offset + chunk].tobytes())
+        frame.timestamp = index * packet_length
+        if pipeline.process(frame).active:
+            active += 1
+    timing = next(iter(pipeline.timings().values()))
+    return timing, active
+
+
+def main():
+    """Run the benchmark of each requested stage"""
+    parser = argparse.ArgumentParser(description="Measure the CPU cost of pipeline stages")
+    # fmt: off
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help=f"Stages to measure among {', '.join(sorted(STAGES))}. Default all")
+    parser.add_argument("-t", "--time", dest="seconds", type=float, default=None,
+                        help="Length of the test signal in seconds. Default 60, 10 with --timers")
+    parser.add_argument("-i", "--input", dest="input_path", type=str, default=None,
+                        help="16 bit mono 48 kHz WAV or raw file to use instead of the test signal")
+    parser.add_argument("-s", "--setpacketlength", dest="packet_length", type=float, default=0.02,
+                        help="Length of audio packet in seconds. Default 0.02")
+    parser.add_argument("-c", "--check", dest="check", action="store_true",
+                        help="Check the detection of the stages on synthetic signals instead of measuring them")
+    parser.add_argument("-T", "--timers", dest="timers", action="store_true",
+                        help="Measure the idle CPU and the PTT hang lateness of polling loops and of the scheduler")
+    # fmt: on
+    args = parser.parse_args()
+    if args.check:
+        return 1 if run_checks() else 0
+    if args.timers:
+        print(f"{'timers':10} {'CPU ms/s':>10} {'late mean ms':>13} {'late max ms':>12}")
+        for name, start_timers in (("polling", polling_timers), ("scheduler", scheduler_timers)):
+            cpu, late = run_timers(start_timers, args.seconds or 10)
+            print(f"{name:10} {cpu * 1000:10.3f} {late.mean() * 1000:13.2f} {late.max() * 1000:12.2f}")
+        return 0
+    for name in args.stages:
+        if name not in STAGES:
+            parser.error(f"unknown stage {name}")
+    audio = synthetic_audio(args.seconds or 60) if args.input_path is None else AudioFile(args.input_path).samples
+    print(f"{'stage':10} {'frames':>8} {'active':>8} {'mean us':>10} {'peak us':>10} {'% of real time':>15}")
+    for name in args.stages or sorted(STAGES):
+        timing, active = run_stage(name, audio, args.packet_length)
+        mean = timing.total / timing.count
+        print(f"{name:10} {timing.count:8d} {active:8d} {mean * 1e6:10.1f} {timing.peak * 1e6:10.1f} {100 * mean / args.packet_length:15.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+""" Audio engine shared by mumblestream and mumblelistener """
+from .runner import Status, Runner, MumbleRunner
+from .connection import prepare_mumble
+from .devices import AudioDevices
+from .latency import LatencyTuner, FixedLatency, chunk_frames, validate_packet_length, set_packet_length
+from .pipeline import Frame, Source, Processor, Sink, Pipeline
+from .stages import PyAudioSource, PyAudioSink, MumbleSink, FifoSource, QueueSource, MumbleMixSource, VoxGate, Volume, LevelMeter, Mute
+from .routing import Router
+from .recorder import Recorder, RecorderTap, make_recorder
+from .control import ControlServer, Parameter, execute
+from .ptt import PttController, make_ptt, swap_ptt
+from .reload import ConfigWatcher
+from .tones import ToneDecoder
+from .drift import DriftEstimator, DriftCompensator
+from .backlog import SendBacklog, validate_backlog_policy
+from .fanout import FanoutSink
+from .playback import AudioFile, FileSource, Announcement, Playback
+from .vad import VadGate
+from .duplex import DuplexState, DuplexGate, PlayoutRing, RingTap, EchoCanceller, validate_duplex_mode
+from .stats import StreamStats, StatsMeter
+from .scheduler import Scheduler, Timer, Hang
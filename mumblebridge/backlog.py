@@ -0,0 +1,106 @@
+""" Latency budget of the pymumble send queue
+
+pymumble sends queued sound at real time pace and never catches up: sound queued during a network stall or
+faster than real time stays in the queue and delays everything that follows. SendBacklog keeps the queue
+within a latency budget with one of the policies:
+
+- drop: drop the oldest queued packets
+- skip_silence: do not queue frames below the silence threshold, drop the oldest packets beyond twice the budget
+- compress: remove one pitch period from each frame, drop the oldest packets beyond twice the budget
+- wait: block the caller until the queue is back within budget. For sources that can be paused such as FIFOs
+"""
+import logging
+import time
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+LOG = logging.getLogger(__name__)
+
+POLICIES = ("drop", "skip_silence", "compress", "wait")
+SAMPLERATE = pymumble.constants.PYMUMBLE_SAMPLERATE
+# Pitch periods searched by compress_frame (400 Hz to 62.5 Hz)
+MIN_PERIOD = SAMPLERATE // 400
+MAX_PERIOD = SAMPLERATE * 16 // 1000
+
+
+def compress_frame(frame):
+    """Shorten a frame by the pitch period that best matches it cross-fading the frame with itself. Returns the removed samples count"""
+    length = frame.length
+    max_period = min(MAX_PERIOD, length // 2)
+    if max_period <= MIN_PERIOD:
+        return 0
+    samples = frame.data.astype(np.float32)
+    spectrum = np.fft.rfft(samples, 2 * length)
+    correlation = np.fft.irfft(spectrum * np.conj(spectrum), 2 * length)[: max_period + 1]
+    energy = np.cumsum(samples * samples)
+    head_energy = energy[length - 1 - np.arange(max_period + 1)]  # energy of samples[: length - period]
+    tail_energy = energy[-1] - np.concatenate(([0], energy[:max_period]))  # energy of samples[period:]
+    score = correlation / np.sqrt(np.maximum(head_energy * tail_energy, 1))
+    period = MIN_PERIOD + int(np.argmax(score[MIN_PERIOD:]))
+    kept = length - period
+    fade = np.linspace(0, 1, kept, dtype=np.float32)
+    output = samples[:kept] + fade * (samples[period:] - samples[:kept])
+    frame.samples[:kept] = np.rint(output)
+    frame.length = kept
+    return period
+
+
+def validate_backlog_policy(policy):
+    """Return the policy if it is known else raise ValueError"""
+    if policy not in POLICIES:
+        raise ValueError(f"send backlog policy must be one of {', '.join(POLICIES)}")
+    return policy
+
+
+class SendBacklog:
+    """Queues frames to the pymumble sound output within a latency budget in seconds and counts what was lost"""
+
+    def __init__(self, budget=0.5, policy="drop", silence_threshold=1000, wait_interval=0.01):
+        self.budget = budget
+        self.policy = validate_backlog_policy(policy)
+        self.silence_threshold = silence_threshold
+        self.wait_interval = wait_interval
+        self.dropped = 0.0
+        self.skipped = 0.0
+        self.compressed = 0.0
+        self.waited = 0.0
+
+    def queue(self, sound_output, frame):
+        """Queue the frame sound to the pymumble sound output"""
+        if self.admit(sound_output.get_buffer_size, frame):
+            sound_output.add_sound(frame.tobytes())
+        self.trim(sound_output)
+
+    def admit(self, depth, frame):
+        """Apply the policy to a frame about to be queued given a function returning the queue depth. Returns False if the frame must be skipped"""
+        if depth() + frame.duration <= self.budget:
+            return True
+        if self.policy == "wait":
+            start = time.time()
+            while 0 < depth() > self.budget - frame.duration:
+                time.sleep(self.wait_interval)
+            self.waited += time.time() - start
+        elif self.policy == "skip_silence" and frame.peak() < self.silence_threshold:
+            self.skipped += frame.duration
+            return False
+        elif self.policy == "compress":
+            self.compressed += compress_frame(frame) / SAMPLERATE
+        return True
+
+    def trim(self, sound_output):
+        """Drop the oldest queued packets of a sound output beyond the policy limit"""
+        limit = self.budget if self.policy in ("drop", "wait") else 2 * self.budget
+        with sound_output.lock:
+            depth = sound_output.get_buffer_size()
+            if depth <= limit:
+                return
+            dropped = depth
+            while sound_output.pcm and sound_output.get_buffer_size() > limit:
+                sound_output.pcm.pop(0)
+            dropped -= sound_output.get_buffer_size()
+        self.dropped += dropped
+        LOG.debug("send queue over budget: dropped %.3fs", dropped)
+
+    def __repr__(self):
+        return f"budget: {self.budget}s policy: {self.policy} dropped: {self.dropped:.2f}s skipped: {self.skipped:.2f}s compressed: {self.compressed:.2f}s waited: {self.waited:.2f}s"
@@ -0,0 +1,32 @@
+""" Mumble server connection """
+import logging
+
+import pymumble_py3 as pymumble
+
+LOG = logging.getLogger(__name__)
+
+
+def prepare_mumble(host, user, password="", certfile=None, codec_profile="audio", bandwidth=96000, channel=None, application="mumblestream", receive_sound=True):
+    """Will configure the pymumble object and return it"""
+
+    try:
+        mumble = pymumble.Mumble(host, user, certfile=certfile, password=password)
+    except Exception as ex:
+        LOG.error("cannot commect to %s: %s", host, ex)
+        return None
+
+    mumble.set_application_string(application)
+    mumble.set_codec_profile(codec_profile)
+    mumble.set_receive_sound(1 if receive_sound else 0)  # Enable receiving sound from mumble server
+    mumble.start()
+    mumble.is_ready()
+    mumble.set_bandwidth(bandwidth)
+    if channel:
+        try:
+            mumble.channels.find_by_name(channel).move_in()
+        except pymumble.channels.UnknownChannelError as ex:
+            LOG.warning("tried to connect to channel: '%s' exception %s", channel, ex)
+            LOG.info("Available Channels:")
+            LOG.info(mumble.channels)
+            return None
+    return mumble
@@ -0,0 +1,153 @@
+""" Local UNIX socket control of a running bot
+
+The protocol is one JSON object per line in each direction. Requests have a "command" key and replies have
+an "ok" key with either a "result" or an "error" key. Commands are:
+
+- {"command": "status"}: thread status, per stage timings, latency, send backlog, clock drift, duplex turnaround and audio statistics
+- {"command": "levels"}: last frame levels of each pipeline
+- {"command": "stats"}: running statistics of each pipeline and of each talker
+- {"command": "get", "name": name}: value of a parameter, all parameters if name is omitted
+- {"command": "set", "name": name, "value": value}: change a parameter between two frames
+- {"command": "channel", "name": name}: move to another channel
+- {"command": "play", "name": path, "value": loop}: play a file into the input, stop playing if path is omitted
+
+The same requests can be executed from other sources (DTMF commands) with execute().
+"""
+import json
+import logging
+import os
+import socketserver
+import threading
+
+from .playback import AudioFile
+
+LOG = logging.getLogger(__name__)
+
+
+class Parameter:
+    """Runtime adjustable stage attribute. Changes are applied by the pipeline between two frames
+
+    linked is a list of (stage, attribute) pairs of the same pipeline that are set to the same value.
+    """
+
+    def __init__(self, pipeline, stage, attribute, kind=float, linked=()):
+        self.pipeline = pipeline
+        self.stage = stage
+        self.attribute = attribute
+        self.kind = kind
+        self.linked = [(stage, attribute)] + list(linked)
+
+    def get(self):
+        """Current value"""
+        return getattr(self.stage, self.attribute)
+
+    def set(self, value):
+        """Convert and queue the new value. Returns the converted value"""
+        if self.kind is bool and isinstance(value, str):
+            value = value.lower() in ("1", "true", "on", "yes")
+        value = self.kind(value)
+
+        def change():
+            for stage, attribute in self.linked:
+                setattr(stage, attribute, value)
+
+        self.pipeline.apply(change)
+        return value
+
+
+def _parameter(runner, name):
+    """Parameter by name"""
+    if name not in runner.parameters:
+        raise KeyError(f"unknown parameter {name}")
+    return runner.parameters[name]
+
+
+def execute(runner, request):
+    """Execute a control request on a MumbleRunner and return its result"""
+    command = request.get("command")
+    if command == "status":
+        # fmt: off
+        return {
+            "threads": repr(runner.status()),
+            "timings": runner.timings(),
+            "latency": repr(getattr(runner, "latency", None)),
+            "backlog": repr(getattr(runner, "backlog", None)),
+            "drift": {name: repr(estimator) for name, estimator in getattr(runner, "drift", {}).items()},
+            "duplex": repr(getattr(runner, "duplex", None)),
+            "stats": runner.stats(),
+        }
+        # fmt: on
+    if command == "levels":
+        return runner.levels()
+    if command == "stats":
+        return runner.stats()
+    if command == "get":
+        if request.get("name") is None:
+            return {name: parameter.get() for name, parameter in runner.parameters.items()}
+        return _parameter(runner, request["name"]).get()
+    if command == "set":
+        value = _parameter(runner, request["name"]).set(request["value"])
+        if request["name"] in runner.config:
+            runner.config[request["name"]] = value
+        LOG.info("control: %s set to %s", request["name"], value)
+        return value
+    if command == "channel":
+        runner.mumble.channels.find_by_name(request["name"]).move_in()
+        LOG.info("control: moved to channel %s", request["name"])
+        return request["name"]
+    if command == "play":
+        playback = getattr(runner, "playback", None)
+        if playback is None:
+            raise ValueError("playback is not available")
+        if request.get("name") is None:
+            runner.pipelines["input"].apply(playback.stop)
+            LOG.info("control: playback stopped")
+            return None
+        audio_file = AudioFile(request["name"])
+        runner.pipelines["input"].apply(lambda: playback.play(audio_file, bool(request.get("value"))))
+        LOG.info("control: playing %s", request["name"])
+        return audio_file.duration
+    raise ValueError(f"unknown command {command}")
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """Handles the requests of one client connection"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                reply = {"ok": True, "result": self.server.execute(request)}
+            except Exception as ex:
+                reply = {"ok": False, "error": str(ex)}
+            self.wfile.write(json.dumps(reply, default=str).encode("utf-8") + b"\n")
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """UNIX socket server controlling a MumbleRunner"""
+
+    daemon_threads = True
+
+    def __init__(self, path, runner):
+        self.path = path
+        self.runner = runner
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, ControlHandler)
+        os.chmod(path, 0o660)
+        self.__thread = threading.Thread(name="control", target=self.serve_forever, daemon=True)
+        self.__thread.start()
+        LOG.info("control socket listening on %s", path)
+
+    def execute(self, request):
+        """Execute a request and return its result"""
+        return execute(self.runner, request)
+
+    def close(self):
+        """Stop serving and remove the socket"""
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
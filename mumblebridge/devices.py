@@ -0,0 +1,133 @@
+""" PyAudio device handling with optional Pulseaudio routing """
+import logging
+
+import pyaudio
+import pymumble_py3 as pymumble
+
+from .pulseaudio import PulseAudioHandler
+
+LOG = logging.getLogger(__name__)
+
+
+class AudioDevices:
+    """PyAudio devices of the host. Streams can be rerouted to Pulseaudio devices"""
+
+    def __init__(self, name):
+        self.name = name
+        self.pa = pyaudio.PyAudio()
+        self.__pulse = None
+        self.input_device_names, self.output_device_names = self.__scan_devices(self.pa)
+
+    @property
+    def pulse(self):
+        """Pulseaudio handler created on first use"""
+        if self.__pulse is None:
+            self.__pulse = PulseAudioHandler(self.name)
+        return self.__pulse
+
+    @staticmethod
+    def __scan_devices(pa):
+        """Scan audio devices handled by PyAudio"""
+        info = pa.get_host_api_info_by_index(0)
+        numdevices = info.get("deviceCount")
+        input_device_names = {}
+        output_device_names = {}
+        for i in range(0, numdevices):
+            if pa.get_device_info_by_host_api_device_index(0, i).get("maxInputChannels") > 0:
+                device_info = pa.get_device_info_by_host_api_device_index(0, i)
+                input_device_names[device_info["name"]] = device_info["index"]
+            if pa.get_device_info_by_host_api_device_index(0, i).get("maxOutputChannels") > 0:
+                device_info = pa.get_device_info_by_host_api_device_index(0, i)
+                output_device_names[device_info["name"]] = device_info["index"]
+        LOG.debug("input: %s", input_device_names)
+        LOG.debug("output: %s", output_device_names)
+        return input_device_names, output_device_names
+
+    def get_input_index(self, pyaudio_name, pulse_name):
+        """Returns the PyAudio index of input device or None if no default"""
+        if pulse_name is not None:
+            pyaudio_name = "pulse"
+        return self.input_device_names.get(pyaudio_name or "default")
+
+    def get_output_index(self, pyaudio_name, pulse_name):
+        """Returns the PyAudio index of output device or None if no default"""
+        if pulse_name is not None:
+            pyaudio_name = "pulse"
+        return self.output_device_names.get(pyaudio_name or "default")
+
+    def open_input(self, index, frames_per_buffer):
+        """Open an input stream on the device with the given PyAudio index"""
+        stream = self.pa.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=pymumble.constants.PYMUMBLE_SAMPLERATE,
+            input=True,
+            frames_per_buffer=frames_per_buffer,
+            input_device_index=index,
+        )
+        LOG.debug("input stream opened with %d frames per buffer", frames_per_buffer)
+        return stream
+
+    def open_output(self, index, frames_per_buffer):
+        """Open an output stream on the device with the given PyAudio index"""
+        stream = self.pa.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=pymumble.constants.PYMUMBLE_SAMPLERATE,
+            output=True,
+            frames_per_buffer=frames_per_buffer,
+            output_device_index=index,
+        )
+        LOG.debug("output stream opened with %d frames per buffer", frames_per_buffer)
+        return stream
+
+    def open_output_pulseaudio(self, output_pulse_name, frames_per_buffer):
+        """Open an output stream on the pulse device and move only this stream to the given pulseaudio sink"""
+        index = self.get_output_index(None, output_pulse_name)
+        if index is None:
+            LOG.error("cannot find PyAudio pulse output device")
+            return None
+        return self.open_output_moved(index, frames_per_buffer, output_pulse_name)
+
+    def open_output_moved(self, index, frames_per_buffer, output_pulse_name):
+        """Open an output stream on the device with the given PyAudio index and move only this stream to the given
+        pulseaudio sink. The new sink input is found by comparing the sink inputs of the process before and after"""
+        pulse_sink_index = self.pulse.get_sink_index(output_pulse_name)
+        own_sink_inputs = self.pulse.list_own_sink_input_indexes()
+        stream = self.open_output(index, frames_per_buffer)
+        new_sink_inputs = self.pulse.list_own_sink_input_indexes() - own_sink_inputs
+        if pulse_sink_index is None or len(new_sink_inputs) != 1:
+            LOG.warning("cannot move new pulseaudio sink input to sink %s", output_pulse_name)
+        else:
+            pulse_sink_input_index = new_sink_inputs.pop()
+            try:
+                self.pulse.move_sink_input(pulse_sink_input_index, pulse_sink_index)
+                LOG.debug("moved pulseaudio sink input %d to sink %d", pulse_sink_input_index, pulse_sink_index)
+            except Exception as ex:
+                LOG.error("exception assigning pulseaudio sink: %s", ex)
+        return stream
+
+    def move_input_pulseaudio(self, input_pulse_name):
+        """Moves the input to the given pulseaudio device"""
+        pulse_source_index = self.pulse.get_source_index(input_pulse_name)
+        pulse_source_output_index = self.pulse.get_own_source_output_index()
+        if pulse_source_index is None or pulse_source_output_index is None:
+            LOG.warning("cannot move source output %s to source %s", pulse_source_output_index, pulse_source_index)
+        else:
+            try:
+                self.pulse.move_source_output(pulse_source_output_index, pulse_source_index)
+                LOG.debug("moved pulseaudio source output %d to source %d", pulse_source_output_index, pulse_source_index)
+            except Exception as ex:
+                LOG.error("exception assigning pulseaudio source: %s", ex)
+
+    def mute_output_pulseaudio(self, mute=True):
+        """Mutes or unmutes the output pulseaudio sink input"""
+        pulse_sink_input_index = self.pulse.get_own_sink_input_index()
+        if pulse_sink_input_index is None:
+            LOG.warning("cannot mute pulseaudio sink input")
+        else:
+            try:
+                self.pulse.mute_sink_input(pulse_sink_input_index, mute)
+                LOG.debug("muted pulseaudio sink input %d: %s", pulse_sink_input_index, mute)
+            except Exception as ex:
+                LOG.error("exception muting pulseaudio sink input %d: %s", pulse_sink_input_index, ex)
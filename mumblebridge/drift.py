@@ -0,0 +1,99 @@
+""" Clock drift compensation between Mumble and sound card clocks
+
+The producer and the consumer of a buffer run on different clocks (a remote sender and our sound card, our
+sound card and the pymumble send timer). A small rate difference makes the buffer fill grow or shrink without
+bound. DriftEstimator follows the buffer fill error with a proportional-integral loop. Its integral converges
+to the rate difference and is kept between talk spurts. DriftCompensator resamples frames by the resulting ratio.
+"""
+import threading
+import time
+
+import numpy as np
+
+from .pipeline import Processor, FRAME_MAX_SAMPLES
+
+
+class DriftEstimator:
+    """Estimates the rate correction that holds a buffer fill error at zero
+
+    Buffer owners report the fill error in seconds (positive when the buffer holds more than its target). The
+    loop is critically damped with the given time constant in seconds. Corrections are limited to max_ppm.
+    Reports further apart than hold seconds start a new smoothing run but keep the drift estimate.
+    """
+
+    def __init__(self, time_constant=120, smoothing=10, max_ppm=1000, hold=0.5):
+        self.time_constant = time_constant
+        self.smoothing = smoothing
+        self.max_ppm = max_ppm
+        self.hold = hold
+        self.error = 0.0
+        self.drift = 0.0
+        self.correction = 0.0
+        self.__lock = threading.Lock()
+        self.__report_ts = None
+
+    @property
+    def ratio(self):
+        """Output samples per input sample"""
+        return 1 - self.correction
+
+    @property
+    def ppm(self):
+        """Estimated rate difference in parts per million"""
+        return self.drift * 1e6
+
+    def report(self, error, now=None):
+        """Report the buffer fill error in seconds"""
+        now = time.time() if now is None else now
+        limit = self.max_ppm * 1e-6
+        with self.__lock:
+            if self.__report_ts is None or now - self.__report_ts > self.hold:
+                self.error = error
+                self.__report_ts = now
+                return
+            elapsed = now - self.__report_ts
+            self.__report_ts = now
+            self.error += min(elapsed / self.smoothing, 1) * (error - self.error)
+            self.drift = min(max(self.drift + self.error * elapsed / self.time_constant**2, -limit), limit)
+            self.correction = min(max(self.drift + 2 * self.error / self.time_constant, -limit), limit)
+
+    def __repr__(self):
+        return f"drift: {self.ppm:+.1f} ppm error: {self.error * 1000:+.1f} ms"
+
+
+class DriftCompensator(Processor):
+    """Resamples frames by the ratio of a DriftEstimator with linear interpolation
+
+    The interpolation phase and the last sample are carried over from frame to frame so that the output is
+    continuous. Frames pass untouched while the ratio is exactly 1.
+    """
+
+    name = "drift"
+
+    def __init__(self, estimator):
+        self.estimator = estimator
+        self.__position = 1.0
+        self.__samples = np.zeros(FRAME_MAX_SAMPLES + 1, dtype=np.float32)
+
+    def process(self, frame):
+        length = frame.length
+        if length == 0:
+            return
+        ratio = self.estimator.ratio
+        if ratio == 1 and self.__position == 1.0:
+            self.__samples[0] = frame.samples[length - 1]
+            return
+        samples = self.__samples[: length + 1]
+        samples[1:] = frame.data  # samples[0] is the last sample of the previous frame
+        step = 1 / ratio
+        count = min(int((length - self.__position) / step) + 1, len(frame.samples))
+        positions = self.__position + step * np.arange(count)
+        indexes = np.minimum(positions.astype(np.int64), length - 1)
+        fractions = (positions - indexes).astype(np.float32)
+        output = samples[indexes]
+        output += fractions * (samples[indexes + 1] - output)
+        np.rint(output, out=output)
+        frame.samples[:count] = output
+        frame.length = count
+        self.__position = positions[-1] + step - length
+        samples[0] = samples[length]
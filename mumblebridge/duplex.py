@@ -0,0 +1,223 @@
+""" Duplex policy between sound received from Mumble (rx) and sound captured for Mumble (tx)
+
+On a simplex radio the sound played to the transmitter comes back on the capture device. DuplexState gives
+the link to one direction at a time: a direction owns it while its frames flow and for hang seconds after, and
+the rx direction also while PTT is on. DuplexGate stages ask for the link on each active frame and drop the
+frame when the other direction owns it. The time between the last frame of a direction and the first frame of
+the other one is measured as the turnaround latency.
+
+In echo mode both directions flow and EchoCanceller subtracts the played sound, found in a ring buffer filled
+by a RingTap on the output, from the captured sound.
+"""
+import threading
+import time
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+from .pipeline import Processor, Sink, FRAME_MAX_SAMPLES
+
+SAMPLERATE = pymumble.constants.PYMUMBLE_SAMPLERATE
+MODES = ("full", "half", "echo")
+
+
+def validate_duplex_mode(mode):
+    """Return the mode if it is known else raise ValueError"""
+    if mode not in MODES:
+        raise ValueError(f"duplex mode must be one of {', '.join(MODES)}")
+    return mode
+
+
+class Turnaround:
+    """Running statistics of turnaround latencies in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+
+    def add(self, latency):
+        """Add a measure"""
+        self.count += 1
+        self.last = latency
+        self.minimum = latency if self.minimum is None else min(self.minimum, latency)
+        self.maximum = latency if self.maximum is None else max(self.maximum, latency)
+        self.total += latency
+
+    def __repr__(self):
+        if self.count == 0:
+            return "none"
+        return f"last: {self.last:.3f}s min: {self.minimum:.3f}s mean: {self.total / self.count:.3f}s max: {self.maximum:.3f}s count: {self.count}"
+
+
+class DuplexState:
+    """Link ownership between the rx and tx directions. Only the half mode refuses claims"""
+
+    def __init__(self, mode="full", hang=0.3, ptt_on=None):
+        self.mode = validate_duplex_mode(mode)
+        self.hang = hang
+        self.ptt_on = ptt_on
+        self.owner = None
+        self.turnarounds = {"rx_to_tx": Turnaround(), "tx_to_rx": Turnaround()}
+        self.__last = {"rx": 0.0, "tx": 0.0}
+        self.__lock = threading.Lock()
+
+    def busy(self, direction, now):
+        """True if the other direction owns the link"""
+        if self.owner is None or self.owner == direction:
+            return False
+        if self.owner == "rx" and self.ptt_on is not None and self.ptt_on():
+            return True
+        return now < self.__last[self.owner] + self.hang
+
+    def claim(self, direction, now=None):
+        """Claim the link for a frame of the direction ("rx" or "tx"). Returns False if the frame must be dropped"""
+        now = time.time() if now is None else now
+        with self.__lock:
+            if self.mode == "half" and self.busy(direction, now):
+                return False
+            if self.owner is not None and self.owner != direction:
+                self.turnarounds[f"{self.owner}_to_{direction}"].add(now - self.__last[self.owner])
+            self.owner = direction
+            self.__last[direction] = now
+            return True
+
+    def __repr__(self):
+        return f"mode: {self.mode} owner: {self.owner} rx to tx: {self.turnarounds['rx_to_tx']} tx to rx: {self.turnarounds['tx_to_rx']}"
+
+
+class DuplexGate(Processor):
+    """Drops the active frames of a direction while the other direction owns the link
+
+    A dropped frame also closes the optional VOX gate so that the gate does not stay open on the echo. The
+    optional on_claim callback is called for each frame that wins the link, for example to key PTT.
+    """
+
+    name = "duplex"
+
+    def __init__(self, state, direction, gate=None, on_claim=None):
+        self.state = state
+        self.direction = direction
+        self.gate = gate
+        self.on_claim = on_claim
+
+    def process(self, frame):
+        if not frame.active:
+            return
+        if not self.state.claim(self.direction, frame.timestamp):
+            frame.active = False
+            if self.gate is not None:
+                self.gate.is_open = False
+        elif self.on_claim is not None:
+            self.on_claim()
+
+
+class PlayoutRing:
+    """Ring buffer of the last played samples"""
+
+    def __init__(self, seconds=0.5):
+        self.samples = np.zeros(int(seconds * SAMPLERATE), dtype=np.float32)
+        self.index = 0
+        self.__lock = threading.Lock()
+
+    def write(self, data):
+        """Append samples"""
+        with self.__lock:
+            data = data[-len(self.samples) :]
+            end = self.index + len(data)
+            if end <= len(self.samples):
+                self.samples[self.index : end] = data
+            else:
+                split = len(self.samples) - self.index
+                self.samples[self.index :] = data[:split]
+                self.samples[: end - len(self.samples)] = data[split:]
+            self.index = end % len(self.samples)
+
+    def recent(self, count, out):
+        """Copy the last count samples in order into out"""
+        with self.__lock:
+            start = (self.index - count) % len(self.samples)
+            if start + count <= len(self.samples):
+                out[:count] = self.samples[start : start + count]
+            else:
+                split = len(self.samples) - start
+                out[:split] = self.samples[start:]
+                out[split:count] = self.samples[: count - split]
+        return out[:count]
+
+
+class RingTap(Sink):
+    """Writes the played frames to a PlayoutRing. Writes silence for frames that are not played"""
+
+    name = "ring_tap"
+    gated = False
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.__silence = np.zeros(FRAME_MAX_SAMPLES, dtype=np.float32)
+
+    def write(self, frame):
+        self.ring.write(frame.data if frame.active else self.__silence[: frame.length])
+
+
+class EchoCanceller(Processor):
+    """Subtracts the played sound from the captured sound
+
+    The echo delay is searched up to max_delay seconds by cross-correlation of the captured frame with the
+    playout ring, again every search_interval seconds or when the echo stops matching. The aligned reference is
+    subtracted with its least squares gain when it correlates better than min_correlation.
+    """
+
+    name = "echo"
+
+    def __init__(self, ring, max_delay=0.25, min_correlation=0.3, search_interval=1):
+        self.ring = ring
+        self.max_delay = int(max_delay * SAMPLERATE)
+        self.min_correlation = min_correlation
+        self.search_interval = search_interval
+        self.delay = None
+        self.gain = 0.0
+        self.__offset = None
+        self.__search_time = 0.0
+        self.__reference = np.zeros(self.max_delay + FRAME_MAX_SAMPLES, dtype=np.float32)
+
+    def __search(self, reference, captured, captured_energy):
+        """Offset in the reference of the best match of the captured samples and its correlation coefficient"""
+        length = len(captured)
+        size = 1 << (len(reference) + length - 1).bit_length()
+        correlation = np.fft.irfft(np.fft.rfft(reference, size) * np.conj(np.fft.rfft(captured, size)), size)[: self.max_delay + 1]
+        energy = np.cumsum(reference * reference)
+        window_energy = energy[length - 1 : length + self.max_delay] - np.concatenate(([0], energy[: self.max_delay]))
+        score = correlation / np.sqrt(np.maximum(window_energy * captured_energy, 1))
+        offset = int(np.argmax(score))
+        return offset, float(score[offset])
+
+    def process(self, frame):
+        length = frame.length
+        if length == 0:
+            return
+        reference = self.ring.recent(self.max_delay + length, self.__reference)
+        captured = frame.data.astype(np.float32)
+        captured_energy = float(np.dot(captured, captured))
+        if captured_energy == 0:
+            return
+        score = 0.0
+        if self.__offset is not None and self.__search_time < self.search_interval:
+            aligned = reference[self.__offset : self.__offset + length]
+            score = float(np.dot(aligned, captured)) / np.sqrt(max(float(np.dot(aligned, aligned)) * captured_energy, 1))
+        self.__search_time += frame.duration
+        if score < self.min_correlation:
+            self.__offset, score = self.__search(reference, captured, captured_energy)
+            self.__search_time = 0.0
+        if score < self.min_correlation:
+            self.__offset = None
+            self.delay = None
+            return
+        aligned = reference[self.__offset : self.__offset + length]
+        self.delay = (self.max_delay - self.__offset) / SAMPLERATE
+        self.gain = float(np.dot(aligned, captured)) / max(float(np.dot(aligned, aligned)), 1)
+        captured -= self.gain * aligned
+        np.clip(captured, -32768, 32767, out=captured)
+        frame.data[:] = captured
@@ -0,0 +1,194 @@
+""" Encode-once fan-out of one capture to several Mumble connections
+
+pymumble encodes the sound queued to each connection with its own Opus encoder. To feed the same capture to N
+servers or channels FanoutSink encodes each packet once per codec configuration (packet length, bitrate and
+Opus profile) and hands the encoded packets to a PacketSoundOutput installed on every connection. Packets are
+still sent from the pymumble thread of each connection at real time pace.
+"""
+import logging
+import struct
+import socket
+import time
+
+import opuslib
+from pymumble_py3.constants import (
+    PYMUMBLE_AUDIO_TYPE_OPUS,
+    PYMUMBLE_MSG_TYPES_UDPTUNNEL,
+    PYMUMBLE_SAMPLERATE,
+    PYMUMBLE_SEQUENCE_DURATION,
+    PYMUMBLE_SEQUENCE_RESET_INTERVAL,
+)
+from pymumble_py3.errors import CodecNotSupportedError
+from pymumble_py3.soundoutput import SoundOutput
+from pymumble_py3.tools import VarInt
+
+from .latency import chunk_frames
+from .pipeline import Sink
+
+LOG = logging.getLogger(__name__)
+
+
+class PacketSoundOutput(SoundOutput):
+    """pymumble sound output sending packets encoded elsewhere
+
+    pcm holds encoded packets of audio_per_packet seconds instead of PCM bytes so that get_buffer_size() and
+    SendBacklog.trim() keep working.
+    """
+
+    def create_encoder(self):
+        if not self.codec:
+            return
+        if not self.codec.opus:
+            raise CodecNotSupportedError("")
+        self.encoder_framesize = self.audio_per_packet
+        self.codec_type = PYMUMBLE_AUDIO_TYPE_OPUS
+
+    def _set_bandwidth(self):
+        """Bitrate is applied by the packet encoder"""
+
+    def bitrate(self):
+        """Opus bitrate fitting the bandwidth once the protocol overhead is removed (as pymumble computes it)"""
+        overhead_per_packet = 20 + 3  # IP header, one frame per packet
+        overhead_per_packet += 12 if self.mumble_object.udp_active else 20 + 6  # UDP or TCP header and TCPTunnel
+        return self.bandwidth - int(overhead_per_packet * 8 / self.audio_per_packet)
+
+    def add_sound(self, pcm):
+        raise RuntimeError("the sound of a fan-out connection is encoded and queued by its FanoutSink, send PCM through the input pipeline")
+
+    def add_packets(self, packets):
+        """Queue encoded packets"""
+        with self.lock:
+            self.pcm.extend(packets)
+
+    def get_buffer_size(self):
+        return len(self.pcm) * self.audio_per_packet
+
+    def send_audio(self):
+        """Send the queued packets taking care of the timing and sequence like pymumble does"""
+        if self.codec_type is None:
+            return
+        while self.pcm and self.sequence_last_time + self.audio_per_packet <= time.time():
+            current_time = time.time()
+            if self.sequence_last_time + PYMUMBLE_SEQUENCE_RESET_INTERVAL <= current_time:
+                self.sequence = 0
+                self.sequence_start_time = current_time
+                self.sequence_last_time = current_time
+            elif self.sequence_last_time + (self.audio_per_packet * 2) <= current_time:
+                self.sequence = int((current_time - self.sequence_start_time) / PYMUMBLE_SEQUENCE_DURATION)
+                self.sequence_last_time = self.sequence_start_time + (self.sequence * PYMUMBLE_SEQUENCE_DURATION)
+            else:
+                self.sequence += int(self.audio_per_packet / PYMUMBLE_SEQUENCE_DURATION)
+                self.sequence_last_time = self.sequence_start_time + (self.sequence * PYMUMBLE_SEQUENCE_DURATION)
+            with self.lock:
+                if not self.pcm:
+                    return
+                encoded = self.pcm.pop(0)
+            udppacket = struct.pack("!B", self.codec_type << 5 | self.target) + VarInt(self.sequence).encode() + VarInt(len(encoded)).encode() + encoded
+            tcppacket = struct.pack("!HL", PYMUMBLE_MSG_TYPES_UDPTUNNEL, len(udppacket)) + udppacket
+            while len(tcppacket) > 0:
+                sent = self.mumble_object.control_socket.send(tcppacket)
+                if sent < 0:
+                    raise socket.error("Server socket error")
+                tcppacket = tcppacket[sent:]
+
+
+def install_packet_output(mumble):
+    """Replace the sound output of a connection by a PacketSoundOutput keeping its codec and bandwidth. Returns it"""
+    previous = mumble.sound_output
+    if isinstance(previous, PacketSoundOutput):
+        return previous
+    output = PacketSoundOutput(mumble, previous.audio_per_packet, previous.bandwidth, opus_profile=previous.opus_profile)
+    if previous.codec:
+        output.set_default_codec(previous.codec)
+    mumble.sound_output = output
+    return output
+
+
+class OpusPacketizer:
+    """Cuts PCM into packets and encodes each packet once. pending is PCM left over by a previous packetizer"""
+
+    def __init__(self, packet_length, bitrate, profile, pending=b""):
+        self.samples = chunk_frames(packet_length)
+        self.encoder = opuslib.Encoder(PYMUMBLE_SAMPLERATE, 1, profile)
+        self.encoder.bitrate = bitrate
+        self.encoded = 0
+        self.__pending = bytearray(pending)
+
+    @property
+    def pending(self):
+        """PCM bytes waiting for a complete packet"""
+        return bytes(self.__pending)
+
+    def encode(self, pcm):
+        """Encode the complete packets of the pending and new PCM bytes. Returns the encoded packets"""
+        self.__pending += pcm
+        packets = []
+        size = self.samples * 2
+        while len(self.__pending) >= size:
+            packets.append(self.encoder.encode(bytes(self.__pending[:size]), self.samples))
+            del self.__pending[:size]
+        self.encoded += len(packets)
+        return packets
+
+
+class FanoutSink(Sink):
+    """Encodes frames once per codec configuration and queues the packets to every connection
+
+    The optional SendBacklog policy is applied against the deepest send queue and each queue is trimmed to
+    the budget separately. When the codec configuration of a connection changes its new packetizer starts with
+    the PCM still pending in the previous one.
+    """
+
+    name = "fanout_out"
+
+    def __init__(self, connections, latency, drift=None, backlog=None):
+        self.outputs = [install_packet_output(mumble) for mumble in connections]
+        for output in self.outputs:
+            output.set_audio_per_packet(latency.packet_length)
+        self.latency = latency
+        self.drift = drift
+        self.backlog = backlog
+        self.packetizers = {}
+        self.__output_keys = {}
+        self.__generation = latency.generation
+
+    def depth(self):
+        """Deepest send queue in seconds"""
+        return max(output.get_buffer_size() for output in self.outputs)
+
+    def __regroup(self, groups):
+        """Create the packetizers of new codec configurations carrying over the pending PCM and drop the unused ones"""
+        packetizers = {}
+        for key, outputs in groups.items():
+            packetizers[key] = self.packetizers.get(key)
+            if packetizers[key] is None:
+                LOG.debug("new encoder for packet length %ss bitrate %d profile %s", *key)
+                previous = self.packetizers.get(self.__output_keys.get(outputs[0]))
+                packetizers[key] = OpusPacketizer(*key, previous.pending if previous is not None else b"")
+        self.packetizers = packetizers
+        self.__output_keys = {output: key for key, outputs in groups.items() for output in outputs}
+
+    def write(self, frame):
+        if self.__generation != self.latency.generation:
+            self.__generation = self.latency.generation
+            for output in self.outputs:
+                output.set_audio_per_packet(self.latency.packet_length)
+        if self.backlog is not None and not self.backlog.admit(self.depth, frame):
+            return
+        groups = {}
+        for output in self.outputs:
+            if output.codec_type is not None:
+                groups.setdefault((output.audio_per_packet, output.bitrate(), output.opus_profile), []).append(output)
+        if groups.keys() != self.packetizers.keys():
+            self.__regroup(groups)
+        pcm = frame.tobytes()
+        for key, outputs in groups.items():
+            packets = self.packetizers[key].encode(pcm)
+            for output in outputs:
+                output.add_packets(packets)
+                if self.backlog is not None:
+                    self.backlog.trim(output)
+        depth = self.depth()
+        self.latency.queue_depth(depth)
+        if self.drift is not None:  # the queue holds between one and two packets when the clocks agree
+            self.drift.report(depth - 2 * self.latency.packet_length, frame.timestamp)
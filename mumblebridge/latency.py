@@ -0,0 +1,161 @@
+""" Latency auto-tuning of packet length and PortAudio buffer sizes """
+import threading
+import time
+
+import pymumble_py3 as pymumble
+
+# Opus frame lengths pymumble can encode as a single packet (seconds)
+OPUS_PACKET_LENGTHS = (0.01, 0.02, 0.04, 0.06)
+
+
+def validate_packet_length(packet_length):
+    """Return the packet length if it is an Opus frame length else raise ValueError"""
+    for opus_length in OPUS_PACKET_LENGTHS:
+        if abs(packet_length - opus_length) < 1e-6:
+            return opus_length
+    raise ValueError(f"packet length must be one of {', '.join(str(length) for length in OPUS_PACKET_LENGTHS)} seconds")
+
+
+def chunk_frames(packet_length):
+    """Number of frames in a packet of the given length"""
+    return int(round(pymumble.constants.PYMUMBLE_SAMPLERATE * packet_length))
+
+
+def set_packet_length(sound_output, packet_length):
+    """Set the packet length of a pymumble sound output
+
+    The queued PCM was cut at the old packet size. It is cut again at the new size under the sound output lock so
+    that the send thread never encodes a chunk of the old size as a packet of the new one.
+    """
+    with sound_output.lock:
+        pcm = b"".join(sound_output.pcm)
+        sound_output.set_audio_per_packet(packet_length)
+        size = chunk_frames(packet_length) * 2 * sound_output.channels
+        sound_output.pcm = [pcm[offset : offset + size] for offset in range(0, len(pcm), size)]
+
+
+class LatencyTuner:
+    """Steps packet length and PortAudio buffer size to hold the lowest glitch-free latency
+
+    Levels are (packet length in seconds, PortAudio buffer size in packets) ordered by increasing latency.
+    Audio threads report overflows, underruns and the send queue depth. Every window the tuner steps one
+    level up if a glitch occurred or one level down after enough clean windows. A level that glitched
+    needs twice as many clean windows before it is tried again so that the tuner does not oscillate.
+    """
+
+    LEVELS = ((0.01, 1), (0.01, 2), (0.02, 1), (0.02, 2), (0.04, 2), (0.06, 2), (0.06, 4))
+
+    def __init__(self, window=5, stable_windows=6, queue_packets=4):
+        self.window = window
+        self.stable_windows = stable_windows
+        self.queue_packets = queue_packets
+        self.level = 0
+        self.generation = 0
+        self.overflows = 0
+        self.underruns = 0
+        self.__lock = threading.Lock()
+        self.__failures = [0] * len(self.LEVELS)
+        self.__window_start = time.time()
+        self.__window_glitches = 0
+        self.__window_queue = 0
+        self.__clean_windows = 0
+
+    @property
+    def packet_length(self):
+        """Packet length of the current level in seconds"""
+        return self.LEVELS[self.level][0]
+
+    @property
+    def chunk_size(self):
+        """Number of frames read or written per packet at the current level"""
+        return chunk_frames(self.packet_length)
+
+    @property
+    def frames_per_buffer(self):
+        """PortAudio buffer size in frames at the current level"""
+        return self.chunk_size * self.LEVELS[self.level][1]
+
+    def overflow(self):
+        """Report a PortAudio input overflow"""
+        with self.__lock:
+            self.overflows += 1
+            self.__window_glitches += 1
+
+    def underrun(self):
+        """Report a PortAudio output underrun"""
+        with self.__lock:
+            self.underruns += 1
+            self.__window_glitches += 1
+
+    def queue_depth(self, seconds):
+        """Report the current depth of the pymumble send queue in seconds"""
+        with self.__lock:
+            self.__window_queue = max(self.__window_queue, seconds)
+
+    def update(self, now=None):
+        """Evaluate the current window and step level if needed. Returns True if the level changed"""
+        now = time.time() if now is None else now
+        with self.__lock:
+            if now - self.__window_start < self.window:
+                return False
+            glitched = self.__window_glitches > 0 or self.__window_queue > self.queue_packets * self.packet_length
+            self.__window_start = now
+            self.__window_glitches = 0
+            self.__window_queue = 0
+            previous_level = self.level
+            if glitched:
+                self.__clean_windows = 0
+                self.__failures[self.level] += 1
+                self.level = min(self.level + 1, len(self.LEVELS) - 1)
+            else:
+                self.__clean_windows += 1
+                if self.level > 0 and self.__clean_windows >= self.stable_windows * (2 ** min(self.__failures[self.level - 1], 4)):
+                    self.__clean_windows = 0
+                    self.level -= 1
+            if self.level == previous_level:
+                return False
+            self.generation += 1
+            return True
+
+    def __repr__(self):
+        return f"level: {self.level} packet: {self.packet_length}s buffer: {self.frames_per_buffer} frames overflows: {self.overflows} underruns: {self.underruns}"
+
+
+class FixedLatency:
+    """Static packet length and PortAudio buffer size with the same interface as LatencyTuner"""
+
+    def __init__(self, packet_length, buffer_packets=1):
+        self.packet_length = packet_length
+        self.buffer_packets = buffer_packets
+        self.level = 0
+        self.generation = 0
+        self.overflows = 0
+        self.underruns = 0
+
+    @property
+    def chunk_size(self):
+        """Number of frames read or written per packet"""
+        return chunk_frames(self.packet_length)
+
+    @property
+    def frames_per_buffer(self):
+        """PortAudio buffer size in frames"""
+        return self.chunk_size * self.buffer_packets
+
+    def overflow(self):
+        """Count a PortAudio input overflow"""
+        self.overflows += 1
+
+    def underrun(self):
+        """Count a PortAudio output underrun"""
+        self.underruns += 1
+
+    def queue_depth(self, seconds):
+        """Send queue depth is not used"""
+
+    def update(self, now=None):
+        """Level never changes"""
+        return False
+
+    def __repr__(self):
+        return f"packet: {self.packet_length}s buffer: {self.frames_per_buffer} frames overflows: {self.overflows} underruns: {self.underruns}"
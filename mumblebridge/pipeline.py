@@ -0,0 +1,177 @@
+""" Source -> processors -> sinks audio pipeline engine
+
+A pipeline moves one preallocated Frame by reference from its source through its processors to its sinks.
+Stages work in place on the frame samples so that adding a stage adds neither a copy nor a thread. The
+pipeline runs in the thread of whoever drives it: a loop pulling from the source with run_once() or a
+callback pushing frames with push().
+"""
+import time
+import collections
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+# Largest frame handled: a 120 ms Opus packet
+FRAME_MAX_SAMPLES = int(pymumble.constants.PYMUMBLE_SAMPLERATE * 0.12)
+
+
+class Frame:
+    """Fixed size mono 16 bit audio frame passed by reference along a pipeline"""
+
+    __slots__ = ("samples", "length", "user", "timestamp", "active")
+
+    def __init__(self, size=FRAME_MAX_SAMPLES):
+        self.samples = np.zeros(size, dtype=np.int16)
+        self.length = 0
+        self.user = None
+        self.timestamp = 0
+        self.active = True
+
+    @property
+    def data(self):
+        """View on the valid samples"""
+        return self.samples[: self.length]
+
+    @property
+    def duration(self):
+        """Duration of the valid samples in seconds"""
+        return self.length / pymumble.constants.PYMUMBLE_SAMPLERATE
+
+    def load(self, pcm, user=None):
+        """Copy 16 bit PCM bytes into the frame. Samples beyond the frame size are dropped"""
+        pcm_samples = np.frombuffer(pcm, dtype=np.int16)
+        self.length = min(len(pcm_samples), len(self.samples))
+        self.samples[: self.length] = pcm_samples[: self.length]
+        self.user = user
+        self.timestamp = time.time()
+        self.active = True
+        return self
+
+    def peak(self):
+        """Maximum sample magnitude"""
+        if self.length == 0:
+            return 0
+        data = self.data
+        return max(int(data.max()), -int(data.min()))
+
+    def tobytes(self):
+        """16 bit PCM bytes of the valid samples"""
+        return self.data.tobytes()
+
+
+class Stage:
+    """Pipeline stage"""
+
+    name = "stage"
+
+    def close(self):
+        """Release the stage resources"""
+
+
+class Source(Stage):
+    """Pipeline stage producing frames"""
+
+    name = "source"
+
+    def read(self, frame):
+        """Fill the frame and return it or return None if there is nothing to process"""
+        raise NotImplementedError("please inherit and implement")
+
+
+class Processor(Stage):
+    """Pipeline stage transforming frames in place. Clearing frame.active keeps the frame from gated sinks"""
+
+    name = "processor"
+
+    def process(self, frame):
+        """Process the frame in place"""
+        raise NotImplementedError("please inherit and implement")
+
+
+class Sink(Stage):
+    """Pipeline stage consuming frames. Gated sinks only see active frames"""
+
+    name = "sink"
+    gated = True
+
+    def write(self, frame):
+        """Consume the frame"""
+        raise NotImplementedError("please inherit and implement")
+
+
+StageTiming = collections.namedtuple("StageTiming", ("count", "total", "peak"))
+
+
+class Pipeline:
+    """Runs frames from a source through processors to sinks recording per stage timings"""
+
+    def __init__(self, name, source=None, processors=None, sinks=None, frame_size=FRAME_MAX_SAMPLES):
+        self.name = name
+        self.source = source
+        self.processors = list(processors or [])
+        self.sinks = list(sinks or [])
+        self.frame = Frame(frame_size)
+        self.__timings = {}
+        self.__changes = collections.deque()
+
+    def stages(self):
+        """All stages in processing order"""
+        return ([self.source] if self.source is not None else []) + self.processors + self.sinks
+
+    def __timed(self, stage, func, frame):
+        """Call a stage function on the frame and accumulate its timing"""
+        start = time.perf_counter()
+        result = func(frame)
+        elapsed = time.perf_counter() - start
+        count, total, peak = self.__timings.get(stage.name, (0, 0.0, 0.0))
+        self.__timings[stage.name] = (count + 1, total + elapsed, max(peak, elapsed))
+        return result
+
+    def read(self):
+        """Read a frame from the source. Returns None if there is nothing to process"""
+        return self.__timed(self.source, self.source.read, self.frame)
+
+    def apply(self, change):
+        """Queue a change (a callable without argument) to be applied before the next frame is processed"""
+        self.__changes.append(change)
+
+    def process(self, frame):
+        """Run a frame through processors and sinks"""
+        while self.__changes:
+            self.__changes.popleft()()
+        for processor in self.processors:
+            self.__timed(processor, processor.process, frame)
+        for sink in self.sinks:
+            if frame.active or not sink.gated:
+                self.__timed(sink, sink.write, frame)
+        return frame
+
+    def push(self, pcm, user=None):
+        """Load PCM bytes in the pipeline frame and process it. For callback driven pipelines"""
+        return self.process(self.frame.load(pcm, user))
+
+    def run_once(self):
+        """Read a frame from the source and process it. Returns the frame or None if nothing was read"""
+        frame = self.read()
+        if frame is not None:
+            self.process(frame)
+        return frame
+
+    def add_processor(self, processor, index=None):
+        """Insert a processor at the given position or at the end. The list is replaced so that a running pipeline is not disturbed"""
+        processors = list(self.processors)
+        processors.insert(len(processors) if index is None else index, processor)
+        self.processors = processors
+
+    def add_sink(self, sink):
+        """Append a sink. The list is replaced so that a running pipeline is not disturbed"""
+        self.sinks = self.sinks + [sink]
+
+    def timings(self):
+        """Per stage timings as {stage name: StageTiming(count, total seconds, peak seconds)}"""
+        return {name: StageTiming(*timing) for name, timing in self.__timings.items()}
+
+    def close(self):
+        """Close all stages"""
+        for stage in self.stages():
+            stage.close()
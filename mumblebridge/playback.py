@@ -0,0 +1,208 @@
+""" Playback of WAV and raw PCM files: announcements, replays and test input
+
+Files are memory-mapped and read as numpy views of the mapping so that a long file costs neither memory nor
+a read at start. Only the samples of the current frame are copied, into the pipeline frame that the stages
+modify in place. Files must be 16 bit mono at the Mumble sample rate. Files that are not RIFF/WAVE are
+taken as raw samples in that format.
+"""
+import datetime
+import logging
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+from .pipeline import Source, Processor
+
+LOG = logging.getLogger(__name__)
+
+SAMPLERATE = pymumble.constants.PYMUMBLE_SAMPLERATE
+MODES = ("priority", "mix")
+
+
+class AudioFile:
+    """Memory-mapped 16 bit mono PCM file. samples is a read only view of the mapping"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as audio_file:
+            if os.fstat(audio_file.fileno()).st_size == 0:
+                raise ValueError(f"{path} is empty")
+            self.__map = mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, size = self.__data_chunk()
+        self.samples = np.frombuffer(self.__map, dtype="<i2", count=size // 2, offset=offset)
+
+    @property
+    def duration(self):
+        """Duration in seconds"""
+        return len(self.samples) / SAMPLERATE
+
+    def __data_chunk(self):
+        """Offset and size of the samples. Checks the format of WAV files"""
+        if self.__map[:4] != b"RIFF" or self.__map[8:12] != b"WAVE":
+            return 0, len(self.__map)
+        offset = 12
+        while offset + 8 <= len(self.__map):
+            chunk_id, chunk_size = struct.unpack_from("<4sI", self.__map, offset)
+            offset += 8
+            if chunk_id == b"fmt ":
+                audio_format, channels, samplerate, _, _, bits = struct.unpack_from("<HHIIHH", self.__map, offset)
+                if audio_format != 1 or channels != 1 or samplerate != SAMPLERATE or bits != 16:
+                    raise ValueError(f"{self.path} must be 16 bit mono PCM at {SAMPLERATE} Hz")
+            elif chunk_id == b"data":
+                return offset, min(chunk_size, len(self.__map) - offset)
+            offset += chunk_size + chunk_size % 2
+        raise ValueError(f"{self.path} has no data chunk")
+
+    def close(self):
+        """Unmap the file. The mapping stays until views of it still in use are released"""
+        self.samples = None
+        try:
+            self.__map.close()
+        except BufferError:
+            pass
+
+
+class FileSource(Source):
+    """Reads an AudioFile at real time pace, in a loop or once"""
+
+    name = "file_in"
+
+    def __init__(self, audio_file, latency, loop=False):
+        self.audio_file = audio_file
+        self.latency = latency
+        self.loop = loop
+        self.position = 0
+        self.__deadline = None
+
+    def read(self, frame):
+        samples = self.audio_file.samples
+        if self.position >= len(samples):
+            if not self.loop:
+                return None
+            self.position = 0
+        now = time.monotonic()
+        if self.__deadline is None or self.__deadline < now - self.latency.packet_length:
+            self.__deadline = now  # start or late by more than a packet: restart pacing
+        elif self.__deadline > now:
+            time.sleep(self.__deadline - now)
+        chunk = samples[self.position : self.position + self.latency.chunk_size]
+        frame.samples[: len(chunk)] = chunk
+        frame.length = len(chunk)
+        frame.user = None
+        frame.timestamp = time.time()
+        frame.active = True
+        self.position += len(chunk)
+        self.__deadline += len(chunk) / SAMPLERATE
+        return frame
+
+    def close(self):
+        self.audio_file.close()
+
+
+class Announcement:
+    """Scheduled playback of a file every interval seconds and/or at daily times ("HH:MM")"""
+
+    def __init__(self, path, every=None, at=None, loop=False):
+        self.path = path
+        self.every = every
+        self.at = [datetime.datetime.strptime(daily_time, "%H:%M").time() for daily_time in (at or [])]
+        self.loop = loop
+        self.due = self.next_due(time.time())
+
+    def next_due(self, now):
+        """Next playback time after now or None"""
+        due_times = []
+        if self.every:
+            due_times.append(now + self.every)
+        today = datetime.date.fromtimestamp(now)
+        for daily_time in self.at:
+            due = datetime.datetime.combine(today, daily_time).timestamp()
+            due_times.append(due if due > now else due + 86400)
+        if self.loop:
+            due_times.append(now)
+        return min(due_times) if due_times else None
+
+
+class Playback(Processor):
+    """Plays files into the frames of a live pipeline
+
+    In priority mode file samples replace the live samples. In mix mode they are added to them. Frames are
+    active while a file plays. Playback requests are queued and played one after the other.
+    """
+
+    name = "playback"
+
+    def __init__(self, mode="priority", volume=1, announcements=None):
+        if mode not in MODES:
+            raise ValueError(f"playback mode must be one of {', '.join(MODES)}")
+        self.mode = mode
+        self.volume = volume
+        self.announcements = list(announcements or [])
+        self.queue = []
+        self.current = None
+        self.position = 0
+        self.loop = False
+        self.__mix = np.zeros(0, dtype=np.float32)
+
+    def play(self, audio_file, loop=False):
+        """Queue a file. Call between frames (Pipeline.apply)"""
+        self.queue.append((audio_file, loop))
+
+    def stop(self):
+        """Stop the current file and clear the queue. Call between frames (Pipeline.apply)"""
+        for audio_file, _ in self.queue:
+            audio_file.close()
+        self.queue = []
+        self.__finish()
+
+    def __finish(self):
+        """Release the current file"""
+        if self.current is not None:
+            LOG.debug("end of %s", self.current.path)
+            self.current.close()
+        self.current = None
+
+    def __schedule(self, now):
+        """Queue the announcements that are due"""
+        for announcement in self.announcements:
+            if announcement.due is not None and announcement.due <= now:
+                announcement.due = None if announcement.loop else announcement.next_due(now)
+                try:
+                    self.play(AudioFile(announcement.path), announcement.loop)
+                except (OSError, ValueError) as ex:
+                    LOG.error("cannot play %s: %s", announcement.path, ex)
+
+    def process(self, frame):
+        self.__schedule(frame.timestamp)
+        if self.current is None:
+            if not self.queue:
+                return
+            self.current, self.loop = self.queue.pop(0)
+            self.position = 0
+            LOG.debug("playing %s", self.current.path)
+        samples = self.current.samples
+        chunk = samples[self.position : self.position + frame.length]
+        self.position += len(chunk)
+        if len(self.__mix) < frame.length:
+            self.__mix = np.zeros(frame.length, dtype=np.float32)
+        mix = self.__mix[: frame.length]
+        if self.mode == "mix":
+            np.copyto(mix, frame.data)
+        else:
+            mix[:] = 0
+        mix[: len(chunk)] += self.volume * chunk
+        np.clip(mix, -32768, 32767, out=mix)
+        frame.data[:] = mix
+        frame.active = True
+        if self.position >= len(samples):
+            if self.loop:
+                self.position = 0
+            else:
+                self.__finish()
+
+    def close(self):
+        self.stop()
@@ -0,0 +1,42 @@
+""" Host PTT control through external commands """
+import logging
+import subprocess
+
+LOG = logging.getLogger(__name__)
+
+
+class PttController:
+    """Runs the host commands turning PTT on and off"""
+
+    def __init__(self, on_command, off_command):
+        self.on_command = " ".join(on_command)
+        self.off_command = " ".join(off_command)
+        self.is_on = False
+
+    def on(self):
+        """Turn PTT on"""
+        run_ptt_on_command = subprocess.run(self.on_command, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        LOG.debug("PTT on exited with code %d", run_ptt_on_command.returncode)
+        self.is_on = True
+
+    def off(self):
+        """Turn PTT off"""
+        run_ptt_off_command = subprocess.run(self.off_command, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        LOG.debug("PTT off exited with code %d", run_ptt_off_command.returncode)
+        self.is_on = False
+
+
+def make_ptt(config):
+    """PTT controller from the configuration or None if PTT commands are not configured"""
+    if not config["ptt_command_support"]:
+        return None
+    return PttController(config["ptt_on_command"], config["ptt_off_command"])
+
+
+def swap_ptt(old_ptt, new_ptt):
+    """Hand PTT over from a controller to another keeping the transmitter state. Returns the new controller"""
+    if old_ptt is not None and old_ptt.is_on:
+        old_ptt.off()
+        if new_ptt is not None:
+            new_ptt.on()
+    return new_ptt
@@ -50,6 +50,16 @@ class PulseAudioHandler:
                 return pulse_sink_input.index
         return None
 
+    def list_own_sink_input_indexes(self):
+        """Get the set of Pulseaudio sink input indexes of its own process (PID)"""
+        result = set()
+        pulse_sink_inputs = self._pulse.sink_input_list()
+        for pulse_sink_input in pulse_sink_inputs:
+            pid = int(pulse_sink_input.proplist.get("application.process.id"))
+            if pid == os.getpid():
+                result.add(pulse_sink_input.index)
+        return result
+
     def get_own_source_output_index(self):
         """Get Pulseaudio source output index of its own process (PID)"""
         pulse_source_outputs = self._pulse.source_output_list()
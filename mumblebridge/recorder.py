@@ -0,0 +1,322 @@
+""" Rotating WAV or Ogg/Opus recorder fed by pipeline taps
+
+Taps copy active frames into a bounded queue and never block: frames are dropped and counted if the queue
+is full. A single background thread batches the queued sound and writes segments to disk. A new segment
+starts at a talk spurt boundary, when sound of another talker comes after spurt_gap seconds of silence, or
+when the current one reaches rotate_time seconds or rotate_size bytes. Talkers overlapping in a mix do not
+split segments: segments are named after the talkers of their first batch and list all the talkers heard in
+their metadata.
+"""
+import logging
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import wave
+
+import pymumble_py3 as pymumble
+
+from .pipeline import Sink
+
+LOG = logging.getLogger(__name__)
+
+SAMPLERATE = pymumble.constants.PYMUMBLE_SAMPLERATE
+
+
+class WavSegment:
+    """WAV segment file with the talker in a LIST INFO chunk. The talker can be changed until the segment is closed"""
+
+    extension = ".wav"
+
+    def __init__(self, path, talker):
+        self.path = path
+        self.talker = talker
+        self.size = 0
+        self.__wav = wave.open(path, "wb")  # pylint: disable=consider-using-with
+        self.__wav.setnchannels(1)
+        self.__wav.setsampwidth(2)
+        self.__wav.setframerate(SAMPLERATE)
+
+    def write(self, pcm):
+        """Append 16 bit PCM"""
+        self.__wav.writeframesraw(pcm)
+        self.size += len(pcm)
+
+    def close(self):
+        """Close the file and append the talker tag"""
+        self.__wav.close()
+        artist = self.talker.encode("utf-8") + b"\x00"
+        if len(artist) % 2:
+            artist += b"\x00"
+        info = b"INFO" + b"IART" + struct.pack("<I", len(artist)) + artist
+        with open(self.path, "r+b") as wav_file:
+            wav_file.seek(0, os.SEEK_END)
+            wav_file.write(b"LIST" + struct.pack("<I", len(info)) + info)
+            riff_size = wav_file.tell() - 8
+            wav_file.seek(4)
+            wav_file.write(struct.pack("<I", riff_size))
+
+
+def _ogg_crc_table():
+    """CRC-32 table of the Ogg page checksum (polynomial 0x04c11db7, not reflected)"""
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def ogg_crc(data):
+    """Ogg page checksum"""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[((crc >> 24) & 0xFF) ^ byte]
+    return crc
+
+
+class OpusSegment:
+    """Ogg/Opus segment file with the talker in the ARTIST comment
+
+    The comment header is padded to tags_size bytes so that the talker can be changed until the segment is
+    closed: the header page is rewritten in place with the same length.
+    """
+
+    extension = ".opus"
+    frame_samples = SAMPLERATE // 50  # 20 ms Opus frames
+    pre_skip = 312
+    tags_size = 512
+
+    def __init__(self, path, talker, bitrate=32000):
+        import opuslib  # pylint: disable=import-outside-toplevel
+
+        self.path = path
+        self.talker = talker
+        self.size = 0
+        self.__file = open(path, "wb")  # pylint: disable=consider-using-with
+        self.__encoder = opuslib.Encoder(SAMPLERATE, 1, "audio")
+        self.__encoder.bitrate = bitrate
+        self.__serial = int.from_bytes(os.urandom(4), "little")
+        self.__sequence = 0
+        self.__granule = 0
+        self.__pending = bytearray()
+        self.__packets = []
+        self.__date = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.__tagged = talker
+        head = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, self.pre_skip, SAMPLERATE, 0, 0)
+        self.__write_page([head], 0, 0x02)
+        self.__tags_offset = self.size
+        self.__write_page([self.__tags()], 0, 0)
+
+    def __tags(self):
+        """Comment header of the current talker padded to tags_size bytes"""
+        vendor = b"mumblestream"
+        comments = [f"DATE={self.__date}".encode("utf-8"), f"ARTIST={self.talker}".encode("utf-8")]
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+        for comment in comments:
+            tags += struct.pack("<I", len(comment)) + comment
+        return tags[: self.tags_size].ljust(self.tags_size, b"\x00")  # padding starting with a zero byte may be discarded
+
+    def __page(self, packets, granule, header_type, sequence):
+        """One Ogg page holding whole packets"""
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+        header = b"OggS" + struct.pack("<BBqIIIB", 0, header_type, granule, self.__serial, sequence, 0, len(lacing)) + lacing
+        page = bytearray(header + b"".join(packets))
+        page[22:26] = struct.pack("<I", ogg_crc(page))
+        return page
+
+    def __write_page(self, packets, granule, header_type):
+        """Write one Ogg page holding whole packets"""
+        page = self.__page(packets, granule, header_type, self.__sequence)
+        self.__file.write(page)
+        self.size += len(page)
+        self.__sequence += 1
+
+    def __flush_packets(self, header_type=0):
+        """Write the pending packets as one page"""
+        self.__write_page(self.__packets, self.__granule, header_type)
+        self.__packets = []
+
+    def write(self, pcm):
+        """Encode 16 bit PCM in 20 ms packets. Pages are written when full"""
+        self.__pending += pcm
+        frame_bytes = self.frame_samples * 2
+        while len(self.__pending) >= frame_bytes:
+            packet = self.__encoder.encode(bytes(self.__pending[:frame_bytes]), self.frame_samples)
+            del self.__pending[:frame_bytes]
+            if sum(len(p) // 255 + 1 for p in self.__packets) + len(packet) // 255 + 1 > 255:
+                self.__flush_packets()
+            self.__packets.append(packet)
+            self.__granule += self.frame_samples
+
+    def close(self):
+        """Pad the last packet, write the last page with end of stream mark and close the file"""
+        if self.__pending:
+            self.write(b"\x00" * (self.frame_samples * 2 - len(self.__pending)))
+        self.__flush_packets(0x04)
+        if self.talker != self.__tagged:
+            self.__file.seek(self.__tags_offset)
+            self.__file.write(self.__page([self.__tags()], 0, 0, 1))
+        self.__file.close()
+
+
+class Recorder:
+    """Background writer of rotating recording segments"""
+
+    formats = {"wav": WavSegment, "opus": OpusSegment}
+
+    def __init__(self, path, record_format="wav", rotate_time=3600, rotate_size=0, batch=5, max_queue=10, spurt_gap=1, error_interval=10):
+        """path is a template with {direction}, {time} and {user} placeholders. Queue size is in seconds. Write
+        errors are logged once every error_interval seconds"""
+        self.path = path
+        self.segment_class = self.formats[record_format]
+        self.rotate_time = rotate_time
+        self.rotate_size = rotate_size
+        self.spurt_gap = spurt_gap
+        self.error_interval = error_interval
+        self.batch_bytes = int(batch * SAMPLERATE) * 2
+        self.batch_time = batch
+        self.dropped = 0
+        self.segments = 0
+        self.errors = 0
+        self.__error_ts = None
+        self.__queue = queue.Queue(maxsize=int(max_queue * 50))
+        self.__streams = {}
+        self.__running = True
+        self.__thread = threading.Thread(name="recorder", target=self.__write_loop, daemon=True)
+        self.__thread.start()
+
+    def put(self, direction, pcm, talker):
+        """Queue sound of a direction without blocking. talker may be several names joined by "+". Returns False if it was dropped"""
+        try:
+            self.__queue.put_nowait((direction, pcm, talker or "", time.monotonic()))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def __segment_path(self, direction, talker):
+        """Path of a new segment"""
+        path = self.path.format(direction=direction, time=time.strftime("%Y%m%d-%H%M%S"), user=re.sub(r"[^\w.-]", "_", talker or "unknown"))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        segment_path = path + self.segment_class.extension
+        index = 1
+        while os.path.exists(segment_path):
+            segment_path = f"{path}-{index}{self.segment_class.extension}"
+            index += 1
+        return segment_path
+
+    def __write_batch(self, direction, stream, close=False):
+        """Write the batched sound of a direction rotating segments as needed"""
+        now = time.time()
+        segment = stream["segment"]
+        rotate = segment is not None and (
+            (self.rotate_time and now >= stream["start"] + self.rotate_time) or (self.rotate_size and segment.size >= self.rotate_size)
+        )
+        if rotate:
+            segment.close()
+            LOG.debug("segment %s closed", segment.path)
+            segment = stream["segment"] = None
+        if stream["buffer"]:
+            if segment is None:
+                stream["talkers"] = set(stream["batch"])
+                talkers = sorted(stream["talkers"])
+                segment = stream["segment"] = self.segment_class(self.__segment_path(direction, "+".join(talkers)), ", ".join(talkers))
+                stream["start"] = now
+                self.segments += 1
+                LOG.debug("segment %s opened", segment.path)
+            stream["talkers"] |= stream["batch"]
+            segment.talker = ", ".join(sorted(stream["talkers"]))
+            segment.write(bytes(stream["buffer"]))
+            stream["buffer"].clear()
+        stream["batch"] = set()
+        stream["flush_ts"] = now
+        if close and segment is not None:
+            segment.close()
+            LOG.debug("segment %s closed", segment.path)
+            stream["segment"] = None
+
+    def __write(self, direction, stream, close=False):
+        """Write the batched sound of a direction. A failing disk drops the batch instead of stopping the writer"""
+        try:
+            self.__write_batch(direction, stream, close)
+        except Exception as ex:
+            stream["buffer"].clear()
+            stream["batch"] = set()
+            stream["flush_ts"] = time.time()
+            if close:
+                stream["segment"] = None
+            self.errors += 1
+            now = time.monotonic()
+            if self.__error_ts is None or now >= self.__error_ts + self.error_interval:
+                self.__error_ts = now
+                LOG.error("cannot write %s recording: %s (%d errors)", direction, ex, self.errors)
+
+    def __write_loop(self):
+        """Writer thread"""
+        while self.__running or not self.__queue.empty():
+            try:
+                direction, pcm, talker, timestamp = self.__queue.get(timeout=0.5)
+            except queue.Empty:
+                direction = None
+            now = time.time()
+            if direction is not None:
+                names = set(talker.split("+")) - {""}
+                stream = self.__streams.get(direction)
+                if stream is None:
+                    stream = self.__streams[direction] = {"buffer": bytearray(), "batch": set(), "talkers": set(), "segment": None, "start": now, "flush_ts": now, "last_ts": timestamp}
+                elif timestamp >= stream["last_ts"] + self.spurt_gap and not names <= stream["talkers"] | stream["batch"]:
+                    self.__write(direction, stream, close=True)  # another talker after a silence: new segment
+                stream["batch"] |= names
+                stream["last_ts"] = timestamp
+                stream["buffer"] += pcm
+            for name, stream in self.__streams.items():
+                if len(stream["buffer"]) >= self.batch_bytes or now >= stream["flush_ts"] + self.batch_time:
+                    self.__write(name, stream)
+        for name, stream in self.__streams.items():
+            self.__write(name, stream, close=True)
+
+    def close(self):
+        """Write what is queued, close the segments and stop the writer thread"""
+        self.__running = False
+        self.__thread.join()
+
+    def __repr__(self):
+        return f"segments: {self.segments} dropped: {self.dropped} write errors: {self.errors}"
+
+
+def make_recorder(recorder_config):
+    """Recorder from the "recorder" configuration section or None if recording is not configured"""
+    if not recorder_config or "path" not in recorder_config:
+        return None
+    return Recorder(
+        recorder_config["path"],
+        recorder_config.get("format", "wav"),
+        recorder_config.get("rotate_time", 3600),
+        recorder_config.get("rotate_size", 0),
+    )
+
+
+class RecorderTap(Sink):
+    """Pipeline sink queueing active frames of one direction to a recorder"""
+
+    name = "recorder"
+
+    def __init__(self, recorder, direction, talker=None):
+        self.recorder = recorder
+        self.direction = direction
+        self.talker = talker
+        self.name = f"recorder_{direction}"
+
+    def write(self, frame):
+        self.recorder.put(self.direction, frame.tobytes(), frame.user or self.talker)
@@ -0,0 +1,111 @@
+""" Configuration file watching for hot reload
+
+The directory of the configuration file is watched with inotify so that files replaced by a rename (editors,
+configuration management) are seen too. Where inotify is not available the file modification time is polled.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class ConfigWatcher:
+    """Calls on_change with the newly loaded configuration when the file changes"""
+
+    def __init__(self, path, load, on_change, settle=0.2, poll_interval=1):
+        self.path = os.path.abspath(path)
+        self.load = load
+        self.on_change = on_change
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.__running = True
+        self.__inotify_fd = self.__inotify_init()
+        self.__thread = threading.Thread(name="config", target=self.__watch_loop, daemon=True)
+        self.__thread.start()
+
+    def __inotify_init(self):
+        """Watch the configuration directory with inotify. Returns the inotify file descriptor or None"""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            inotify_fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+            if inotify_fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            directory = os.path.dirname(self.path).encode()
+            if libc.inotify_add_watch(inotify_fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                os.close(inotify_fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch")
+            LOG.debug("watching %s with inotify", self.path)
+            return inotify_fd
+        except (OSError, AttributeError) as ex:
+            LOG.info("inotify not available (%s): polling %s", ex, self.path)
+            return None
+
+    def __inotify_changed(self):
+        """Wait for inotify events. Returns True if the configuration file changed"""
+        readable, _, _ = select.select([self.__inotify_fd], [], [], self.poll_interval)
+        if not readable:
+            return False
+        buffer = os.read(self.__inotify_fd, 4096)
+        name = os.path.basename(self.path).encode()
+        offset = 0
+        changed = False
+        while offset < len(buffer):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT.size
+            if buffer[offset : offset + length].rstrip(b"\x00") == name:
+                changed = True
+            offset += length
+        return changed
+
+    def __mtime(self):
+        """Modification time of the configuration file or None if it does not exist"""
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def __watch_loop(self):
+        """Watcher thread"""
+        mtime = self.__mtime()
+        while self.__running:
+            if self.__inotify_fd is not None:
+                if not self.__inotify_changed():
+                    continue
+            else:
+                time.sleep(self.poll_interval)
+                new_mtime = self.__mtime()
+                if new_mtime == mtime:
+                    continue
+                mtime = new_mtime
+            time.sleep(self.settle)  # let the writer finish
+            if self.__mtime() is None:  # deleted or renamed away: the defaults must not replace the configuration
+                LOG.warning("%s is missing, keeping the current configuration", self.path)
+                continue
+            try:
+                config = self.load()
+            except Exception as ex:
+                LOG.error("cannot reload %s: %s", self.path, ex)
+                continue
+            LOG.info("%s changed", self.path)
+            try:
+                self.on_change(config)
+            except Exception as ex:
+                LOG.error("cannot apply %s: %s", self.path, ex)
+
+    def close(self):
+        """Stop watching"""
+        self.__running = False
+        self.__thread.join()
+        if self.__inotify_fd is not None:
+            os.close(self.__inotify_fd)
@@ -0,0 +1,277 @@
+""" Per user output routing to Pulseaudio/PyAudio devices, FIFOs and WAV files
+
+A route sends the sound of its users to one track instead of the main mix. Users of a route are mixed
+together on its track. A route whose path contains "{user}" gets one track per user created on first sound.
+Tracks buffer the sound and are flushed with non-blocking writes by the thread that drives the router so
+that any number of talkers is served by a single thread.
+"""
+import errno
+import logging
+import os
+import re
+import time
+import wave
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+from .pipeline import FRAME_MAX_SAMPLES
+
+LOG = logging.getLogger(__name__)
+
+
+class Track:
+    """Buffered non-blocking writer of 16 bit PCM. The oldest samples are dropped beyond max_buffer seconds"""
+
+    def __init__(self, name, max_buffer=2):
+        self.name = name
+        self.max_bytes = int(max_buffer * pymumble.constants.PYMUMBLE_SAMPLERATE) * 2
+        self.buffer = bytearray()
+        self.dropped_bytes = 0
+        self.__mix = np.zeros(FRAME_MAX_SAMPLES, dtype=np.int32)
+        self.__mix_length = 0
+
+    def add(self, pcm_samples):
+        """Mix samples in the current cycle"""
+        length = len(pcm_samples)
+        if self.__mix_length == 0:
+            self.__mix[:length] = pcm_samples
+        else:
+            self.__mix[self.__mix_length : length] = 0
+            self.__mix[:length] += pcm_samples
+        self.__mix_length = max(self.__mix_length, length)
+
+    def commit(self):
+        """Append the mix of the current cycle to the buffer"""
+        if self.__mix_length == 0:
+            return
+        self.buffer += np.clip(self.__mix[: self.__mix_length], -32768, 32767).astype(np.int16).tobytes()
+        self.__mix_length = 0
+        overflow = len(self.buffer) - self.max_bytes
+        if overflow > 0:
+            del self.buffer[:overflow]
+            self.dropped_bytes += overflow
+
+    def flush(self):
+        """Write as much of the buffer as possible without blocking"""
+        raise NotImplementedError("please inherit and implement")
+
+    def pending(self):
+        """True if buffered sound waits for the sink to accept it"""
+        return False
+
+    def close(self):
+        """Flush and release the track"""
+
+
+class NullTrack(Track):
+    """Drops the sound of the users of a route whose track could not be created"""
+
+    def add(self, pcm_samples):
+        self.dropped_bytes += 2 * len(pcm_samples)
+
+    def commit(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+class FifoTrack(Track):
+    """Writes to a FIFO opened non-blocking. Sound is dropped while no reader is connected"""
+
+    def __init__(self, name, path, max_buffer=2, retry_interval=1):
+        super().__init__(name, max_buffer)
+        self.path = path
+        self.retry_interval = retry_interval
+        self.__fd = None
+        self.__open_ts = 0
+
+    def __open(self):
+        """Try to open the FIFO for writing. Fails with ENXIO while there is no reader"""
+        now = time.time()
+        if now < self.__open_ts + self.retry_interval:
+            return
+        self.__open_ts = now
+        if not os.path.exists(self.path):
+            os.mkfifo(self.path)
+        try:
+            self.__fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            LOG.debug("track %s: FIFO %s opened", self.name, self.path)
+        except OSError as ex:
+            if ex.errno != errno.ENXIO:
+                raise
+
+    def flush(self):
+        if self.__fd is None:
+            self.__open()
+        if self.__fd is None or not self.buffer:
+            return
+        try:
+            written = os.write(self.__fd, self.buffer)
+            del self.buffer[:written]
+        except BlockingIOError:
+            pass
+        except BrokenPipeError:
+            LOG.debug("track %s: FIFO %s reader left", self.name, self.path)
+            os.close(self.__fd)
+            self.__fd = None
+
+    def pending(self):
+        return self.__fd is not None and bool(self.buffer)
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+
+class WavTrack(Track):
+    """Writes to a WAV file in batches of batch seconds"""
+
+    def __init__(self, name, path, max_buffer=10, batch=1):
+        super().__init__(name, max_buffer)
+        self.path = path
+        self.batch_bytes = int(batch * pymumble.constants.PYMUMBLE_SAMPLERATE) * 2
+        self.__wav = wave.open(path, "wb")  # pylint: disable=consider-using-with
+        self.__wav.setnchannels(1)
+        self.__wav.setsampwidth(2)
+        self.__wav.setframerate(pymumble.constants.PYMUMBLE_SAMPLERATE)
+        LOG.debug("track %s: WAV file %s opened", self.name, self.path)
+
+    def flush(self):
+        if len(self.buffer) >= self.batch_bytes:
+            self.__write()
+
+    def __write(self):
+        """Write the whole buffer to the file"""
+        self.__wav.writeframesraw(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        self.__write()
+        self.__wav.close()
+
+
+class PyAudioTrack(Track):
+    """Writes to a PortAudio output stream only what fits in the stream buffer"""
+
+    def __init__(self, name, stream, max_buffer=1):
+        super().__init__(name, max_buffer)
+        self.stream = stream
+
+    def flush(self):
+        frames = min(self.stream.get_write_available(), len(self.buffer) // 2)
+        if frames > 0:
+            self.stream.write(bytes(self.buffer[: frames * 2]), frames, exception_on_underflow=False)
+            del self.buffer[: frames * 2]
+
+    def pending(self):
+        return bool(self.buffer)
+
+    def close(self):
+        self.stream.close()
+
+
+class Route:
+    """Users sent to a track. The track is created on first use"""
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.users = rule.get("users", "*")
+        if isinstance(self.users, str):
+            self.users = [self.users]
+        self.per_user = "{user}" in rule.get("path", "")
+        self.__name = rule.get("path", rule.get("name", "track")).replace("{time}", time.strftime("%Y%m%d%H%M%S"))
+
+    def matches(self, user_name):
+        """True if the user is routed here"""
+        return "*" in self.users or user_name in self.users
+
+    def track_name(self, user_name):
+        """Name of the track of the user"""
+        if self.per_user:
+            return self.__name.replace("{user}", re.sub(r"[^\w.-]", "_", user_name))
+        return self.__name
+
+
+class Router:
+    """Dispatches users sound to the tracks of the first matching route
+
+    Users of a route whose track cannot be created are dropped, not sent to the main mix. The write errors of a
+    track are logged once every error_interval seconds.
+    """
+
+    def __init__(self, rules, devices=None, latency=None, error_interval=10):
+        self.routes = [Route(rule) for rule in rules]
+        self.devices = devices
+        self.latency = latency
+        self.error_interval = error_interval
+        self.tracks = {}
+        self.__user_tracks = {}
+        self.__error_ts = {}
+
+    def __create_track(self, route, name):
+        """Create the track of a route"""
+        track_type = route.rule.get("type", "wav")
+        if track_type == "fifo":
+            return FifoTrack(name, name)
+        if track_type == "wav":
+            return WavTrack(name, name)
+        if track_type == "pulse":
+            stream = self.devices.open_output_pulseaudio(route.rule["name"], self.latency.frames_per_buffer)
+            if stream is None:
+                raise ValueError(f"cannot open Pulseaudio sink {route.rule['name']}")
+        elif track_type == "pyaudio":
+            index = self.devices.get_output_index(route.rule["name"], None)
+            if index is None:
+                raise ValueError(f"cannot find PyAudio output device {route.rule['name']}")
+            stream = self.devices.open_output(index, self.latency.frames_per_buffer)
+        else:
+            raise ValueError(f"unknown route type {track_type}")
+        return PyAudioTrack(name, stream)
+
+    def track(self, user_name):
+        """Track of the user or None if the user goes to the main mix"""
+        if user_name in self.__user_tracks:
+            return self.__user_tracks[user_name]
+        track = None
+        for route in self.routes:
+            if route.matches(user_name):
+                name = route.track_name(user_name)
+                if name not in self.tracks:
+                    try:
+                        self.tracks[name] = self.__create_track(route, name)
+                        LOG.info("routing %s to %s", user_name, name)
+                    except Exception as ex:
+                        LOG.error("cannot create track %s, dropping the sound routed to it: %s", name, ex)
+                        self.tracks[name] = NullTrack(name)
+                track = self.tracks[name]
+                break
+        self.__user_tracks[user_name] = track
+        return track
+
+    def dispatch(self):
+        """Commit the sound mixed in this cycle and flush all tracks"""
+        for name, track in self.tracks.items():
+            track.commit()
+            try:
+                track.flush()
+            except Exception as ex:
+                now = time.monotonic()
+                if now >= self.__error_ts.get(name, -self.error_interval) + self.error_interval:
+                    self.__error_ts[name] = now
+                    LOG.error("track %s: %s", name, ex)
+
+    def pending(self):
+        """True if a track must be flushed again before more sound arrives"""
+        return any(track.pending() for track in self.tracks.values())
+
+    def dropped(self):
+        """Bytes dropped per track because the sink could not keep up"""
+        return {name: track.dropped_bytes for name, track in self.tracks.items()}
+
+    def close(self):
+        """Close all tracks"""
+        for track in self.tracks.values():
+            track.close()
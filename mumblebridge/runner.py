@@ -0,0 +1,139 @@
+""" Thread runners shared by mumblestream and mumblelistener """
+from threading import Thread
+import logging
+import collections
+import time
+
+from .scheduler import Scheduler
+
+LOG = logging.getLogger(__name__)
+
+
+class Status(collections.UserList):
+    """Thread status handler. Also holds the audio statistics of each pipeline"""
+
+    def __init__(self, runner_obj):
+        self.__runner_obj = runner_obj
+        self.scheme = collections.namedtuple("thread_info", ("name", "alive"))
+        super().__init__(self.__gather_status())
+        self.stats = runner_obj.stats()
+
+    def __gather_status(self):
+        """Gather status"""
+        result = []
+        for meta in self.__runner_obj.values():
+            result.append(self.scheme(meta["process"].name, meta["process"].is_alive()))
+        return result
+
+    def __repr__(self):
+        repr_str = ""
+        for status in self:
+            repr_str += f"[{status.name}] alive: {status.alive} "
+        for name, stats in self.stats.items():
+            stream = stats["stream"]
+            repr_str += f"[{name}] rms: {stream['rms']}dB floor: {stream['noise_floor']}dB duty: {stream['duty_cycle']} clip: {stream['clip_rate']} silence: {stream['silence']}s "
+        return repr_str
+
+
+class Runner(collections.UserDict):
+    """Runs a list of threads"""
+
+    def __init__(self, run_dict, args_dict=None):
+        self.is_ready = False
+        if run_dict is not None:
+            super().__init__(run_dict)
+            self.change_args(args_dict)
+            self.run()
+
+    def change_args(self, args_dict):
+        """Copy arguments"""
+        for name, value in self.items():
+            if name in args_dict:
+                value["args"] = args_dict[name]["args"]
+                value["kwargs"] = args_dict[name]["kwargs"]
+            else:
+                value["args"] = None
+                value["kwargs"] = None
+
+    def run(self):
+        """Spawns threads"""
+        for name, cdict in self.items():
+            LOG.info("generating process")
+            # fmt: off
+            cdict["process"] = Thread(
+                name=name,
+                target=cdict["func"],
+                args=cdict["args"],
+                kwargs=cdict["kwargs"]
+            )
+            # fmt: on
+            LOG.info("starting process")
+            cdict["process"].daemon = True
+            cdict["process"].start()
+            LOG.info("%s started", name)
+        LOG.info("all done")
+        self.is_ready = True
+
+    def status(self):
+        """Return a status"""
+        if self.is_ready:
+            return Status(self)
+        return []
+
+    def stats(self):
+        """Return the audio statistics of each stream"""
+        return {}
+
+    def stop(self, name=""):
+        """Stop and exit"""
+        raise NotImplementedError("Sorry")
+
+
+class MumbleRunner(Runner):
+    """A threads runner for Mumble"""
+
+    def __init__(self, mumble_object, config, args_dict):
+        self.mumble = mumble_object
+        self.config = config
+        self.pipelines = {}
+        self.parameters = {}
+        self.meters = {}
+        self.stats_meters = {}
+        self.scheduler = Scheduler()
+        super().__init__(self._config(), args_dict)
+
+    def _config(self):
+        """Initial configuration"""
+        raise NotImplementedError("please inherit and implement")
+
+    def timings(self):
+        """Return per stage timings of all pipelines"""
+        return {name: pipeline.timings() for name, pipeline in self.pipelines.items()}
+
+    def reconfigure(self, config):
+        """Apply only the differences of a new configuration. Returns the names of the applied settings"""
+        changed = {name for name, value in config.items() if name != "args" and value != self.config.get(name)}
+        applied = set()
+        for name in changed & set(self.parameters):
+            self.parameters[name].set(config[name])
+            applied.add(name)
+        applied |= self._reconfigure(config, changed - applied)
+        for name in sorted(changed - applied):
+            LOG.warning("%s change needs a restart", name)
+        for name in applied:
+            self.config[name] = config[name]
+            LOG.info("%s set to %s", name, config[name])
+        return applied
+
+    def _reconfigure(self, config, changed):
+        """Apply changed settings that are not parameters. Returns the names of the applied settings"""
+        return set()
+
+    def levels(self):
+        """Return the last frame levels of all metered pipelines"""
+        return {name: meter.levels() for name, meter in self.meters.items()}
+
+    def stats(self):
+        """Return the running statistics of all pipelines and of their talkers"""
+        now = time.time()
+        return {name: meter.snapshot(now) for name, meter in self.stats_meters.items()}
@@ -0,0 +1,168 @@
+""" One-shot timers run by a single thread
+
+Deadlines (PTT hang, talker timeout, status reports) used to be checked by threads waking up every few
+milliseconds. The Scheduler keeps them in a heap ordered by monotonic time and sleeps until the earliest one or
+until a timer is added. Audio threads arm timers and never wait for them. Cancelled timers are dropped when they
+reach the top of the heap. Lateness of the fired timers is measured for the status report.
+
+A Hang calls its callback hang seconds after the last touch(). Touching it on every packet only stores a time:
+the timer is re-armed once per hang period at most.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class Timer:
+    """Handle of a scheduled callback"""
+
+    __slots__ = ("when", "callback", "cancelled")
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        """Do not call the callback"""
+        self.cancelled = True
+
+
+class Scheduler:
+    """Calls callbacks at monotonic times from the thread running run()"""
+
+    def __init__(self):
+        self.fired = 0
+        self.lateness = 0.0
+        self.max_lateness = 0.0
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__wakeup = threading.Condition()
+        self.__running = False
+        self.__thread = None
+
+    def call_at(self, when, callback):
+        """Call callback at monotonic time when. Returns a Timer"""
+        timer = Timer(when, callback)
+        with self.__wakeup:
+            heapq.heappush(self.__heap, (when, next(self.__counter), timer))
+            if self.__heap[0][2] is timer:
+                self.__wakeup.notify()
+        return timer
+
+    def call_later(self, delay, callback):
+        """Call callback in delay seconds. Returns a Timer"""
+        return self.call_at(time.monotonic() + delay, callback)
+
+    def every(self, interval, callback):
+        """Call callback every interval seconds without cumulating delays. Returns a Timer cancelling all calls"""
+        handle = Timer(time.monotonic() + interval, callback)
+
+        def tick():
+            if handle.cancelled:
+                return
+            handle.when += interval
+            self.call_at(handle.when, tick)
+            callback()
+
+        self.call_at(handle.when, tick)
+        return handle
+
+    def run(self):
+        """Run the due callbacks until stop()"""
+        self.__running = True
+        while True:
+            with self.__wakeup:
+                while self.__running:
+                    if not self.__heap:
+                        self.__wakeup.wait()
+                        continue
+                    when, _, timer = self.__heap[0]
+                    if timer.cancelled:
+                        heapq.heappop(self.__heap)
+                        continue
+                    delay = when - time.monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self.__heap)
+                        break
+                    self.__wakeup.wait(delay)
+                else:
+                    return
+            late = -delay
+            self.fired += 1
+            self.lateness += late
+            self.max_lateness = max(self.max_lateness, late)
+            try:
+                timer.callback()
+            except Exception as ex:  # a failing callback must not stop the other timers
+                LOG.exception("timer callback %s: %s", timer.callback, ex)
+
+    def start(self):
+        """Run the callbacks in a daemon thread"""
+        self.__thread = threading.Thread(name="scheduler", target=self.run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Make run() return"""
+        with self.__wakeup:
+            self.__running = False
+            self.__wakeup.notify()
+
+    def __repr__(self):
+        mean = self.lateness / self.fired if self.fired else 0.0
+        return f"timers: {len(self.__heap)} fired: {self.fired} lateness mean: {mean * 1000:.2f}ms max: {self.max_lateness * 1000:.2f}ms"
+
+
+class Hang:
+    """Calls on_expire hang seconds after the last touch() unless touched again"""
+
+    def __init__(self, scheduler, hang, on_expire):
+        self.scheduler = scheduler
+        self.hang = hang
+        self.on_expire = on_expire
+        self.last = None
+        self.__timer = None
+        self.__lock = threading.Lock()
+
+    @property
+    def active(self):
+        """True between the first touch() and the expiry"""
+        return self.__timer is not None
+
+    def touch(self):
+        """Restart the hang period. Returns True if the hang was not active"""
+        with self.__lock:
+            self.last = time.monotonic()
+            if self.__timer is not None:
+                return False
+            self.__arm(self.last + self.hang)
+            return True
+
+    def cancel(self):
+        """Stop without calling on_expire"""
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+
+    def __arm(self, deadline):
+        """Schedule the expiry check. Called with the lock held so the timer is known before it can fire"""
+        armed = []
+        self.__timer = self.scheduler.call_at(deadline, lambda: self.__expire(armed))
+        armed.append(self.__timer)
+
+    def __expire(self, armed):
+        """Timer callback: re-arm if touched since else expire"""
+        with self.__lock:
+            if self.__timer is not armed[0]:  # cancelled, maybe touched again since
+                return
+            deadline = self.last + self.hang
+            if deadline > time.monotonic():
+                self.__arm(deadline)
+                return
+            self.__timer = None
+        self.on_expire()
@@ -0,0 +1,423 @@
+""" Pipeline stages for PortAudio devices, Mumble and level handling """
+import collections
+import logging
+import threading
+import time
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+from .latency import set_packet_length
+from .pipeline import Source, Processor, Sink, FRAME_MAX_SAMPLES
+
+LOG = logging.getLogger(__name__)
+
+
+class PyAudioSource(Source):
+    """Reads packets from a PortAudio input device
+
+    The stream is re-opened when the latency level changes or when another device is requested with reopen().
+    With pulse_name the stream is moved to this PulseAudio source each time it is opened. PyAudio closes the
+    stream when it raises an overflow, so an overflow is reported when more than a PortAudio buffer of input
+    waits to be read instead.
+    """
+
+    name = "pyaudio_in"
+
+    def __init__(self, devices, device_index, latency, pulse_name=None):
+        self.devices = devices
+        self.device_index = device_index
+        self.latency = latency
+        self.pulse_name = pulse_name
+        self.__generation = latency.generation
+        self.__reopen = None
+        self.__open()
+
+    def __open(self):
+        """Open the stream on the current device"""
+        self.stream = self.devices.open_input(self.device_index, self.latency.frames_per_buffer)
+        if self.pulse_name is not None:  # redirect input to mumblestream with pulseaudio
+            self.devices.move_input_pulseaudio(self.pulse_name)
+
+    def reopen(self, device_index, pulse_name=None):
+        """Switch to another device before the next read"""
+        self.__reopen = (device_index, pulse_name)
+
+    def read(self, frame):
+        if self.__generation != self.latency.generation or self.__reopen is not None:
+            self.__generation = self.latency.generation
+            self.stream.close()
+            if self.__reopen is not None:
+                self.device_index, self.pulse_name = self.__reopen
+                self.__reopen = None
+            self.__open()
+        if self.stream.get_read_available() > self.latency.frames_per_buffer:
+            LOG.debug("input overflow")
+            self.latency.overflow()
+        return frame.load(self.stream.read(self.latency.chunk_size, exception_on_overflow=False))
+
+    def close(self):
+        self.stream.close()
+        LOG.debug("input stream closed")
+
+
+class PyAudioSink(Sink):
+    """Writes frames to a PortAudio output device
+
+    The stream is re-opened when the latency level changes or when another device is requested with reopen().
+    With pulse_name the stream is moved to this PulseAudio sink each time it is opened. PyAudio closes the
+    stream when it raises an underflow, so an underrun is reported when the PortAudio buffer is found empty
+    before a write instead.
+    """
+
+    name = "pyaudio_out"
+
+    def __init__(self, devices, device_index, latency, hold=0.5, pulse_name=None):
+        self.devices = devices
+        self.device_index = device_index
+        self.latency = latency
+        self.hold = hold
+        self.pulse_name = pulse_name
+        self.__generation = latency.generation
+        self.__reopen = None
+        self.__write_ts = None
+        self.__open()
+
+    def __open(self):
+        """Open the stream on the current device"""
+        if self.pulse_name is None:
+            self.stream = self.devices.open_output(self.device_index, self.latency.frames_per_buffer)
+        else:  # redirect output from mumblestream with pulseaudio
+            self.stream = self.devices.open_output_moved(self.device_index, self.latency.frames_per_buffer, self.pulse_name)
+        self.__capacity = self.stream.get_write_available()  # the buffer is empty
+
+    def reopen(self, device_index, pulse_name=None):
+        """Switch to another device before the next write"""
+        self.__reopen = (device_index, pulse_name)
+
+    def write(self, frame):
+        continuous = self.__write_ts is not None and frame.timestamp < self.__write_ts + self.hold
+        self.__write_ts = frame.timestamp
+        if self.__generation != self.latency.generation or self.__reopen is not None:
+            self.__generation = self.latency.generation
+            self.stream.close()
+            if self.__reopen is not None:
+                self.device_index, self.pulse_name = self.__reopen
+                self.__reopen = None
+            self.__open()
+            continuous = False
+        if continuous and 0 < self.__capacity <= self.stream.get_write_available():  # an underrun between two overs is expected
+            LOG.debug("output underrun")
+            self.latency.underrun()
+        self.stream.write(frame.tobytes(), exception_on_underflow=False)
+
+    def close(self):
+        self.stream.close()
+        LOG.debug("output stream closed")
+
+
+class MumbleSink(Sink):
+    """Queues frames to the pymumble sound output. Applies the latency packet length to pymumble
+
+    With a SendBacklog the send queue is kept within its latency budget.
+    """
+
+    name = "mumble_out"
+
+    def __init__(self, mumble, latency, drift=None, backlog=None):
+        self.mumble = mumble
+        self.latency = latency
+        self.drift = drift
+        self.backlog = backlog
+        self.__generation = latency.generation
+
+    def write(self, frame):
+        if self.__generation != self.latency.generation:
+            self.__generation = self.latency.generation
+            set_packet_length(self.mumble.sound_output, self.latency.packet_length)
+        if self.backlog is not None:
+            self.backlog.queue(self.mumble.sound_output, frame)
+        else:
+            self.mumble.sound_output.add_sound(frame.tobytes())
+        depth = self.mumble.sound_output.get_buffer_size()
+        self.latency.queue_depth(depth)
+        if self.drift is not None:  # the queue holds between one and two packets when the clocks agree
+            self.drift.report(depth - 2 * self.latency.packet_length, frame.timestamp)
+
+
+class QueueSource(Source):
+    """Jitter buffer between a producer thread calling put() and the pipeline thread
+
+    read() blocks while nothing is queued. Playout starts when prebuffer seconds are queued or timeout seconds
+    after the first sound. Sound older than max_depth seconds is dropped. The fill error against prebuffer,
+    measured before each packet is taken, is reported to the optional drift estimator. Running empty while
+    playing reports the whole prebuffer as missing. The fill can only be seen going under its target with a
+    prebuffer of two packets or more. interrupt() wakes up a blocked read() for good. clock gives the time of
+    the reports.
+    """
+
+    name = "queue_in"
+
+    def __init__(self, prebuffer, max_depth=1, timeout=0.1, drift=None, clock=time.time):
+        self.prebuffer = prebuffer
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.drift = drift
+        self.clock = clock
+        self.dropped = 0
+        self.__queue = collections.deque()
+        self.__depth = 0
+        self.__playing = False
+        self.__closed = False
+        self.__ready = threading.Condition()
+
+    def depth(self):
+        """Queued sound in seconds"""
+        return self.__depth / pymumble.constants.PYMUMBLE_SAMPLERATE
+
+    def put(self, pcm, user=None):
+        """Queue 16 bit PCM bytes"""
+        with self.__ready:
+            self.__queue.append((pcm, user))
+            self.__depth += len(pcm) // 2
+            while self.depth() > self.max_depth:
+                self.__depth -= len(self.__queue.popleft()[0]) // 2
+                self.dropped += 1
+            self.__ready.notify()
+
+    def read(self, frame):
+        with self.__ready:
+            if not self.__playing:
+                self.__ready.wait_for(lambda: self.__queue or self.__closed)
+                self.__ready.wait_for(lambda: self.depth() >= self.prebuffer or self.__closed, self.timeout)
+            depth = self.depth()
+            if not self.__queue:
+                if self.__playing and self.drift is not None:  # underrun
+                    self.drift.report(-self.prebuffer, self.clock())
+                self.__playing = False
+                return None
+            self.__playing = True
+            pcm, user = self.__queue.popleft()
+            self.__depth -= len(pcm) // 2
+        frame.load(pcm, user)
+        if self.drift is not None:
+            self.drift.report(depth - self.prebuffer, self.clock())
+        return frame
+
+    def interrupt(self):
+        """Make read() return None from now on. Can be called from another thread"""
+        with self.__ready:
+            self.__closed = True
+            self.__ready.notify_all()
+
+    def close(self):
+        self.interrupt()
+
+
+class FifoSource(Source):
+    """Reads packets of raw 16 bit PCM from a FIFO. The FIFO is re-opened when the writer closes it"""
+
+    name = "fifo_in"
+
+    def __init__(self, path, latency):
+        self.path = path
+        self.latency = latency
+        self.fifo = None
+
+    def read(self, frame):
+        while True:
+            if self.fifo is None:
+                self.fifo = open(self.path, "rb")  # pylint: disable=consider-using-with
+            data = self.fifo.read(self.latency.chunk_size * 2)
+            if data:
+                return frame.load(data[: len(data) // 2 * 2])
+            self.fifo.close()
+            self.fifo = None
+
+    def close(self):
+        if self.fifo is not None:
+            self.fifo.close()
+
+
+class MumbleMixSource(Source):
+    """Mixes the sound received from every Mumble user
+
+    Sound is queued per user by the pymumble sound received callback which wakes up read(). read() blocks until
+    sound arrives, a talker is silent for hold seconds, the router tracks need a flush or interrupt() is called,
+    and returns None when no user has sound. Users with a track in the optional router are sent to their track
+    instead of the mix. The sound of each user is accounted to the optional StatsMeter before mixing.
+    """
+
+    name = "mumble_mix"
+
+    def __init__(self, mumble, hold=0.5, router=None, stats=None, flush_interval=0.01):
+        self.mumble = mumble
+        self.hold = hold
+        self.router = router
+        self.stats = stats
+        self.flush_interval = flush_interval
+        self.in_users = {}
+        self.__mix = np.zeros(FRAME_MAX_SAMPLES, dtype=np.int32)
+        self.__queues = {}
+        self.__closed = False
+        self.__ready = threading.Condition()
+        self.mumble.callbacks.add_callback(pymumble.constants.PYMUMBLE_CLBK_SOUNDRECEIVED, self.__sound_received)
+
+    def __sound_received(self, user, soundchunk):
+        """Pymumble sound received callback"""
+        with self.__ready:
+            self.__queues.setdefault(user["name"], collections.deque()).append(soundchunk.pcm)
+            self.__ready.notify()
+
+    def __timeout(self, now):
+        """Seconds until the next talker hold expires or the router tracks need a flush. None if nothing is due"""
+        deadlines = [last + self.hold for last in self.in_users.values()]
+        if self.router is not None and self.router.pending():
+            deadlines.append(now + self.flush_interval)
+        return max(0.0, min(deadlines) - now) if deadlines else None
+
+    def read(self, frame):
+        with self.__ready:
+            self.__ready.wait_for(lambda: self.__closed or any(self.__queues.values()), self.__timeout(time.time()))
+            chunks = [(user_name, queue.popleft()) for user_name, queue in self.__queues.items() if queue]
+        length = 0
+        now = time.time()
+        talkers = []
+        for user_name, chunk in chunks:
+            if user_name not in self.in_users:
+                LOG.debug("start receiving audio from %s", user_name)
+            self.in_users[user_name] = now
+            pcm = np.frombuffer(chunk, dtype=np.int16)[:FRAME_MAX_SAMPLES]
+            if self.stats is not None:
+                self.stats.update(user_name, pcm, now)
+            track = self.router.track(user_name) if self.router is not None else None
+            if track is not None:
+                track.add(pcm)
+                continue
+            talkers.append(user_name)
+            if length == 0:
+                self.__mix[: len(pcm)] = pcm
+            else:
+                self.__mix[length : len(pcm)] = 0
+                self.__mix[: len(pcm)] += pcm
+            length = max(length, len(pcm))
+        for user_name, last in list(self.in_users.items()):
+            if now >= last + self.hold:
+                LOG.debug("stop receiving audio from %s", user_name)
+                self.in_users.pop(user_name)
+        if self.router is not None:
+            self.router.dispatch()
+        if length == 0:
+            return None
+        np.clip(self.__mix[:length], -32768, 32767, out=frame.samples[:length], casting="unsafe")
+        frame.length = length
+        frame.user = "+".join(talkers)
+        frame.timestamp = now
+        frame.active = True
+        return frame
+
+    def interrupt(self):
+        """Make read() stop waiting for sound. Can be called from another thread"""
+        with self.__ready:
+            self.__closed = True
+            self.__ready.notify_all()
+
+    def close(self):
+        self.interrupt()
+        self.mumble.callbacks.remove_callback(pymumble.constants.PYMUMBLE_CLBK_SOUNDRECEIVED, self.__sound_received)
+        if self.router is not None:
+            self.router.close()
+
+
+class VoxGate(Processor):
+    """Opens on a sample above threshold and closes after silence_time seconds below threshold
+
+    Subclasses change what opens the gate by overriding detect(). With a squelch (an object with a tone_present
+    attribute such as ToneDecoder) frames without the tone count as below threshold.
+    """
+
+    name = "vox"
+
+    def __init__(self, threshold, silence_time, squelch=None):
+        self.threshold = threshold
+        self.silence_time = silence_time
+        self.squelch = squelch
+        self.is_open = False
+        self.__quiet_time = 0
+
+    def detect(self, frame):
+        """True if the frame holds sound to send"""
+        return frame.peak() > self.threshold
+
+    def process(self, frame):
+        sound = self.detect(frame)
+        if self.squelch is not None and not self.squelch.tone_present:
+            sound = False
+        if not self.is_open:
+            if sound:
+                LOG.debug("audio on")
+                self.is_open = True
+                self.__quiet_time = 0
+        elif not sound:
+            self.__quiet_time += frame.duration
+            if self.__quiet_time >= self.silence_time:
+                LOG.debug("audio off")
+                self.is_open = False
+        else:
+            self.__quiet_time = 0
+        frame.active = self.is_open
+
+
+class Volume(Processor):
+    """Applies a volume factor with clipping"""
+
+    name = "volume"
+
+    def __init__(self, volume):
+        self.volume = volume
+        self.__scaled = np.zeros(FRAME_MAX_SAMPLES, dtype=np.float32)
+
+    def process(self, frame):
+        if self.volume == 1:
+            return
+        scaled = self.__scaled[: frame.length]
+        np.multiply(frame.data, self.volume, out=scaled)
+        np.clip(scaled, -32768, 32767, out=scaled)
+        frame.data[:] = scaled
+
+
+class LevelMeter(Processor):
+    """Keeps the peak and RMS levels of the last frame"""
+
+    name = "meter"
+
+    def __init__(self):
+        self.peak = 0
+        self.rms = 0.0
+        self.__samples = np.zeros(FRAME_MAX_SAMPLES, dtype=np.float32)
+
+    def process(self, frame):
+        self.peak = frame.peak()
+        if frame.length == 0:
+            self.rms = 0.0
+            return
+        samples = self.__samples[: frame.length]
+        np.copyto(samples, frame.data)
+        self.rms = float(np.sqrt(np.dot(samples, samples) / frame.length))
+
+    def levels(self):
+        """Last frame levels as a dictionary"""
+        return {"peak": self.peak, "rms": round(self.rms, 1)}
+
+
+class Mute(Processor):
+    """Keeps frames from gated sinks while muted"""
+
+    name = "mute"
+
+    def __init__(self, muted=False):
+        self.muted = muted
+
+    def process(self, frame):
+        if self.muted:
+            frame.active = False
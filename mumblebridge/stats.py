@@ -0,0 +1,139 @@
+""" Running audio statistics of each stream for dashboards and alerting
+
+Every chunk updates a fixed set of accumulators per stream: exponentially weighted power, peak, clip rate and
+talk duty cycle over time_constant seconds, an adaptive noise floor and running totals. The update costs a few
+numpy reductions over the chunk whatever the stream age. Levels are in dB relative to full scale.
+
+A chunk is talk when its power is snr dB above the noise floor. The floor follows the chunk power down at once
+and rises by floor_rise dB per second at most, as in the voice activity detector. A long silence (dead air)
+shows as a growing "silence" and an over-driven link as a non zero "clip_rate".
+"""
+import collections
+import math
+import threading
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+from .pipeline import Processor, FRAME_MAX_SAMPLES
+
+SAMPLERATE = pymumble.constants.PYMUMBLE_SAMPLERATE
+FULL_SCALE = 32768.0
+CLIP_LEVEL = 32767
+MIN_DB = -100.0
+
+
+def to_db(power):
+    """Power relative to full scale in dB"""
+    return max(MIN_DB, 10 * math.log10(power / (FULL_SCALE * FULL_SCALE) + 1e-10))
+
+
+class StreamStats:
+    """Accumulators of one stream"""
+
+    __slots__ = ("power", "peak", "clip_rate", "duty_cycle", "floor", "time", "talk_time", "clipped", "start", "last_talk")
+
+    def __init__(self):
+        self.power = 0.0
+        self.peak = 0.0
+        self.clip_rate = 0.0
+        self.duty_cycle = 0.0
+        self.floor = None
+        self.time = 0.0
+        self.talk_time = 0.0
+        self.clipped = 0
+        self.start = None
+        self.last_talk = None
+
+    def as_dict(self, now):
+        """Statistics as a dictionary"""
+        last_talk = self.last_talk or self.start or now
+        # fmt: off
+        return {
+            "rms": round(to_db(self.power), 1),
+            "peak": round(to_db(self.peak * self.peak), 1),
+            "noise_floor": round(self.floor if self.floor is not None else MIN_DB, 1),
+            "clip_rate": round(self.clip_rate, 6),
+            "duty_cycle": round(self.duty_cycle, 3),
+            "silence": round(max(0.0, now - last_talk), 1),
+            "time": round(self.time, 1),
+            "talk_time": round(self.talk_time, 1),
+            "clipped": self.clipped,
+        }
+        # fmt: on
+
+
+class StatsMeter(Processor):
+    """Keeps StreamStats of the pipeline stream and, with per_user, of each talker
+
+    Sources that see the talkers before they are mixed call update() for each of them. At most max_users
+    talkers are kept, the least recently heard one is forgotten first.
+    """
+
+    name = "stats"
+
+    def __init__(self, per_user=False, time_constant=10, snr=9, floor_rise=1, max_users=64):
+        self.per_user = per_user
+        self.time_constant = time_constant
+        self.snr = snr
+        self.floor_rise = floor_rise
+        self.max_users = max_users
+        self.stream = StreamStats()
+        self.users = collections.OrderedDict()
+        self.__samples = np.zeros(FRAME_MAX_SAMPLES, dtype=np.float32)
+        self.__lock = threading.Lock()
+
+    def __user(self, name):
+        """Accumulators of a talker, created if needed"""
+        with self.__lock:
+            stats = self.users.get(name)
+            if stats is None:
+                stats = self.users[name] = StreamStats()
+                if len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            else:
+                self.users.move_to_end(name)
+        return stats
+
+    def update(self, user, data, timestamp):
+        """Account a chunk of 16 bit samples of a talker, or of the pipeline stream if user is None"""
+        length = min(len(data), len(self.__samples))
+        if length == 0:
+            return
+        samples = self.__samples[:length]
+        np.copyto(samples, data[:length])
+        power = float(np.dot(samples, samples)) / length
+        peak = max(float(samples.max()), -float(samples.min()))
+        clipped = int(np.count_nonzero(samples >= CLIP_LEVEL)) + int(np.count_nonzero(samples <= -CLIP_LEVEL))
+        duration = length / SAMPLERATE
+        stats = self.stream if user is None else self.__user(user)
+        if stats.start is None:  # start the averages from the first chunk
+            stats.start = timestamp
+            stats.power = power
+        energy = to_db(power)
+        if stats.floor is None or energy < stats.floor:
+            stats.floor = energy
+        else:
+            stats.floor += self.floor_rise * duration
+        talk = energy >= stats.floor + self.snr
+        weight = 1 - math.exp(-duration / self.time_constant)
+        stats.power += weight * (power - stats.power)
+        stats.peak = max(peak, stats.peak * (1 - weight))
+        stats.clip_rate += weight * (clipped / length - stats.clip_rate)
+        stats.duty_cycle += weight * (talk - stats.duty_cycle)
+        stats.time += duration
+        stats.clipped += clipped
+        if talk:
+            stats.talk_time += duration
+            stats.last_talk = timestamp
+
+    def process(self, frame):
+        self.update(None, frame.data, frame.timestamp)
+        if self.per_user and frame.user is not None:
+            self.update(frame.user, frame.data, frame.timestamp)
+
+    def snapshot(self, now):
+        """Statistics of the stream and of each talker as a dictionary"""
+        with self.__lock:
+            users = list(self.users.items())
+        return {"stream": self.stream.as_dict(now), "users": {name: stats.as_dict(now) for name, stats in users}}
@@ -0,0 +1,215 @@
+""" DTMF and CTCSS tone detection on captured audio
+
+Tone powers are computed per chunk as single DFT bins (the block form of the Goertzel algorithm) with one
+matrix product over the whole chunk for all frequencies. DTMF uses the full rate chunk. CTCSS tones are too
+close to each other for a 20 ms chunk so the chunk is low-pass filtered and decimated to 1 kHz into a 0.5
+second ring buffer. Voice pitch falls in the CTCSS band too but its energy is spread by the pitch changes:
+the tone bin must stand above the bins of the neighbouring CTCSS tones, not only above the band energy.
+Voice pitch that stays on the tone frequency hides the tone until it moves away.
+"""
+import logging
+
+import numpy as np
+import pymumble_py3 as pymumble
+
+from .pipeline import Processor
+
+LOG = logging.getLogger(__name__)
+
+SAMPLERATE = pymumble.constants.PYMUMBLE_SAMPLERATE
+DTMF_LOW = (697, 770, 852, 941)
+DTMF_HIGH = (1209, 1336, 1477, 1633)
+DTMF_KEYS = ("123A", "456B", "789C", "*0#D")
+CTCSS_TONES = (
+    67.0, 69.3, 71.9, 74.4, 77.0, 79.7, 82.5, 85.4, 88.5, 91.5, 94.8, 97.4, 100.0, 103.5, 107.2, 110.9, 114.8, 118.8,
+    123.0, 127.3, 131.8, 136.5, 141.3, 146.2, 151.4, 156.7, 159.8, 162.2, 165.5, 167.9, 171.3, 173.8, 177.3, 179.9,
+    183.5, 186.2, 189.9, 192.8, 196.6, 199.5, 203.5, 206.5, 210.7, 218.1, 225.7, 229.1, 233.6, 241.8, 250.3, 254.1,
+)  # fmt: skip
+CTCSS_DECIMATION = 48
+CTCSS_CUTOFF = 400
+CTCSS_HARMONIC_MAX = 350  # highest second harmonic left by the low-pass filter
+CTCSS_TAPS = 16 * CTCSS_DECIMATION
+
+
+def lowpass_kernel(cutoff, taps, samplerate):
+    """Hamming windowed sinc low-pass FIR kernel with unit DC gain"""
+    times = np.arange(taps) - (taps - 1) / 2
+    kernel = np.sinc(2 * cutoff / samplerate * times) * np.hamming(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def ctcss_neighbours(tone):
+    """Standard CTCSS tones on each side of a tone, or tones 3% away for a non standard one"""
+    lower = [frequency for frequency in CTCSS_TONES if frequency < tone - 1]
+    higher = [frequency for frequency in CTCSS_TONES if frequency > tone + 1]
+    return (lower[-1] if lower else tone * 0.97, higher[0] if higher else tone * 1.03)
+
+
+class ToneBank:
+    """DFT bins of a set of frequencies. Bases are cached per block length
+
+    With window the bins are computed on the Hann windowed block: less leakage from strong nearby frequencies.
+    """
+
+    def __init__(self, frequencies, samplerate, window=False):
+        self.frequencies = np.asarray(frequencies, dtype=np.float32)
+        self.samplerate = samplerate
+        self.window = window
+        self.__bases = {}
+
+    def __basis(self, length):
+        """Stacked cosine and sine basis for a block length, windowed and scaled to the window power gain"""
+        if length not in self.__bases:
+            phase = 2 * np.pi * np.outer(self.frequencies, np.arange(length)) / self.samplerate
+            basis = np.vstack((np.cos(phase), np.sin(phase)))
+            if self.window:
+                window = np.hanning(length)
+                basis *= window / np.sqrt(np.mean(window**2))
+            self.__bases[length] = basis.astype(np.float32)
+        return self.__bases[length]
+
+    def ratios(self, block):
+        """Share of the block energy carried by each frequency (about 1 for a pure tone)"""
+        energy = float(np.dot(block, block))
+        if energy == 0:
+            return np.zeros(len(self.frequencies), dtype=np.float32)
+        bins = self.__basis(len(block)) @ block
+        count = len(self.frequencies)
+        powers = bins[:count] ** 2 + bins[count:] ** 2
+        return 2 * powers / (len(block) * energy)
+
+
+class ToneDecoder(Processor):
+    """Detects DTMF digits and a CTCSS tone in each frame
+
+    A DTMF digit counts once it has been heard for min_digit_time seconds. Completed DTMF sequences that are
+    keys of commands are passed to on_command with their value. The CTCSS tone is seen when its bin holds
+    ctcss_ratio of the filtered band energy, ctcss_margin times the power of the neighbouring tone bins and
+    ctcss_harmonic times the power of its second harmonic (voice pitch has harmonics, the tone has none) for
+    ctcss_confirm seconds in a row. tone_present tells if it was seen in the last hang seconds. It can be used
+    as a squelch by VoxGate.
+    """
+
+    name = "tones"
+
+    # fmt: off
+    def __init__(self, ctcss_tone=None, commands=None, on_command=None, min_level=100, min_digit_time=0.04,
+                 ctcss_ratio=0.005, ctcss_margin=3, ctcss_harmonic=10, ctcss_confirm=0.15, hang=0.3, sequence_timeout=3):
+        # fmt: on
+        self.ctcss_tone = ctcss_tone
+        self.commands = commands or {}
+        self.on_command = on_command
+        self.min_level = min_level
+        self.min_digit_time = min_digit_time
+        self.ctcss_ratio = ctcss_ratio
+        self.ctcss_margin = ctcss_margin
+        self.ctcss_harmonic = ctcss_harmonic
+        self.ctcss_confirm = ctcss_confirm
+        self.hang = hang
+        self.sequence_timeout = sequence_timeout
+        self.tone_present = ctcss_tone is None
+        self.sequence = ""
+        self.__dtmf_bank = ToneBank(DTMF_LOW + DTMF_HIGH, SAMPLERATE)
+        self.__samples = np.zeros(0, dtype=np.float32)
+        self.__digit = None
+        self.__digit_time = 0.0
+        self.__digit_ts = 0
+        if ctcss_tone is not None:
+            frequencies = (ctcss_tone,) + ctcss_neighbours(ctcss_tone)
+            if 2 * ctcss_tone <= CTCSS_HARMONIC_MAX:
+                frequencies += (2 * ctcss_tone,)
+            self.__ctcss_bank = ToneBank(frequencies, SAMPLERATE / CTCSS_DECIMATION, window=True)
+            self.__kernel = lowpass_kernel(CTCSS_CUTOFF, CTCSS_TAPS, SAMPLERATE)
+            self.__history = np.zeros(CTCSS_TAPS - 1, dtype=np.float32)
+            self.__phase = 0
+            self.__ring = np.zeros(SAMPLERATE // CTCSS_DECIMATION // 2, dtype=np.float32)
+            self.__ring_fill = 0
+            self.__tone_time = 0.0
+            self.__tone_ts = 0
+
+    def process(self, frame):
+        if frame.length == 0:
+            return
+        if len(self.__samples) < frame.length:
+            self.__samples = np.zeros(frame.length, dtype=np.float32)
+        samples = self.__samples[: frame.length]
+        np.copyto(samples, frame.data)
+        now = frame.timestamp
+        self.__detect_dtmf(samples, now, frame.duration)
+        if self.ctcss_tone is not None:
+            self.__detect_ctcss(samples, now, frame.duration)
+
+    def dtmf_digit(self, samples):
+        """DTMF digit present in the samples or None"""
+        if np.sqrt(np.dot(samples, samples) / len(samples)) < self.min_level:
+            return None
+        ratios = self.__dtmf_bank.ratios(samples)
+        low = int(np.argmax(ratios[:4]))
+        high = int(np.argmax(ratios[4:]))
+        low_ratio = ratios[low]
+        high_ratio = ratios[4 + high]
+        if low_ratio < 0.2 or high_ratio < 0.2 or low_ratio + high_ratio < 0.7:
+            return None
+        twist = high_ratio / low_ratio
+        if twist > 10 ** 0.4 or twist < 10 ** -0.8:  # 4 dB reverse twist, 8 dB normal twist
+            return None
+        return DTMF_KEYS[low][high]
+
+    def __detect_dtmf(self, samples, now, duration):
+        """Debounce digits over min_digit_time seconds whatever the frame length and complete sequences"""
+        digit = self.dtmf_digit(samples)
+        if self.sequence and now > self.__digit_ts + self.sequence_timeout:
+            LOG.debug("DTMF sequence %s timed out", self.sequence)
+            self.sequence = ""
+        if digit is None or digit != self.__digit:
+            self.__digit = digit
+            self.__digit_time = 0.0
+        if digit is None:
+            return
+        counted = self.__digit_time >= self.min_digit_time
+        self.__digit_time += duration
+        if counted or self.__digit_time < self.min_digit_time:
+            return
+        self.sequence += digit
+        self.__digit_ts = now
+        LOG.debug("DTMF %s", self.sequence)
+        if self.sequence in self.commands:
+            sequence, self.sequence = self.sequence, ""
+            LOG.info("DTMF command %s", sequence)
+            if self.on_command is not None:
+                try:
+                    self.on_command(self.commands[sequence])
+                except Exception as ex:
+                    LOG.error("DTMF command %s failed: %s", sequence, ex)
+        elif not any(key.startswith(self.sequence) for key in self.commands):
+            self.sequence = ""
+
+    def __decimate(self, samples):
+        """Low-pass filter and decimate the samples to the CTCSS rate. Only the kept outputs are computed"""
+        buffer = np.concatenate((self.__history, samples))
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, CTCSS_TAPS)[self.__phase :: CTCSS_DECIMATION]
+        self.__phase = (self.__phase - len(samples)) % CTCSS_DECIMATION
+        self.__history = buffer[len(samples) :]
+        return windows @ self.__kernel
+
+    def __detect_ctcss(self, samples, now, duration):
+        """Decimate into the ring buffer and look for the CTCSS tone"""
+        decimated = self.__decimate(samples)
+        ring_length = len(self.__ring)
+        count = min(len(decimated), ring_length)
+        if count > 0:
+            self.__ring[: ring_length - count] = self.__ring[count:]
+            self.__ring[ring_length - count :] = decimated[-count:]
+        self.__ring_fill = min(self.__ring_fill + count, ring_length)
+        if self.__ring_fill == ring_length:
+            ratios = self.__ctcss_bank.ratios(self.__ring - self.__ring.mean())
+            if ratios[0] >= self.ctcss_ratio and ratios[0] >= self.ctcss_margin * max(ratios[1:3]) and ratios[0] >= self.ctcss_harmonic * max(ratios[3:], default=0):
+                self.__tone_time += duration
+            else:
+                self.__tone_time = 0.0
+            if self.__tone_time >= self.ctcss_confirm:
+                self.__tone_ts = now
+        tone_present = now <= self.__tone_ts + self.hang
+        if tone_present != self.tone_present:
+            LOG.debug("CTCSS %.1f Hz %s", self.ctcss_tone, "on" if tone_present else "off")
+            self.tone_present = tone_present
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+TITLE:  mumblectl
+AUTHOR: Ranomier (ranomier@fragomat.net), F4EXB (f4exb06@gmail.com)
+DESC:   Control a running mumblestream or mumblelistener through its control socket.
+"""
+
+import argparse
+import json
+import socket
+import sys
+
+
+def send_request(path, request):
+    """Send one request to the control socket and return the decoded reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as reply_file:
+            return json.loads(reply_file.readline())
+
+
+def parse_value(value):
+    """Decode a JSON value falling back to a plain string"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main():
+    """Parse the command line and send the request"""
+    parser = argparse.ArgumentParser(description="Control a running mumblestream or mumblelistener")
+    # fmt: off
+    parser.add_argument("-S", "--socket", dest="socket_path", type=str, default="/tmp/mumblestream.sock",
+                        help="Control socket path. Default /tmp/mumblestream.sock")
+    parser.add_argument("command", choices=("status", "levels", "stats", "get", "set", "channel", "play"),
+                        help="Command to send")
+    parser.add_argument("name", nargs="?", default=None,
+                        help="Parameter name for get and set, channel name for channel or file path for play")
+    parser.add_argument("value", nargs="?", default=None,
+                        help="New value for set or true to loop the file for play")
+    # fmt: on
+    args = parser.parse_args()
+    request = {"command": args.command}
+    if args.name is not None:
+        request["name"] = args.name
+    if args.command in ("set", "channel") and args.name is None:
+        parser.error(f"{args.command} needs a name")
+    if args.command == "set":
+        if args.value is None:
+            parser.error("set needs a value")
+        request["value"] = parse_value(args.value)
+    if args.command == "play" and args.value is not None:
+        request["value"] = parse_value(args.value)
+    try:
+        reply = send_request(args.socket_path, request)
+    except OSError as ex:
+        print(f"cannot connect to {args.socket_path}: {ex}", file=sys.stderr)
+        return 1
+    if not reply["ok"]:
+        print(reply["error"], file=sys.stderr)
+        return 1
+    print(json.dumps(reply["result"], indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
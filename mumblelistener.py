@@ -8,18 +8,35 @@ DESC:   A bot that streams audio from a Mumble server to host audio.
 import argparse
 import sys
 import os
-import subprocess
-from threading import Thread
 import time
 import logging
 import json
-import collections
 
-import audioop
 import pymumble_py3 as pymumble
-import pyaudio
 
-from pulseaudio import PulseAudioHandler
+from mumblebridge import (
+    MumbleRunner,
+    prepare_mumble,
+    AudioDevices,
+    FixedLatency,
+    validate_packet_length,
+    Pipeline,
+    PyAudioSink,
+    MumbleMixSource,
+    Router,
+    Volume,
+    LevelMeter,
+    StatsMeter,
+    Mute,
+    RecorderTap,
+    make_recorder,
+    ControlServer,
+    Parameter,
+    make_ptt,
+    swap_ptt,
+    ConfigWatcher,
+    Hang,
+)
 
 __version__ = "0.1.0"
 
@@ -27,102 +44,16 @@ logging.basicConfig(format="%(asctime)s %(levelname).1s [%(threadName)s] %(funcN
 LOG = logging.getLogger("Mumblelistener")
 
 
-class Status(collections.UserList):
-    """Thread status handler"""
-
-    def __init__(self, runner_obj):
-        self.__runner_obj = runner_obj
-        self.scheme = collections.namedtuple("thread_info", ("name", "alive"))
-        super().__init__(self.__gather_status())
-
-    def __gather_status(self):
-        """Gather status"""
-        result = []
-        for meta in self.__runner_obj.values():
-            result.append(self.scheme(meta["process"].name, meta["process"].is_alive()))
-        return result
-
-    def __repr__(self):
-        repr_str = ""
-        for status in self:
-            repr_str += f"[{status.name}] alive: {status.alive} "
-        return repr_str
-
-
-class Runner(collections.UserDict):
-    """Runs a list of threads"""
-
-    def __init__(self, run_dict, args_dict=None):
-        self.is_ready = False
-        if run_dict is not None:
-            super().__init__(run_dict)
-            self.change_args(args_dict)
-            self.run()
-
-    def change_args(self, args_dict):
-        """Copy arguments"""
-        for name, value in self.items():
-            if name in args_dict:
-                value["args"] = args_dict[name]["args"]
-                value["kwargs"] = args_dict[name]["kwargs"]
-            else:
-                value["args"] = None
-                value["kwargs"] = None
-
-    def run(self):
-        """Spawns threads"""
-        for name, cdict in self.items():
-            LOG.info("generating process")
-            # fmt: off
-            cdict["process"] = Thread(
-                name=name,
-                target=cdict["func"],
-                args=cdict["args"],
-                kwargs=cdict["kwargs"]
-            )
-            # fmt: on
-            LOG.info("starting process")
-            cdict["process"].daemon = True
-            cdict["process"].start()
-            LOG.info("%s started", name)
-        LOG.info("all done")
-        self.is_ready = True
-
-    def status(self):
-        """Return a status"""
-        if self.is_ready:
-            return Status(self)
-        return []
-
-    def stop(self, name=""):
-        """Stop and exit"""
-        raise NotImplementedError("Sorry")
-
-
-class MumbleRunner(Runner):
-    """A threads runner for Mumble"""
-
-    def __init__(self, mumble_object, config, args_dict):
-        self.mumble = mumble_object
-        self.config = config
-        super().__init__(self._config(), args_dict)
-
-    def _config(self):
-        """Initial configuration"""
-        raise NotImplementedError("please inherit and implement")
-
-
 class Audio(MumbleRunner):
     """Audio input/output"""
 
     def _config(self):
-        self.stream_out = None
         self.out_running = None
-        self.in_users = {}
-        self.receive_ts = None
-        self.ptt_on_command = None
-        self.ptt_off_command = None
-        self.ptt_running = None
+        self.ptt = make_ptt(self.config)
+        self.ptt_hang = Hang(self.scheduler, 2, self.__ptt_off)
+        self.latency = FixedLatency(self.config["args"].packet_length)
+        self.recorder = make_recorder(self.config["recorder"])
+        self.control = None
         """Initial configuration"""
         if not self.__init_audio():
             return None
@@ -132,132 +63,84 @@ class Audio(MumbleRunner):
                 "func": self.__output_loop,
                 "process": None
             },
-            "ptt": {
-                "func": self.__ptt_loop,
-                "process": None
-            },
         }
         # fmt: on
 
     def __init_audio(self):
-        pa = pyaudio.PyAudio()
-        pulse = None
-        input_device_names, output_device_names = self.__scan_devices(pa)
-        chunk_size = int(pymumble.constants.PYMUMBLE_SAMPLERATE * self.config["args"].packet_length)
+        devices = self.devices = AudioDevices("mumblestream")
         # Output audio
-        if pulse is None and self.config["output_pulse_name"]:
-            pulse = PulseAudioHandler("mumblestream")
-        pyaudio_output_index = self.__get_pyaudio_output_index(output_device_names)
+        pyaudio_output_index = devices.get_output_index(self.config["output_pyaudio_name"], self.config["output_pulse_name"])
         if pyaudio_output_index is None:
             LOG.error("cannot find PyAudio output device")
             return False
-        self.stream_out = pa.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=pymumble.constants.PYMUMBLE_SAMPLERATE,
-            output=True,
-            frames_per_buffer=chunk_size,
-            output_device_index=pyaudio_output_index,
+        router = Router(self.config["routes"], devices, self.latency) if self.config["routes"] else None
+        volume = Volume(self.config["audio_output_volume"])
+        meter = LevelMeter()
+        stats = StatsMeter()
+        mute = Mute()
+        self.pipelines["output"] = Pipeline(
+            "output",
+            MumbleMixSource(self.mumble, router=router, stats=stats),
+            [stats, volume, meter, mute],
+            [PyAudioSink(devices, pyaudio_output_index, self.latency, pulse_name=self.config["output_pulse_name"])],
         )
-        LOG.debug("output stream opened")
-        if self.config["output_pulse_name"] is not None:  # redirect output from mumblestream with pulseaudio
-            self.__move_output_pulseaudio(pulse, self.config["output_pulse_name"])
+        self.meters["output"] = meter
+        self.stats_meters["output"] = stats
+        self.parameters["audio_output_volume"] = Parameter(self.pipelines["output"], volume, "volume")
+        self.parameters["output_mute"] = Parameter(self.pipelines["output"], mute, "muted", bool)
+        if self.recorder is not None:
+            self.pipelines["output"].add_sink(RecorderTap(self.recorder, "rx"))
+        if self.config["control_socket"] is not None:
+            self.control = ControlServer(self.config["control_socket"], self)
         # All OK
         return True
 
-    @staticmethod
-    def __scan_devices(pa):
-        """Scan audio devices handled by PyAudio"""
-        info = pa.get_host_api_info_by_index(0)
-        numdevices = info.get("deviceCount")
-        input_device_names = {}
-        output_device_names = {}
-        for i in range(0, numdevices):
-            if pa.get_device_info_by_host_api_device_index(0, i).get("maxInputChannels") > 0:
-                device_info = pa.get_device_info_by_host_api_device_index(0, i)
-                input_device_names[device_info["name"]] = device_info["index"]
-            if pa.get_device_info_by_host_api_device_index(0, i).get("maxOutputChannels") > 0:
-                device_info = pa.get_device_info_by_host_api_device_index(0, i)
-                output_device_names[device_info["name"]] = device_info["index"]
-        LOG.debug("input: %s", input_device_names)
-        LOG.debug("output: %s", output_device_names)
-        return input_device_names, output_device_names
-
-    def __get_pyaudio_output_index(self, output_device_names):
-        """Returns the PyAudio index of output device or None if no default"""
-        if self.config["output_pulse_name"] is not None:
-            pyaudio_name = "pulse"
-        else:
-            pyaudio_name = self.config.get("output_pyaudio_name", "default")
-        return output_device_names.get(pyaudio_name)
-
-    def __move_output_pulseaudio(self, pulse, output_pulse_name):
-        """Moves the output to the given pulseaudio device"""
-        pulse_sink_index = pulse.get_sink_index(output_pulse_name)
-        pulse_sink_input_index = pulse.get_own_sink_input_index()
-        if pulse_sink_index is None or pulse_sink_input_index is None:
-            LOG.warning("cannot move pulseaudio sink input %d to sink %d", pulse_sink_input_index, pulse_sink_index)
-        else:
-            try:
-                pulse.move_sink_input(pulse_sink_input_index, pulse_sink_index)
-                LOG.debug("moved pulseaudio sink input %d to sink %d", pulse_sink_input_index, pulse_sink_index)
-            except Exception as ex:
-                LOG.error("exception assigning pulseaudio sink: %s", ex)
+    def _reconfigure(self, config, changed):
+        """Re-open the streams whose device changed and swap the PTT controller"""
+        applied = set()
+        output_changes = changed & {"output_pyaudio_name", "output_pulse_name"}
+        if output_changes and "output" in self.pipelines:
+            pyaudio_output_index = self.devices.get_output_index(config["output_pyaudio_name"], config["output_pulse_name"])
+            if pyaudio_output_index is None:
+                LOG.error("cannot find PyAudio output device")
+            else:
+                self.pipelines["output"].sinks[0].reopen(pyaudio_output_index, config["output_pulse_name"])
+                applied |= output_changes
+        ptt_changes = changed & {"ptt_on_command", "ptt_off_command", "ptt_command_support"}
+        if ptt_changes:
+            self.ptt = swap_ptt(self.ptt, make_ptt(config))
+            applied |= ptt_changes
+        return applied
 
     def __output_loop(self):
         """Output process"""
-        self.ptt_on_command = " ".join(self.config["ptt_on_command"]) if self.config["ptt_command_support"] else None
-        self.ptt_off_command = " ".join(self.config["ptt_off_command"]) if self.config["ptt_command_support"] else None
         self.out_running = True
         try:
             while self.out_running:
-                sound_frag = None
-                for user_session_id in list(self.mumble.users):
-                    user = self.mumble.users[user_session_id]
-                    user_name = user["name"]
-                    if user.sound.is_sound():
-                        if self.config["ptt_command_support"] and self.receive_ts is None:
-                            run_ptt_on_command = subprocess.run(
-                                self.ptt_on_command, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-                            LOG.debug("PTT on exited with code %d", run_ptt_on_command.returncode)
-                        if user_name not in self.in_users:
-                            LOG.debug("start receiving audio from %s", user_name)
-                            self.in_users[user_name] = 0
-                        self.receive_ts = time.time()
-                        self.in_users[user_name] = self.receive_ts
-                        if sound_frag is None:
-                            sound_frag = user.sound.get_sound().pcm
-                        else:
-                            sound_frag = audioop.add(sound_frag, user.sound.get_sound().pcm, 2)
-                    else:
-                        if user_name in self.in_users and time.time() > self.in_users[user_name] + 0.5:
-                            LOG.debug("stop receiving audio from %s", user_name)
-                            self.in_users.pop(user_name)
-                if sound_frag is not None:
-                    self.stream_out.write(sound_frag)
-                time.sleep(0.005)
+                frame = self.pipelines["output"].read()
+                if frame is not None:
+                    if self.ptt_hang.touch() and self.ptt is not None:
+                        self.ptt.on()
+                    self.pipelines["output"].process(frame)
         finally:
             LOG.debug("terminating")
-            self.stream_out.close()
-            LOG.debug("output stream closed")
+            self.pipelines["output"].close()
         return True
 
-    def __ptt_loop(self):
-        """PTT process"""
-        self.ptt_running = True
-        while self.ptt_running:
-            if self.config["ptt_command_support"] and self.receive_ts is not None and time.time() > self.receive_ts + 2:
-                run_ptt_off_command = subprocess.run(
-                    self.ptt_off_command, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-                LOG.debug("PTT off exited with code %d", run_ptt_off_command.returncode)
-                self.receive_ts = None
-            time.sleep(0.1)
-        return True
+    def __ptt_off(self):
+        """PTT hang: no sound for two seconds"""
+        if self.ptt is not None:
+            self.ptt.off()
 
     def stop(self, name=""):
         """Stop the runnin threads"""
         self.out_running = False
-        self.ptt_running = False
+        self.ptt_hang.cancel()
+        self.pipelines["output"].source.interrupt()  # wake up the output thread waiting for sound
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.control is not None:
+            self.control.close()
 
 
 class AudioPipe(MumbleRunner):
@@ -290,32 +173,6 @@ class AudioPipe(MumbleRunner):
         """Stop the runnin threads"""
 
 
-def prepare_mumble(host, user, password="", certfile=None, codec_profile="audio", bandwidth=96000, channel=None):
-    """Will configure the pymumble object and return it"""
-
-    try:
-        mumble = pymumble.Mumble(host, user, certfile=certfile, password=password)
-    except Exception as ex:
-        LOG.error("cannot commect to %s: %s", host, ex)
-        return None
-
-    mumble.set_application_string(f"mumblestream ({__version__})")
-    mumble.set_codec_profile(codec_profile)
-    mumble.set_receive_sound(1)  # Enable receiving sound from mumble server
-    mumble.start()
-    mumble.is_ready()
-    mumble.set_bandwidth(bandwidth)
-    if channel:
-        try:
-            mumble.channels.find_by_name(channel).move_in()
-        except pymumble.channels.UnknownChannelError as ex:
-            LOG.warning("tried to connect to channel: '%s' exception %s", channel, ex)
-            LOG.info("Available Channels:")
-            LOG.info(mumble.channels)
-            return None
-    return mumble
-
-
 def get_config(args):
     """Get parameters from the optional config file"""
     config = {}
@@ -328,6 +185,11 @@ def get_config(args):
 
     config["output_pyaudio_name"] = configdata.get("output_pyaudio_name", "default")
     config["output_pulse_name"] = configdata.get("output_pulse_name")
+    config["audio_output_volume"] = configdata.get("audio_output_volume", 1)
+    config["routes"] = configdata.get("routes", [])
+    config["recorder"] = configdata.get("recorder")
+    config["control_socket"] = configdata.get("control_socket")
+    config["config_reload"] = configdata.get("config_reload", 0) != 0
     config["ptt_on_command"] = configdata.get("ptt_on_command")
     config["ptt_off_command"] = configdata.get("ptt_off_command")
     config["ptt_command_support"] = not (config["ptt_on_command"] is None or config["ptt_off_command"] is None)
@@ -335,6 +197,13 @@ def get_config(args):
     return config
 
 
+def report_status(audio):
+    """Log the threads status and statistics"""
+    LOG.info(audio.status())
+    LOG.debug(audio.timings())
+    LOG.debug("scheduler %s", audio.scheduler)
+
+
 def main(preserve_thread=True):
     """swallows parameter. TODO: move functionality away"""
     parser = argparse.ArgumentParser(description="Alsa input to mumble")
@@ -345,8 +214,8 @@ def main(preserve_thread=True):
                         help="Username you wish, Default=mumble")
     parser.add_argument("-p", "--password", dest="password", type=str, default="",
                         help="Password if server requires one")
-    parser.add_argument("-s", "--setpacketlength", dest="packet_length", type=int, default=pymumble.constants.PYMUMBLE_AUDIO_PER_PACKET,
-                        help="Length of audio packet in seconds. Lower values mean less delay. Default 0.02 WARNING:Lower values could be unstable")
+    parser.add_argument("-s", "--setpacketlength", dest="packet_length", type=float, default=pymumble.constants.PYMUMBLE_AUDIO_PER_PACKET,
+                        help="Length of audio packet in seconds (0.01, 0.02, 0.04 or 0.06). Lower values mean less delay. Default 0.02 WARNING:Lower values could be unstable")
     parser.add_argument("-b", "--bandwidth", dest="bandwidth", type=int, default=48000,
                         help="Bandwith of the bot (in bytes/s). Default=96000")
     parser.add_argument("-c", "--certificate", dest="certfile", type=str, default=None,
@@ -359,13 +228,19 @@ def main(preserve_thread=True):
                         help="Configuration file")
     # fmt: on
     args = parser.parse_args()
+    try:
+        args.packet_length = validate_packet_length(args.packet_length)
+    except ValueError as ex:
+        parser.error(str(ex))
     config = get_config(args)
     config["args"] = args
 
     log_level = logging.getLevelName(config["logging_level"].upper())
     LOG.setLevel(log_level)
 
-    mumble = prepare_mumble(args.host, args.user, args.password, args.certfile, "audio", args.bandwidth, args.channel)
+    logging.getLogger("mumblebridge").setLevel(log_level)
+
+    mumble = prepare_mumble(args.host, args.user, args.password, args.certfile, "audio", args.bandwidth, args.channel, f"mumblestream ({__version__})")
 
     if mumble is None:
         LOG.critical("cannot connect to Mumble server or channel")
@@ -396,26 +271,29 @@ def main(preserve_thread=True):
                     "args": [],
                     "kwargs": None
                 },
-                "ptt": {
-                    "args": [],
-                    "kwargs": None
-                },
             }
         )
     # fmt: on
-    if preserve_thread:
-        while True:
-            try:
-                LOG.info(audio.status())
-                time.sleep(60)
-            except KeyboardInterrupt:
-                LOG.info("terminating")
-                audio.stop()
-                time.sleep(1)
-                return 0
-            except Exception as ex:
-                LOG.error("exception %s", ex)
-                return 1
+    watcher = None
+    if config["config_reload"] and args.config_path is not None:
+        watcher = ConfigWatcher(args.config_path, lambda: get_config(args), audio.reconfigure)
+    if not preserve_thread:
+        audio.scheduler.start()
+        return 0
+    report_status(audio)
+    audio.scheduler.every(60, lambda: report_status(audio))
+    try:
+        audio.scheduler.run()
+    except KeyboardInterrupt:
+        LOG.info("terminating")
+        if watcher is not None:
+            watcher.close()
+        audio.stop()
+        time.sleep(1)
+        return 0
+    except Exception as ex:
+        LOG.error("exception %s", ex)
+        return 1
     return 0
 
 
@@ -8,19 +8,59 @@ DESC:   A bot that streams host audio to/from a Mumble server.
 import argparse
 import sys
 import os
-import subprocess
-from threading import Thread
 import time
 import logging
 import json
-import collections
 
 import pymumble_py3 as pymumble
 from pymumble_py3.callbacks import PYMUMBLE_CLBK_SOUNDRECEIVED as CLBK_SOUNDRECEIVED
-import pyaudio
-import numpy as np
 
-from pulseaudio import PulseAudioHandler
+from mumblebridge import (
+    MumbleRunner,
+    prepare_mumble,
+    AudioDevices,
+    LatencyTuner,
+    FixedLatency,
+    validate_packet_length,
+    set_packet_length,
+    Pipeline,
+    PyAudioSource,
+    PyAudioSink,
+    MumbleSink,
+    FanoutSink,
+    FifoSource,
+    QueueSource,
+    AudioFile,
+    FileSource,
+    Announcement,
+    Playback,
+    VoxGate,
+    VadGate,
+    Volume,
+    LevelMeter,
+    StatsMeter,
+    Mute,
+    RecorderTap,
+    make_recorder,
+    ControlServer,
+    Parameter,
+    execute,
+    ToneDecoder,
+    DriftEstimator,
+    DriftCompensator,
+    SendBacklog,
+    validate_backlog_policy,
+    DuplexState,
+    DuplexGate,
+    PlayoutRing,
+    RingTap,
+    EchoCanceller,
+    validate_duplex_mode,
+    make_ptt,
+    swap_ptt,
+    ConfigWatcher,
+    Hang,
+)
 
 __version__ = "0.1.0"
 
@@ -28,103 +68,32 @@ logging.basicConfig(format="%(asctime)s %(levelname).1s [%(threadName)s] %(funcN
 LOG = logging.getLogger("Mumblestream")
 
 
-class Status(collections.UserList):
-    """Thread status handler"""
-
-    def __init__(self, runner_obj):
-        self.__runner_obj = runner_obj
-        self.scheme = collections.namedtuple("thread_info", ("name", "alive"))
-        super().__init__(self.__gather_status())
-
-    def __gather_status(self):
-        """Gather status"""
-        result = []
-        for meta in self.__runner_obj.values():
-            result.append(self.scheme(meta["process"].name, meta["process"].is_alive()))
-        return result
-
-    def __repr__(self):
-        repr_str = ""
-        for status in self:
-            repr_str += f"[{status.name}] alive: {status.alive} "
-        return repr_str
-
-
-class Runner(collections.UserDict):
-    """Runs a list of threads"""
-
-    def __init__(self, run_dict, args_dict=None):
-        self.is_ready = False
-        if run_dict is not None:
-            super().__init__(run_dict)
-            self.change_args(args_dict)
-            self.run()
-
-    def change_args(self, args_dict):
-        """Copy arguments"""
-        for name, value in self.items():
-            if name in args_dict:
-                value["args"] = args_dict[name]["args"]
-                value["kwargs"] = args_dict[name]["kwargs"]
-            else:
-                value["args"] = None
-                value["kwargs"] = None
-
-    def run(self):
-        """Spawns threads"""
-        for name, cdict in self.items():
-            LOG.info("generating process")
-            # fmt: off
-            cdict["process"] = Thread(
-                name=name,
-                target=cdict["func"],
-                args=cdict["args"],
-                kwargs=cdict["kwargs"]
-            )
-            # fmt: on
-            LOG.info("starting process")
-            cdict["process"].daemon = True
-            cdict["process"].start()
-            LOG.info("%s started", name)
-        LOG.info("all done")
-        self.is_ready = True
-
-    def status(self):
-        """Return a status"""
-        if self.is_ready:
-            return Status(self)
-        return []
-
-    def stop(self, name=""):
-        """Stop and exit"""
-        raise NotImplementedError("Sorry")
-
-
-class MumbleRunner(Runner):
-    """A threads runner for Mumble"""
-
-    def __init__(self, mumble_object, config, args_dict):
-        self.mumble = mumble_object
-        self.config = config
-        super().__init__(self._config(), args_dict)
-
-    def _config(self):
-        """Initial configuration"""
-        raise NotImplementedError("please inherit and implement")
-
-
 class Audio(MumbleRunner):
-    """Audio input/output"""
+    """Audio input/output. Input can also be sent to other Mumble connections (destinations)"""
+
+    def __init__(self, mumble_object, config, args_dict, destinations=()):
+        self.destinations = list(destinations)
+        super().__init__(mumble_object, config, args_dict)
 
     def _config(self):
-        self.stream_in = None
-        self.stream_out = None
         self.in_user = None
-        self.receive_ts = None
+        self.talker = Hang(self.scheduler, 1, self.__stop_receiving)
         self.in_running = None
         self.out_running = None
-        self.out_volume = 1
-        self.ptt_on_command = None
+        self.ptt = make_ptt(self.config)
+        if self.config["latency_autotune"]:
+            self.latency = LatencyTuner()
+        else:
+            self.latency = FixedLatency(self.config["args"].packet_length, self.config["audio_buffer_packets"])
+        self.recorder = make_recorder(self.config["recorder"])
+        self.control = None
+        self.backlog = SendBacklog(self.config["send_latency_budget"], self.config["send_backlog_policy"] or "drop", self.config["audio_threshold"])
+        self.playback = None
+        self.drift = {}
+        if self.config["drift_compensation"]:
+            self.drift = {"input": DriftEstimator(), "output": DriftEstimator()}
+        self.duplex = DuplexState(self.config["duplex_mode"], self.config["duplex_hang"], lambda: self.ptt is not None and self.ptt.is_on)
+        self.ring = PlayoutRing() if self.duplex.mode == "echo" else None
         """Initial configuration"""
         if not self.__init_audio():
             return None
@@ -142,171 +111,150 @@ class Audio(MumbleRunner):
         # fmt: on
 
     def __init_audio(self):
-        pa = pyaudio.PyAudio()
-        pulse = None
-        input_device_names, output_device_names = self.__scan_devices(pa)
-        chunk_size = int(pymumble.constants.PYMUMBLE_SAMPLERATE * self.config["args"].packet_length)
+        devices = self.devices = AudioDevices("mumblestream")
         # Input audio
         if not self.config["input_disable"]:
-            if pulse is None and self.config["input_pulse_name"]:
-                pulse = PulseAudioHandler("mumblestream")
-            pyaudio_input_index = self.__get_pyaudio_input_index(input_device_names)
+            pyaudio_input_index = devices.get_input_index(self.config["input_pyaudio_name"], self.config["input_pulse_name"])
             if pyaudio_input_index is None:
                 LOG.error("cannot find PyAudio input device")
                 return False
-            self.stream_in = pa.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=pymumble.constants.PYMUMBLE_SAMPLERATE,
-                input=True,
-                frames_per_buffer=chunk_size,
-                input_device_index=pyaudio_input_index,
+            meter = LevelMeter()
+            stats = StatsMeter()
+            tones = None
+            if self.config["ctcss_tone"] is not None or self.config["dtmf_commands"]:
+                tones = ToneDecoder(self.config["ctcss_tone"], self.config["dtmf_commands"], lambda request: execute(self, request))
+            gate = VadGate if self.config["vox_mode"] == "vad" else VoxGate
+            vox = gate(self.config["audio_threshold"], self.config["vox_silence_time"], tones)
+            announcements = [Announcement(**announcement) for announcement in self.config["announcements"]]
+            self.playback = Playback(self.config["playback_mode"], announcements=announcements)
+            duplex = DuplexGate(self.duplex, "tx", vox)
+            mute = Mute()
+            self.pipelines["input"] = Pipeline(
+                "input",
+                PyAudioSource(devices, pyaudio_input_index, self.latency, pulse_name=self.config["input_pulse_name"]),
+                [meter, stats, vox, self.playback, mute, duplex] if tones is None else [meter, stats, tones, vox, self.playback, mute, duplex],
+                [self.__mumble_sink()],
             )
-            LOG.debug("input stream opened")
-            if self.config["input_pulse_name"] is not None:  # redirect input to mumblestream with pulseaudio
-                self.__move_input_pulseaudio(pulse, self.config["input_pulse_name"])
+            if self.ring is not None:  # cancel the echo before any level is measured
+                self.pipelines["input"].add_processor(EchoCanceller(self.ring), 0)
+            if "input" in self.drift:
+                self.pipelines["input"].add_processor(DriftCompensator(self.drift["input"]))
+            self.meters["input"] = meter
+            self.stats_meters["input"] = stats
+            # the skip_silence policy of the send backlog follows the VOX threshold
+            self.parameters["audio_threshold"] = Parameter(self.pipelines["input"], vox, "threshold", int, [(self.backlog, "silence_threshold")])
+            self.parameters["vox_silence_time"] = Parameter(self.pipelines["input"], vox, "silence_time")
+            self.parameters["input_mute"] = Parameter(self.pipelines["input"], mute, "muted", bool)
+            self.parameters["send_latency_budget"] = Parameter(self.pipelines["input"], self.backlog, "budget")
+            if self.recorder is not None:
+                self.pipelines["input"].add_sink(RecorderTap(self.recorder, "tx", self.config["args"].user))
         # Output audio
         if not self.config["output_disable"]:
-            if pulse is None and self.config["output_pulse_name"]:
-                pulse = PulseAudioHandler("mumblestream")
-            pyaudio_output_index = self.__get_pyaudio_output_index(output_device_names)
+            pyaudio_output_index = devices.get_output_index(self.config["output_pyaudio_name"], self.config["output_pulse_name"])
             if pyaudio_output_index is None:
                 LOG.error("cannot find PyAudio output device")
                 return False
-            self.stream_out = pa.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=pymumble.constants.PYMUMBLE_SAMPLERATE,
-                output=True,
-                frames_per_buffer=chunk_size,
-                output_device_index=pyaudio_output_index,
+            volume = Volume(self.config["audio_output_volume"])
+            meter = LevelMeter()
+            stats = StatsMeter(per_user=True)
+            duplex = DuplexGate(self.duplex, "rx", on_claim=self.__key_ptt)
+            mute = Mute()
+            # with drift compensation the jitter buffer holds two packets so that a slower sender shows as a fill under target
+            self.pipelines["output"] = Pipeline(
+                "output",
+                QueueSource(self.latency.packet_length * (2 if "output" in self.drift else 1), drift=self.drift.get("output")),
+                [stats, volume, meter, mute, duplex],
+                [PyAudioSink(devices, pyaudio_output_index, self.latency, pulse_name=self.config["output_pulse_name"])],
             )
-            LOG.debug("output stream opened")
-            if self.config["output_pulse_name"] is not None:  # redirect output from mumblestream with pulseaudio
-                self.__move_output_pulseaudio(pulse, self.config["output_pulse_name"])
+            if self.ring is not None:
+                self.pipelines["output"].add_sink(RingTap(self.ring))
+            if "output" in self.drift:
+                self.pipelines["output"].add_processor(DriftCompensator(self.drift["output"]), 0)
+            self.meters["output"] = meter
+            self.stats_meters["output"] = stats
+            self.parameters["audio_output_volume"] = Parameter(self.pipelines["output"], volume, "volume")
+            self.parameters["output_mute"] = Parameter(self.pipelines["output"], mute, "muted", bool)
+            if self.recorder is not None:
+                self.pipelines["output"].add_sink(RecorderTap(self.recorder, "rx"))
+        if self.config["control_socket"] is not None:
+            self.control = ControlServer(self.config["control_socket"], self)
         # All OK
         return True
 
-    @staticmethod
-    def __scan_devices(pa):
-        """Scan audio devices handled by PyAudio"""
-        info = pa.get_host_api_info_by_index(0)
-        numdevices = info.get("deviceCount")
-        input_device_names = {}
-        output_device_names = {}
-        for i in range(0, numdevices):
-            if pa.get_device_info_by_host_api_device_index(0, i).get("maxInputChannels") > 0:
-                device_info = pa.get_device_info_by_host_api_device_index(0, i)
-                input_device_names[device_info["name"]] = device_info["index"]
-            if pa.get_device_info_by_host_api_device_index(0, i).get("maxOutputChannels") > 0:
-                device_info = pa.get_device_info_by_host_api_device_index(0, i)
-                output_device_names[device_info["name"]] = device_info["index"]
-        LOG.debug("input: %s", input_device_names)
-        LOG.debug("output: %s", output_device_names)
-        return input_device_names, output_device_names
-
-    def __get_pyaudio_input_index(self, input_device_names):
-        """Returns the PyAudio index of input device or None if no default"""
-        if self.config["input_pulse_name"] is not None:
-            pyaudio_name = "pulse"
-        else:
-            pyaudio_name = self.config.get("input_pyaudio_name", "default")
-        return input_device_names.get(pyaudio_name)
-
-    def __get_pyaudio_output_index(self, output_device_names):
-        """Returns the PyAudio index of output device or None if no default"""
-        if self.config["output_pulse_name"] is not None:
-            pyaudio_name = "pulse"
-        else:
-            pyaudio_name = self.config.get("output_pyaudio_name", "default")
-        return output_device_names.get(pyaudio_name)
-
-    def __move_input_pulseaudio(self, pulse, input_pulse_name):
-        """Moves the input to the given pulseaudio device"""
-        pulse_source_index = pulse.get_source_index(input_pulse_name)
-        pulse_source_output_index = pulse.get_own_source_output_index()
-        if pulse_source_index is None or pulse_source_output_index is None:
-            LOG.warning("cannot move source output %d to source %d", pulse_source_output_index, pulse_source_index)
-        else:
-            try:
-                pulse.move_source_output(pulse_source_output_index, pulse_source_index)
-                LOG.debug("moved pulseaudio source output %d to source %d", pulse_source_output_index, pulse_source_index)
-            except Exception as ex:
-                LOG.error("exception assigning pulseaudio source: %s", ex)
-
-    def __move_output_pulseaudio(self, pulse, output_pulse_name):
-        """Moves the output to the given pulseaudio device"""
-        pulse_sink_index = pulse.get_sink_index(output_pulse_name)
-        pulse_sink_input_index = pulse.get_own_sink_input_index()
-        if pulse_sink_index is None or pulse_sink_input_index is None:
-            LOG.warning("cannot move pulseaudio sink input %d to sink %d", pulse_sink_input_index, pulse_sink_index)
-        else:
-            try:
-                pulse.move_sink_input(pulse_sink_input_index, pulse_sink_index)
-                LOG.debug("moved pulseaudio sink input %d to sink %d", pulse_sink_input_index, pulse_sink_index)
-            except Exception as ex:
-                LOG.error("exception assigning pulseaudio sink: %s", ex)
-
-    def __mute_output_pulseaudio(self, pulse):
-        pulse_sink_input_index = pulse.get_own_sink_input_index()
-        if pulse_sink_input_index is None:
-            LOG.warning("cannot mute pulseaudio sink input %d", pulse_sink_input_index)
-        else:
-            try:
-                pulse.mute_sink_input(pulse_sink_input_index, True)
-                LOG.debug("muted pulseaudio sink input %d", pulse_sink_input_index)
-            except Exception as ex:
-                LOG.error("exception muting pulseaudio sink input %d: %s", pulse_sink_input_index, ex)
-
-    @staticmethod
-    def __level(audio_bytes):
-        """Return maximum signal chunk magnitude"""
-        alldata = bytearray()
-        alldata.extend(audio_bytes)
-        data = np.frombuffer(alldata, dtype=np.short)
-        return max(abs(data))
+    def __mumble_sink(self):
+        """Sink of the input pipeline. With destinations the sound is encoded once for all connections"""
+        if self.destinations:
+            return FanoutSink([self.mumble] + self.destinations, self.latency, self.drift.get("input"), self.backlog)
+        return MumbleSink(self.mumble, self.latency, self.drift.get("input"), self.backlog)
+
+    def __autotune(self):
+        """Evaluate the latency tuner"""
+        if self.latency.update():
+            LOG.info("latency tuner %s", self.latency)
+
+    def _reconfigure(self, config, changed):
+        """Re-open the streams whose device changed and swap the PTT controller"""
+        applied = set()
+        input_changes = changed & {"input_pyaudio_name", "input_pulse_name"}
+        if input_changes and "input" in self.pipelines:
+            pyaudio_input_index = self.devices.get_input_index(config["input_pyaudio_name"], config["input_pulse_name"])
+            if pyaudio_input_index is None:
+                LOG.error("cannot find PyAudio input device")
+            else:
+                self.pipelines["input"].source.reopen(pyaudio_input_index, config["input_pulse_name"])
+                applied |= input_changes
+        output_changes = changed & {"output_pyaudio_name", "output_pulse_name"}
+        if output_changes and "output" in self.pipelines:
+            pyaudio_output_index = self.devices.get_output_index(config["output_pyaudio_name"], config["output_pulse_name"])
+            if pyaudio_output_index is None:
+                LOG.error("cannot find PyAudio output device")
+            else:
+                self.pipelines["output"].sinks[0].reopen(pyaudio_output_index, config["output_pulse_name"])
+                applied |= output_changes
+        ptt_changes = changed & {"ptt_on_command", "ptt_off_command", "ptt_command_support"}
+        if ptt_changes:
+            self.ptt = swap_ptt(self.ptt, make_ptt(config))
+            applied |= ptt_changes
+        return applied
 
     def __sound_received_handler(self, user, soundchunk):
         """Pymumble sound received callback"""
         if self.in_user is None:
             LOG.debug("start receiving from %s", user["name"])
             self.in_user = user["name"]
-            if self.ptt_on_command is not None:  # PTT on
-                run_ptt_on_command = subprocess.run(
-                    self.ptt_on_command, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-                LOG.debug("PTT on exited with code %d", run_ptt_on_command.returncode)
-        if self.stream_out is not None and user["name"] == self.in_user:
-            self.receive_ts = time.time()
-            np_audio = np.frombuffer(soundchunk.pcm, dtype=np.short)
-            np_audio = (np_audio * self.out_volume).astype(np.short)
-            self.stream_out.write(np_audio.tobytes())
+        if user["name"] == self.in_user:
+            self.talker.touch()
+            self.pipelines["output"].source.put(soundchunk.pcm, user["name"])
+
+    def __key_ptt(self):
+        """A received frame won the link: key PTT if a talker is being played"""
+        ptt = self.ptt
+        if ptt is not None and not ptt.is_on and self.in_user is not None:
+            ptt.on()
+
+    def __stop_receiving(self):
+        """Talker timeout: the current talker has been silent for a second"""
+        LOG.debug("stop receiving from %s", self.in_user)
+        if self.ptt is not None:
+            self.ptt.off()
+        self.in_user = None
 
     def __output_loop(self):
         """Output process"""
         if self.config["output_disable"]:
             LOG.info("output disabled")
             return None
-        self.out_volume = self.config["audio_output_volume"]
-        self.ptt_on_command = " ".join(self.config["ptt_on_command"]) if self.config["ptt_command_support"] else None
         self.out_running = True
         try:
             self.mumble.callbacks.set_callback(CLBK_SOUNDRECEIVED, self.__sound_received_handler)
             while self.out_running:
-                if self.receive_ts is not None and time.time() > self.receive_ts + 1:
-                    LOG.debug("stop receiving from %s", self.in_user)
-                    if self.config["ptt_command_support"]:  # PTT off
-                        ptt_off_command = " ".join(self.config["ptt_off_command"])
-                        run_ptt_off_command = subprocess.run(
-                            ptt_off_command, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-                        LOG.debug("PTT off exited with code %d", run_ptt_off_command.returncode)
-                    self.receive_ts = None
-                    self.in_user = None
-                time.sleep(0.1)
+                if self.config["input_disable"]:
+                    self.__autotune()
+                self.pipelines["output"].run_once()
         finally:
             LOG.debug("terminating")
             self.mumble.callbacks.remove_callback(CLBK_SOUNDRECEIVED, self.__sound_received_handler)
-            self.stream_out.close()
-            LOG.debug("output stream closed")
+            self.pipelines["output"].close()
         return True
 
     def __input_loop(self):
@@ -314,46 +262,42 @@ class Audio(MumbleRunner):
         if self.config["input_disable"]:
             LOG.info("input disabled")
             return None
-        chunk_size = int(pymumble.constants.PYMUMBLE_SAMPLERATE * self.config["args"].packet_length)
         self.in_running = True
         try:
             while self.in_running:
-                data = self.stream_in.read(chunk_size)
-                if self.__level(data) > self.config["audio_threshold"]:
-                    LOG.debug("audio on")
-                    quiet_samples = 0
-                    while quiet_samples < (self.config["vox_silence_time"] * (1 / self.config["args"].packet_length)):
-                        self.mumble.sound_output.add_sound(data)
-                        data = self.stream_in.read(chunk_size)
-                        if self.__level(data) < self.config["audio_threshold"]:
-                            quiet_samples = quiet_samples + 1
-                        else:
-                            quiet_samples = 0
-                    LOG.debug("audio off")
+                self.__autotune()
+                self.pipelines["input"].run_once()
         finally:
             LOG.debug("terminating")
-            self.stream_in.close()
-            LOG.debug("input stream closed")
+            self.pipelines["input"].close()
         return True
 
     def stop(self, name=""):
         """Stop the runnin threads"""
         self.in_running = False
         self.out_running = False
+        self.talker.cancel()
+        if "output" in self.pipelines:  # wake up the output thread waiting for sound
+            self.pipelines["output"].source.interrupt()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.control is not None:
+            self.control.close()
 
 
 class AudioPipe(MumbleRunner):
-    """Audio pipe"""
+    """Audio pipe from a FIFO or a file"""
 
     def _config(self):
         """Initial configuration"""
+        self.backlog = None
         # fmt: off
         return {
-            "PipeInput": {
+            "input": {
                 "func": self.__input_loop,
                 "process": None
             },
-            "PipeOutput": {
+            "output": {
                 "func": self.__output_loop,
                 "process": None
             }
@@ -364,45 +308,22 @@ class AudioPipe(MumbleRunner):
         """Output process"""
         return None
 
-    def __input_loop(self, packet_length, path):
+    def __input_loop(self, packet_length, path, play=False, loop=False):
         """Input process"""
-        ckunk_size = int(pymumble.constants.PYMUMBLE_SAMPLERATE * packet_length)
-        while True:
-            with open(path) as fifo_fd:
-                while True:
-                    data = fifo_fd.read(ckunk_size)
-                    self.mumble.sound_output.add_sound(data)
+        latency = FixedLatency(packet_length)
+        # FIFOs and files can be paused: wait for the queue rather than dropping sound read ahead of real time
+        self.backlog = SendBacklog(self.config["send_latency_budget"], self.config["send_backlog_policy"] or "wait", self.config["audio_threshold"])
+        source = FileSource(AudioFile(path), latency, loop) if play else FifoSource(path, latency)
+        self.pipelines["input"] = Pipeline("input", source, [], [MumbleSink(self.mumble, latency, backlog=self.backlog)])
+        while self.pipelines["input"].run_once() is not None:
+            pass
+        LOG.info("end of %s", path)
+        self.pipelines["input"].close()
 
     def stop(self, name=""):
         """Stop the runnin threads"""
 
 
-def prepare_mumble(host, user, password="", certfile=None, codec_profile="audio", bandwidth=96000, channel=None):
-    """Will configure the pymumble object and return it"""
-
-    try:
-        mumble = pymumble.Mumble(host, user, certfile=certfile, password=password)
-    except Exception as ex:
-        LOG.error("cannot commect to %s: %s", host, ex)
-        return None
-
-    mumble.set_application_string(f"mumblestream ({__version__})")
-    mumble.set_codec_profile(codec_profile)
-    mumble.set_receive_sound(1)  # Enable receiving sound from mumble server
-    mumble.start()
-    mumble.is_ready()
-    mumble.set_bandwidth(bandwidth)
-    if channel:
-        try:
-            mumble.channels.find_by_name(channel).move_in()
-        except pymumble.channels.UnknownChannelError as ex:
-            LOG.warning("tried to connect to channel: '%s' exception %s", channel, ex)
-            LOG.info("Available Channels:")
-            LOG.info(mumble.channels)
-            return None
-    return mumble
-
-
 def get_config(args):
     """Get parameters from the optional config file"""
     config = {}
@@ -415,13 +336,29 @@ def get_config(args):
 
     config["vox_silence_time"] = configdata.get("vox_silence_time", 3)
     config["audio_threshold"] = configdata.get("audio_threshold", 1000)
+    config["vox_mode"] = configdata.get("vox_mode", "peak")
     config["audio_output_volume"] = configdata.get("audio_output_volume", 1)
     config["input_pyaudio_name"] = configdata.get("input_pyaudio_name", "default")
     config["input_pulse_name"] = configdata.get("input_pulse_name")
     config["input_disable"] = configdata.get("input_disable", 0) != 0
+    config["audio_buffer_packets"] = configdata.get("audio_buffer_packets", 1)
+    config["latency_autotune"] = configdata.get("latency_autotune", 0) != 0
+    config["drift_compensation"] = configdata.get("drift_compensation", 0) != 0
+    config["send_latency_budget"] = configdata.get("send_latency_budget", 0.5)
+    config["send_backlog_policy"] = configdata.get("send_backlog_policy")  # None: depends on the source
+    config["destinations"] = configdata.get("destinations", [])
+    config["duplex_mode"] = configdata.get("duplex_mode", "full")
+    config["duplex_hang"] = configdata.get("duplex_hang", 0.3)
+    config["playback_mode"] = configdata.get("playback_mode", "priority")
+    config["announcements"] = configdata.get("announcements", [])
     config["output_pyaudio_name"] = configdata.get("output_pyaudio_name", "default")
     config["output_pulse_name"] = configdata.get("output_pulse_name")
     config["output_disable"] = configdata.get("output_disable", 0) != 0
+    config["ctcss_tone"] = configdata.get("ctcss_tone")
+    config["dtmf_commands"] = configdata.get("dtmf_commands", {})
+    config["recorder"] = configdata.get("recorder")
+    config["control_socket"] = configdata.get("control_socket")
+    config["config_reload"] = configdata.get("config_reload", 0) != 0
     config["ptt_on_command"] = configdata.get("ptt_on_command")
     config["ptt_off_command"] = configdata.get("ptt_off_command")
     config["ptt_command_support"] = not (config["ptt_on_command"] is None or config["ptt_off_command"] is None)
@@ -429,6 +366,15 @@ def get_config(args):
     return config
 
 
+def report_status(audio):
+    """Log the threads status and statistics"""
+    LOG.info(audio.status())
+    if audio.backlog is not None:
+        LOG.info("send backlog %s", audio.backlog)
+    LOG.debug(audio.timings())
+    LOG.debug("scheduler %s", audio.scheduler)
+
+
 def main(preserve_thread=True):
     """swallows parameter. TODO: move functionality away"""
     parser = argparse.ArgumentParser(description="Alsa input to mumble")
@@ -439,8 +385,8 @@ def main(preserve_thread=True):
                         help="Username you wish, Default=mumble")
     parser.add_argument("-p", "--password", dest="password", type=str, default="",
                         help="Password if server requires one")
-    parser.add_argument("-s", "--setpacketlength", dest="packet_length", type=int, default=pymumble.constants.PYMUMBLE_AUDIO_PER_PACKET,
-                        help="Length of audio packet in seconds. Lower values mean less delay. Default 0.02 WARNING:Lower values could be unstable")
+    parser.add_argument("-s", "--setpacketlength", dest="packet_length", type=float, default=pymumble.constants.PYMUMBLE_AUDIO_PER_PACKET,
+                        help="Length of audio packet in seconds (0.01, 0.02, 0.04 or 0.06). Lower values mean less delay. Default 0.02 WARNING:Lower values could be unstable")
     parser.add_argument("-b", "--bandwidth", dest="bandwidth", type=int, default=48000,
                         help="Bandwith of the bot (in bytes/s). Default=96000")
     parser.add_argument("-c", "--certificate", dest="certfile", type=str, default=None,
@@ -449,24 +395,60 @@ def main(preserve_thread=True):
                         help="Channel name as string")
     parser.add_argument("-f", "--fifo", dest="fifo_path", type=str, default=None,
                         help="Read from FIFO (EXPERMENTAL)")
+    parser.add_argument("-P", "--play", dest="play_path", type=str, default=None,
+                        help="Play a 16 bit mono 48 kHz WAV or raw file instead of the sound card input")
+    parser.add_argument("--loop", dest="loop", action="store_true",
+                        help="Play the --play file in a loop")
     parser.add_argument("--config", dest="config_path", type=str, default="config.json",
                         help="Configuration file")
     # fmt: on
     args = parser.parse_args()
+    try:
+        args.packet_length = validate_packet_length(args.packet_length)
+    except ValueError as ex:
+        parser.error(str(ex))
     config = get_config(args)
     config["args"] = args
+    try:
+        if config["send_backlog_policy"] is not None:
+            validate_backlog_policy(config["send_backlog_policy"])
+        validate_duplex_mode(config["duplex_mode"])
+    except ValueError as ex:
+        parser.error(str(ex))
 
     log_level = logging.getLevelName(config["logging_level"].upper())
     LOG.setLevel(log_level)
 
-    mumble = prepare_mumble(args.host, args.user, args.password, args.certfile, "audio", args.bandwidth, args.channel)
+    logging.getLogger("mumblebridge").setLevel(log_level)
+
+    mumble = prepare_mumble(args.host, args.user, args.password, args.certfile, "audio", args.bandwidth, args.channel, f"mumblestream ({__version__})")
 
     if mumble is None:
         LOG.critical("cannot connect to Mumble server or channel")
         return 1
+    set_packet_length(mumble.sound_output, LatencyTuner.LEVELS[0][0] if config["latency_autotune"] else args.packet_length)
+    destinations = []
+    for destination in config["destinations"]:
+        # fmt: off
+        destination_mumble = prepare_mumble(
+            destination.get("host", args.host),
+            destination.get("user", args.user),
+            destination.get("password", ""),
+            destination.get("certfile", args.certfile),
+            "audio",
+            destination.get("bandwidth", args.bandwidth),
+            destination.get("channel"),
+            f"mumblestream ({__version__})",
+            receive_sound=False
+        )
+        # fmt: on
+        if destination_mumble is None:
+            LOG.error("cannot connect to destination %s", destination.get("host", args.host))
+            continue
+        destinations.append(destination_mumble)
 
     # fmt: off
-    if args.fifo_path:
+    if args.fifo_path or args.play_path:
         audio = AudioPipe(
             mumble,
             config,
@@ -476,7 +458,7 @@ def main(preserve_thread=True):
                     "kwargs": None
                 },
                 "input": {
-                    "args": (args.packet_length, args.fifo_path),
+                    "args": (args.packet_length, args.play_path or args.fifo_path, args.play_path is not None, args.loop),
                     "kwargs": None
                 },
             },
@@ -494,22 +476,30 @@ def main(preserve_thread=True):
                     "args": [],
                     "kwargs": None
                 }
-            }
+            },
+            destinations
         )
     # fmt: on
-    if preserve_thread:
-        while True:
-            try:
-                LOG.info(audio.status())
-                time.sleep(60)
-            except KeyboardInterrupt:
-                LOG.info("terminating")
-                audio.stop()
-                time.sleep(1)
-                return 0
-            except Exception as ex:
-                LOG.error("exception %s", ex)
-                return 1
+    watcher = None
+    if config["config_reload"] and args.config_path is not None:
+        watcher = ConfigWatcher(args.config_path, lambda: get_config(args), audio.reconfigure)
+    if not preserve_thread:
+        audio.scheduler.start()
+        return 0
+    report_status(audio)
+    audio.scheduler.every(60, lambda: report_status(audio))
+    try:
+        audio.scheduler.run()
+    except KeyboardInterrupt:
+        LOG.info("terminating")
+        if watcher is not None:
+            watcher.close()
+        audio.stop()
+        time.sleep(1)
+        return 0
+    except Exception as ex:
+        LOG.error("exception %s", ex)
+        return 1
     return 0
 
 
@@ -0,0 +1,38 @@
+""" Send backlog policies and pitch period compression """
+import numpy as np
+
+from mumblebridge import Frame, SendBacklog
+from mumblebridge.backlog import compress_frame, MIN_PERIOD, SAMPLERATE
+
+
+def loaded_frame(samples):
+    """Frame holding the samples"""
+    return Frame().load(np.asarray(samples, dtype=np.int16).tobytes())
+
+
+def test_compress_periodic():
+    """A periodic frame is shortened by its period and stays within the signal range"""
+    t = np.arange(SAMPLERATE // 25) / SAMPLERATE
+    samples = 3000 * np.sin(2 * np.pi * 100 * t) + 1000 * np.sin(2 * np.pi * 200 * t)
+    frame = loaded_frame(samples)
+    removed = compress_frame(frame)
+    assert removed == SAMPLERATE // 100
+    assert frame.length == len(samples) - removed
+    assert frame.peak() <= 4000
+
+
+def test_compress_short_frame():
+    """Frames shorter than two minimum periods are not changed"""
+    frame = loaded_frame(np.ones(2 * MIN_PERIOD))
+    assert compress_frame(frame) == 0
+    assert frame.length == 2 * MIN_PERIOD
+
+
+def test_skip_silence():
+    """Over budget only frames below the silence threshold are skipped"""
+    backlog = SendBacklog(0.1, "skip_silence", silence_threshold=500)
+    quiet = loaded_frame(np.full(960, 100))
+    assert backlog.admit(lambda: 0.0, quiet)
+    assert not backlog.admit(lambda: 0.2, quiet)
+    assert backlog.admit(lambda: 0.2, loaded_frame(np.full(960, 1000)))
+    assert backlog.skipped == quiet.duration
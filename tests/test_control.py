@@ -0,0 +1,74 @@
+""" Control requests and runtime parameters """
+import types
+
+import pytest
+
+from mumblebridge import Parameter, Pipeline, SendBacklog, VoxGate, Mute, execute
+
+
+@pytest.fixture(name="runner")
+def fixture_runner():
+    """Runner holding the input pipeline parameters of mumblestream"""
+    vox = VoxGate(1000, 1)
+    mute = Mute()
+    backlog = SendBacklog(0.5, "skip_silence", 1000)
+    pipeline = Pipeline("input", None, [vox, mute])
+    runner = types.SimpleNamespace(
+        pipelines={"input": pipeline},
+        config={"audio_threshold": 1000, "input_mute": False},
+        vox=vox,
+        mute=mute,
+        backlog=backlog,
+    )
+    runner.parameters = {
+        "audio_threshold": Parameter(pipeline, vox, "threshold", int, [(backlog, "silence_threshold")]),
+        "vox_silence_time": Parameter(pipeline, vox, "silence_time"),
+        "input_mute": Parameter(pipeline, mute, "muted", bool),
+    }
+    return runner
+
+
+def test_get(runner):
+    """Single and all parameter values"""
+    assert execute(runner, {"command": "get", "name": "audio_threshold"}) == 1000
+    assert execute(runner, {"command": "get"}) == {"audio_threshold": 1000, "vox_silence_time": 1, "input_mute": False}
+
+
+def test_set_between_frames(runner):
+    """A new value is converted, kept in the configuration and applied before the next frame"""
+    assert execute(runner, {"command": "set", "name": "vox_silence_time", "value": "2.5"}) == 2.5
+    assert runner.vox.silence_time == 1
+    pipeline = runner.pipelines["input"]
+    pipeline.push(b"\x00\x00" * 960)
+    assert runner.vox.silence_time == 2.5
+
+
+def test_set_linked(runner):
+    """The audio threshold sets the silence threshold of the send backlog too"""
+    assert execute(runner, {"command": "set", "name": "audio_threshold", "value": "300"}) == 300
+    runner.pipelines["input"].push(b"\x00\x00" * 960)
+    assert runner.vox.threshold == 300
+    assert runner.backlog.silence_threshold == 300
+    assert runner.config["audio_threshold"] == 300
+
+
+@pytest.mark.parametrize("value, muted", [("on", True), ("off", False), ("1", True), (True, True), (0, False)])
+def test_set_bool(runner, value, muted):
+    """Boolean parameters accept usual words"""
+    assert execute(runner, {"command": "set", "name": "input_mute", "value": value}) is muted
+    runner.pipelines["input"].push(b"\x00\x00" * 960)
+    assert runner.mute.muted is muted
+
+
+def test_errors(runner):
+    """Unknown parameters and commands and bad values are errors"""
+    with pytest.raises(KeyError):
+        execute(runner, {"command": "get", "name": "volume"})
+    with pytest.raises(KeyError):
+        execute(runner, {"command": "set", "name": "volume", "value": 1})
+    with pytest.raises(ValueError):
+        execute(runner, {"command": "set", "name": "audio_threshold", "value": "loud"})
+    with pytest.raises(ValueError):
+        execute(runner, {"command": "reboot"})
+    with pytest.raises(ValueError):
+        execute(runner, {"command": "play", "name": "announce.wav"})
@@ -0,0 +1,72 @@
+""" Clock drift estimation and compensation """
+import types
+
+import numpy as np
+import pytest
+
+from benchmark import simulate_drift
+from mumblebridge import DriftEstimator, DriftCompensator, Frame, QueueSource
+
+
+def test_estimator_follows_error():
+    """A steady fill error moves the estimate towards it in sign, limited to max_ppm"""
+    for error in (0.01, -0.01):
+        estimator = DriftEstimator(time_constant=10, max_ppm=500)
+        for step in range(5000):
+            estimator.report(error, step * 0.02)
+        assert np.sign(estimator.ppm) == np.sign(error)
+        assert abs(estimator.ppm) <= 500
+        assert np.sign(1 - estimator.ratio) == np.sign(error)
+
+
+def test_estimator_hold():
+    """Reports after a pause restart the smoothing but keep the estimate"""
+    estimator = DriftEstimator(time_constant=10)
+    for step in range(500):
+        estimator.report(0.01, step * 0.02)
+    drift = estimator.drift
+    estimator.report(-0.05, 100)
+    assert estimator.drift == drift and estimator.error == -0.05
+
+
+def test_empty_queue_reports_negative_error():
+    """A drained jitter buffer reports a fill under target so that a slower sender can be measured"""
+    reports = []
+    source = QueueSource(0.04, drift=types.SimpleNamespace(report=lambda error, now: reports.append(error)), clock=lambda: 0.0)
+    frame = Frame()
+    for _ in range(2):
+        source.put(b"\x00\x00" * 960)
+    assert source.read(frame) is not None
+    assert source.read(frame) is not None
+    assert source.read(frame) is None
+    assert reports == pytest.approx([0.0, -0.02, -0.04])
+
+
+def test_compensator_passthrough():
+    """Frames pass untouched while the ratio is 1"""
+    compensator = DriftCompensator(DriftEstimator())
+    frame = Frame().load(np.arange(960, dtype=np.int16).tobytes())
+    compensator.process(frame)
+    assert frame.length == 960 and np.array_equal(frame.data, np.arange(960))
+
+
+def test_compensator_ratio():
+    """The output length follows the ratio over many frames"""
+    estimator = DriftEstimator()
+    estimator.correction = 0.001
+    compensator = DriftCompensator(estimator)
+    frame = Frame()
+    total = 0
+    for _ in range(1000):
+        compensator.process(frame.load(np.full(960, 1000, dtype=np.int16).tobytes()))
+        total += frame.length
+    assert abs(total - 960 * 1000 * estimator.ratio) <= 1
+    assert np.all(frame.data == 1000)
+
+
+def test_drift_simulation():
+    """Senders faster and slower than the sound card are measured without underruns"""
+    for ppm in (200, -300):
+        estimate, underruns = simulate_drift(ppm, 900)
+        assert abs(estimate - ppm) < 10
+        assert underruns == 0
@@ -0,0 +1,111 @@
+""" Ogg page writer and recording segments """
+import struct
+import time
+import wave
+
+from mumblebridge.recorder import Recorder, OpusSegment, ogg_crc
+
+
+def bitwise_crc(data):
+    """Ogg checksum computed bit by bit"""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def ogg_pages(data):
+    """Split an Ogg stream into (header type, sequence, page bytes, packets)"""
+    pages = []
+    offset = 0
+    while offset < len(data):
+        assert data[offset : offset + 4] == b"OggS"
+        _, header_type, _, _, sequence, _, segments = struct.unpack_from("<BBqIIIB", data, offset + 4)
+        lacing = data[offset + 27 : offset + 27 + segments]
+        body = offset + 27 + segments
+        packets, packet = [], b""
+        for length in lacing:
+            packet += data[body : body + length]
+            body += length
+            if length < 255:
+                packets.append(packet)
+                packet = b""
+        pages.append((header_type, sequence, data[offset:body], packets))
+        offset = body
+    return pages
+
+
+def check_page_crc(page):
+    """True if the checksum of the page matches its content"""
+    stored = struct.unpack_from("<I", page, 22)[0]
+    return stored == ogg_crc(page[:22] + b"\x00" * 4 + page[26:])
+
+
+def test_ogg_crc():
+    """The table driven checksum matches the bit by bit definition"""
+    assert ogg_crc(b"") == 0
+    for data in (b"OggS", b"123456789", bytes(range(256)) * 3):
+        assert ogg_crc(data) == bitwise_crc(data)
+
+
+def test_opus_segment_pages(tmp_path):
+    """Head, tags and audio pages are in sequence with valid checksums and the last page ends the stream"""
+    path = str(tmp_path / "segment.opus")
+    segment = OpusSegment(path, "alice")
+    segment.write(b"\x00" * (OpusSegment.frame_samples * 2 * 300 + 100))
+    segment.close()
+    with open(path, "rb") as opus_file:
+        pages = ogg_pages(opus_file.read())
+    assert [sequence for _, sequence, _, _ in pages] == list(range(len(pages)))
+    assert all(check_page_crc(page) for _, _, page, _ in pages)
+    assert pages[0][0] == 0x02 and pages[0][3][0].startswith(b"OpusHead")
+    assert pages[-1][0] == 0x04
+    assert sum(len(packets) for _, _, _, packets in pages[2:]) == 301
+    tags = pages[1][3][0]
+    assert len(tags) == OpusSegment.tags_size and b"ARTIST=alice\x00" in tags
+
+
+def test_opus_segment_talker_change(tmp_path):
+    """A talker changed before closing rewrites the tags page in place"""
+    path = str(tmp_path / "segment.opus")
+    segment = OpusSegment(path, "alice")
+    segment.write(b"\x00" * OpusSegment.frame_samples * 2 * 10)
+    size = segment.size
+    segment.talker = "alice, bob"
+    segment.close()
+    with open(path, "rb") as opus_file:
+        data = opus_file.read()
+    pages = ogg_pages(data)
+    assert len(data) >= size
+    assert pages[1][1] == 1 and check_page_crc(pages[1][2])
+    assert b"ARTIST=alice, bob\x00" in pages[1][3][0]
+
+
+def wav_artist(path):
+    """Talker of the LIST INFO chunk of a WAV segment"""
+    with open(path, "rb") as wav_file:
+        data = wav_file.read()
+    offset = data.index(b"IART")
+    length = struct.unpack_from("<I", data, offset + 4)[0]
+    return data[offset + 8 : offset + 8 + length].rstrip(b"\x00").decode("utf-8")
+
+
+def test_recorder_spurts(tmp_path):
+    """Overlapping talkers share a segment, another talker after a silence starts a new one"""
+    recorder = Recorder(str(tmp_path / "{direction}-{user}"), spurt_gap=0.2, batch=0.05)
+    pcm = b"\x01\x00" * 960
+    for talker in ("alice", "bob", "alice+bob", "alice", "bob") * 10:
+        assert recorder.put("output", pcm, talker)
+    time.sleep(0.4)
+    recorder.put("output", pcm, "carol")
+    recorder.close()
+    assert recorder.segments == 2 and recorder.errors == 0
+    paths = sorted(tmp_path.glob("output-*.wav"), key=lambda path: path.stat().st_mtime)
+    assert len(paths) == 2
+    assert wav_artist(paths[0]) == "alice, bob"
+    assert paths[1].name == "output-carol.wav" and wav_artist(paths[1]) == "carol"
+    with wave.open(str(paths[0]), "rb") as wav_file:
+        assert wav_file.getnframes() == 50 * 960
@@ -0,0 +1,90 @@
+""" Configuration file watching """
+import json
+import os
+import time
+
+import pytest
+
+from mumblebridge import ConfigWatcher
+
+
+def wait_for(predicate, timeout=2):
+    """Wait until predicate() is true. Returns its last value"""
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture(name="polling", params=[False, True], ids=["inotify", "polling"])
+def fixture_polling(request, monkeypatch):
+    """Watch with inotify where available or by polling the modification time"""
+    if request.param:
+        monkeypatch.setattr(ConfigWatcher, "_ConfigWatcher__inotify_init", lambda self: None)
+    return request.param
+
+
+def watch(path, changes):
+    """Watcher loading the JSON file into changes"""
+
+    def load():
+        with open(path, encoding="utf-8") as config_file:
+            return json.load(config_file)
+
+    return ConfigWatcher(path, load, changes.append, settle=0.02, poll_interval=0.05)
+
+
+def write_config(path, config):
+    """Replace the configuration file with a rename like editors do"""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def test_change(tmp_path, polling):  # pylint: disable=unused-argument
+    """A replaced file is loaded and passed to on_change"""
+    path = str(tmp_path / "config.json")
+    write_config(path, {"audio_threshold": 1000})
+    changes = []
+    watcher = watch(path, changes)
+    try:
+        time.sleep(0.1)
+        write_config(path, {"audio_threshold": 500})
+        assert wait_for(lambda: changes)
+        assert changes[-1] == {"audio_threshold": 500}
+    finally:
+        watcher.close()
+
+
+def test_missing_file(tmp_path, polling):  # pylint: disable=unused-argument
+    """A file renamed away keeps the current configuration until it comes back"""
+    path = str(tmp_path / "config.json")
+    write_config(path, {"audio_threshold": 1000})
+    changes = []
+    watcher = watch(path, changes)
+    try:
+        time.sleep(0.1)
+        os.rename(path, f"{path}.old")
+        time.sleep(0.3)
+        assert not changes
+        write_config(path, {"audio_threshold": 500})
+        assert wait_for(lambda: changes)
+        assert changes == [{"audio_threshold": 500}]
+    finally:
+        watcher.close()
+
+
+def test_invalid_file(tmp_path, polling):  # pylint: disable=unused-argument
+    """A file that cannot be loaded is not applied"""
+    path = str(tmp_path / "config.json")
+    write_config(path, {"audio_threshold": 1000})
+    changes = []
+    watcher = watch(path, changes)
+    try:
+        time.sleep(0.1)
+        with open(path, "w", encoding="utf-8") as config_file:
+            config_file.write("{")
+        time.sleep(0.3)
+        assert not changes
+    finally:
+        watcher.close()
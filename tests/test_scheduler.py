@@ -0,0 +1,94 @@
+""" One-shot timers and hang periods """
+import threading
+import time
+
+import pytest
+
+from mumblebridge import Scheduler, Hang
+
+
+@pytest.fixture(name="scheduler")
+def fixture_scheduler():
+    """Scheduler running in its thread"""
+    scheduler = Scheduler()
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+
+
+def wait_for(predicate, timeout=2):
+    """Wait until predicate() is true. Returns its last value"""
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_order(scheduler):
+    """Timers fire in deadline order whatever the order they were added in"""
+    fired = []
+    scheduler.call_later(0.06, lambda: fired.append("late"))
+    scheduler.call_later(0.02, lambda: fired.append("early"))
+    assert wait_for(lambda: len(fired) == 2)
+    assert fired == ["early", "late"]
+
+
+def test_cancel(scheduler):
+    """A cancelled timer does not fire and does not delay the others"""
+    fired = []
+    scheduler.call_later(0.02, lambda: fired.append("cancelled")).cancel()
+    scheduler.call_later(0.04, lambda: fired.append("kept"))
+    assert wait_for(lambda: fired)
+    time.sleep(0.05)
+    assert fired == ["kept"]
+
+
+def test_failing_callback(scheduler):
+    """A failing callback does not stop the scheduler"""
+    fired = threading.Event()
+    scheduler.call_later(0.01, lambda: 1 / 0)
+    scheduler.call_later(0.02, fired.set)
+    assert fired.wait(2)
+
+
+def test_every(scheduler):
+    """Repeated timers fire until cancelled"""
+    ticks = []
+    handle = scheduler.every(0.01, lambda: ticks.append(time.monotonic()))
+    assert wait_for(lambda: len(ticks) >= 3)
+    handle.cancel()
+    time.sleep(0.03)
+    count = len(ticks)
+    time.sleep(0.05)
+    assert len(ticks) == count
+
+
+def test_hang(scheduler):
+    """on_expire is called once, hang seconds after the last touch"""
+    expired = []
+    hang = Hang(scheduler, 0.05, lambda: expired.append(time.monotonic()))
+    assert hang.touch()
+    assert not hang.touch()
+    for _ in range(10):
+        time.sleep(0.02)
+        hang.touch()
+    assert hang.active and not expired
+    assert wait_for(lambda: expired)
+    assert expired[0] >= hang.last + 0.05
+    assert not hang.active
+    time.sleep(0.1)
+    assert len(expired) == 1
+    assert hang.touch()
+
+
+def test_hang_cancel(scheduler):
+    """A cancelled hang does not expire and can be touched again"""
+    expired = []
+    hang = Hang(scheduler, 0.02, lambda: expired.append(True))
+    hang.touch()
+    hang.cancel()
+    assert not hang.active
+    time.sleep(0.05)
+    assert not expired
+    assert hang.touch()
+    assert wait_for(lambda: expired)
@@ -0,0 +1,65 @@
+""" DTMF and CTCSS detection """
+import numpy as np
+import pytest
+
+from benchmark import SAMPLERATE, noise, pushed_frames, speech, synthetic_audio, tone, tone_frames
+from mumblebridge import ToneDecoder
+
+
+def dtmf(key, seconds=0.1):
+    """DTMF digit"""
+    frequencies = {"1": (697, 1209), "5": (770, 1336), "9": (852, 1477), "#": (941, 1477)}[key]
+    return sum(tone(seconds, frequency, 4000) for frequency in frequencies)
+
+
+def test_dtmf_digit():
+    """Single digits are recognized, silence and a single tone are not"""
+    decoder = ToneDecoder()
+    for key in "159#":
+        assert decoder.dtmf_digit(dtmf(key, 0.02).astype(np.float32)) == key
+    assert decoder.dtmf_digit(noise(0.02).astype(np.float32)) is None
+    assert decoder.dtmf_digit(tone(0.02, 697, 4000).astype(np.float32)) is None
+
+
+@pytest.mark.parametrize("packet_length", [0.01, 0.02, 0.04, 0.06])
+def test_dtmf_command(packet_length):
+    """A command is decoded once whatever the packet length"""
+    commands = []
+    decoder = ToneDecoder(commands={"*12#": "status"}, on_command=commands.append)
+    for _ in pushed_frames(decoder, synthetic_audio(2), packet_length):
+        pass
+    assert commands == ["status"]
+
+
+def test_dtmf_held_digit():
+    """A held digit counts once"""
+    decoder = ToneDecoder(commands={"55": "status"})
+    for _ in pushed_frames(decoder, np.concatenate((dtmf("5", 1), noise(0.1)))):
+        pass
+    assert decoder.sequence == "5"
+
+
+@pytest.mark.parametrize("ctcss_tone", [100.0, 136.5])
+def test_ctcss_voice(ctcss_tone):
+    """Voice pitch moving across the tone frequency does not open the squelch"""
+    assert tone_frames(ctcss_tone, speech(20) + noise(20)).mean() < 0.01
+
+
+def test_ctcss_tone():
+    """The tone is seen alone and most of the time under voice 20 dB louder"""
+    assert tone_frames(100.0, tone(5, 100.0) + noise(5)).all()
+    assert tone_frames(100.0, tone(20, 100.0) + speech(20) + noise(20)).mean() > 0.5
+
+
+def test_ctcss_other_tone():
+    """A neighbouring CTCSS tone does not open the squelch"""
+    assert not tone_frames(100.0, tone(5, 103.5) + noise(5)).any()
+
+
+def test_ctcss_hang():
+    """The squelch closes hang seconds after the tone stops"""
+    decoder = ToneDecoder(100.0, hang=0.3)
+    present = [decoder.tone_present for _ in pushed_frames(decoder, np.concatenate((tone(3, 100.0), noise(2))) + noise(5))]
+    stop = 3 * SAMPLERATE // 960
+    assert present[stop - 1]
+    assert not present[stop + 40]